@@ -0,0 +1,657 @@
+#!/usr/bin/env python3
+"""
+build_clonezilla.py - Build HardClone Live on top of Clonezilla as resumable stages
+
+Stages: fetch, extract, unsquash, inject, resquash, master. Each stage records
+a key derived from its inputs and the key of the stage before it; a rerun
+skips every stage whose key still matches and resumes from the first one
+that does not.
+"""
+
+import os
+import sys
+import subprocess
+import shutil
+import hashlib
+import re
+import time
+import urllib.request
+from datetime import datetime
+from pathlib import Path
+import json
+import logging
+from typing import List, Dict, Optional
+import argparse
+
+# Setup logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+class Colors:
+    RED = '\033[0;31m'
+    GREEN = '\033[0;32m'
+    YELLOW = '\033[1;33m'
+    BLUE = '\033[0;34m'
+    NC = '\033[0m'  # No Color
+
+STAGES = ["fetch", "extract", "unsquash", "inject", "resquash", "master"]
+
+# Files of the original ISO the build replaces or adds (ISO paths)
+LAYER_NAME = "hardclone.squashfs"
+PATCH_FILES = [
+    "live/filesystem.squashfs",
+    "live/filesystem.module",
+    f"live/{LAYER_NAME}",
+    "isolinux/isolinux.cfg",
+    "boot/grub/grub.cfg",
+]
+
+# Files of the base image the delta layer appends to
+DELTA_BASE_FILES = ["etc/rc.local", "etc/bash.bashrc"]
+
+HARDCLONE_CLI_REPO = "https://github.com/dawciobiel/hardclone-cli.git"
+HARDCLONE_GUI_REPO = "https://github.com/dawciobiel/hardclone-gui.git"
+
+FIRST_BOOT_SETUP = """#!/bin/bash
+# First boot setup script
+if [ ! -f /var/log/hardclone-setup-done ]; then
+    echo "HardClone: Installing additional packages..."
+    apt update
+    apt install -y python3-pip python3-venv python3-dialog git xxd fish
+
+    # Mark as done
+    touch /var/log/hardclone-setup-done
+    echo "HardClone: Setup completed"
+fi
+"""
+
+NETWORK_SETUP = """#!/bin/bash
+# Auto-start network and update packages
+sleep 5
+dhclient eth0 2>/dev/null || dhclient 2>/dev/null &
+sleep 10
+apt update &
+"""
+
+CLI_DESKTOP = """[Desktop Entry]
+Version=1.0
+Type=Application
+Name=HardClone CLI
+Comment=Command line backup tool
+Exec=/opt/hardclone-cli/hardclone
+Icon=utilities-terminal
+Terminal=true
+Categories=System;
+"""
+
+GUI_DESKTOP = """[Desktop Entry]
+Version=1.0
+Type=Application
+Name=HardClone GUI
+Comment=Graphical backup tool
+Exec=/opt/hardclone-gui/hardclone-gui
+Icon=drive-harddisk
+Terminal=false
+Categories=System;
+"""
+
+# (path, line) pairs appended to files of the base image, once
+APPENDED_LINES = [
+    ("etc/rc.local", "/usr/local/bin/network-setup.sh &"),
+    ("etc/bash.bashrc", "/usr/local/bin/network-setup.sh &"),
+    ("etc/bash.bashrc", 'export PATH="/opt/hardclone-cli:/opt/hardclone-gui:$PATH"'),
+]
+
+
+class StageError(Exception):
+    """A build stage failed"""
+
+
+class ClonezillaBuilder:
+    def __init__(self, work_dir: str = "/workspace"):
+        self.work_dir = Path(work_dir).resolve()
+        self.build_dir = self.work_dir / "clonezilla-custom"
+        self.state_file = self.build_dir / "stages.json"
+        self.iso_name = f"hardclone-live-{datetime.now():%Y%m%d}.iso"
+        self.volume_id = "HARDCLONE-LIVE"
+
+        # Clonezilla download cache (kept between builds, keyed by version)
+        self.base_url = os.environ.get(
+            "CLONEZILLA_BASE_URL",
+            "https://sourceforge.net/projects/clonezilla/files/clonezilla_live_stable")
+        self.cache_dir = Path(os.environ.get("CACHE_DIR", self.work_dir / ".cache" / "clonezilla"))
+        self.version_ttl = int(os.environ.get("VERSION_TTL", 21600))
+        self.version = os.environ.get("CLONEZILLA_VERSION", "")
+
+        # full  - unpack filesystem.squashfs, customize it and recompress the whole tree
+        # delta - leave filesystem.squashfs untouched and put only our additions into
+        #         live/hardclone.squashfs, which live-boot stacks on top of it at boot
+        self.customize_mode = os.environ.get("CUSTOMIZE_MODE", "full")
+        # remaster - extract the whole ISO and build a new one from the tree
+        # patch    - extract only the files we change and let xorriso write a new
+        #            ISO from the original one, replacing just those files and
+        #            replaying its boot catalog and El Torito images as they are
+        self.iso_mode = os.environ.get("ISO_MODE", "remaster")
+        self.squashfs_options = ["-comp", "xz", "-Xbcj", "x86"]
+        # mksquashfs sort file from scripts/boot_trace.py, puts the boot
+        # working set at the front of filesystem.squashfs
+        self.sort_file: Optional[Path] = None
+
+        self.force_from: Optional[str] = None
+        self.timings: List[Dict] = []
+
+    def print_colored(self, message: str, color: str = Colors.NC) -> None:
+        """Print colored message"""
+        print(f"{color}{message}{Colors.NC}", flush=True)
+
+    def run(self, cmd: List[str], cwd: Optional[Path] = None, check: bool = True) -> subprocess.CompletedProcess:
+        """Run a command with output going to the console"""
+        logger.debug(f"Running: {' '.join(str(c) for c in cmd)}")
+        result = subprocess.run([str(c) for c in cmd], cwd=cwd)
+        if check and result.returncode != 0:
+            raise StageError(f"{Path(str(cmd[0])).name} exited with code {result.returncode}")
+        return result
+
+    @property
+    def iso_path(self) -> Path:
+        return self.cache_dir / f"clonezilla-live-{self.version}-amd64.iso"
+
+    @property
+    def extract_dir(self) -> Path:
+        return self.build_dir / "iso-extract"
+
+    @property
+    def rootfs_dir(self) -> Path:
+        return self.build_dir / ("hardclone-layer" if self.customize_mode == "delta" else "squashfs-root")
+
+    @property
+    def overlay_dir(self) -> Path:
+        """Replaced and added ISO files, laid out by their ISO path"""
+        return self.build_dir / "overlay"
+
+    # --- Clonezilla download --------------------------------------------
+
+    def resolve_version(self) -> str:
+        """Latest Clonezilla version, cached for version_ttl and falling back
+        to the newest cached ISO when offline"""
+        if self.version:
+            return self.version
+
+        version_file = self.cache_dir / "latest-version"
+        if version_file.exists() and time.time() - version_file.stat().st_mtime < self.version_ttl:
+            return version_file.read_text().strip()
+
+        try:
+            with urllib.request.urlopen(f"{self.base_url}/", timeout=30) as response:
+                page = response.read().decode(errors="replace")
+            match = re.search(r'href="/projects/clonezilla/files/clonezilla_live_stable/([0-9][^/"]*)', page)
+            if match:
+                self.cache_dir.mkdir(parents=True, exist_ok=True)
+                version_file.write_text(match.group(1) + "\n")
+                return match.group(1)
+        except OSError as e:
+            logger.warning(f"Version lookup failed: {e}")
+
+        self.print_colored("Version lookup failed, using cached ISO", Colors.YELLOW)
+        # The last looked up version only helps if its ISO was downloaded too
+        if version_file.exists():
+            latest = version_file.read_text().strip()
+            if (self.cache_dir / f"clonezilla-live-{latest}-amd64.iso").exists():
+                return latest
+        cached = sorted(self.cache_dir.glob("clonezilla-live-*-amd64.iso"),
+                        key=lambda p: [int(n) for n in re.findall(r"\d+", p.name)])
+        if cached:
+            return cached[-1].name[len("clonezilla-live-"):-len("-amd64.iso")]
+        return ""
+
+    def expected_sha256(self) -> str:
+        """Published SHA256 of the ISO (empty if unavailable)"""
+        checksums = self.cache_dir / f"CHECKSUMS-{self.version}.txt"
+        if not checksums.exists() or checksums.stat().st_size == 0:
+            try:
+                with urllib.request.urlopen(f"{self.base_url}/{self.version}/CHECKSUMS.TXT/download",
+                                            timeout=60) as response:
+                    checksums.write_bytes(response.read())
+            except OSError as e:
+                logger.warning(f"Cannot download CHECKSUMS.TXT: {e}")
+                return ""
+
+        for line in checksums.read_text(errors="replace").splitlines():
+            fields = line.split()
+            if len(fields) >= 2 and fields[1] == self.iso_path.name and len(fields[0]) == 64:
+                return fields[0]
+        return ""
+
+    def fetch_iso(self) -> None:
+        """Make sure a verified ISO of this version is in the cache"""
+        iso_path = self.iso_path
+        if iso_path.exists():
+            self.print_colored(f"Using cached {iso_path.name}", Colors.YELLOW)
+            return
+
+        part = iso_path.with_name(iso_path.name + ".part")
+        url = f"{self.base_url}/{self.version}/{iso_path.name}/download"
+        sha256 = self.expected_sha256()
+        for attempt in (1, 2):
+            self.print_colored(f"Downloading {iso_path.name} (attempt {attempt})...", Colors.YELLOW)
+            # -C - resumes a partial download left by an interrupted build
+            if self.run(["curl", "-fL", "--retry", "3", "-C", "-", "-o", part, url],
+                        check=False).returncode != 0:
+                self.print_colored("Resume failed, restarting download", Colors.YELLOW)
+                part.unlink(missing_ok=True)
+                self.run(["curl", "-fL", "--retry", "3", "-o", part, url])
+
+            if not sha256:
+                self.print_colored(f"WARNING: no published checksum for {iso_path.name}, not verified",
+                                   Colors.YELLOW)
+                break
+            digest = hashlib.sha256()
+            with open(part, "rb") as f:
+                for block in iter(lambda: f.read(1024 * 1024), b""):
+                    digest.update(block)
+            if digest.hexdigest() == sha256:
+                self.print_colored("Checksum OK", Colors.GREEN)
+                break
+            self.print_colored("Checksum mismatch, discarding download", Colors.RED)
+            part.unlink()
+            if attempt == 2:
+                raise StageError(f"{iso_path.name} does not match its published checksum")
+        part.rename(iso_path)
+
+    # --- Stage checkpoints ----------------------------------------------
+
+    def load_state(self) -> Dict[str, Dict]:
+        """Load the recorded stage keys"""
+        if self.state_file.exists():
+            try:
+                return json.loads(self.state_file.read_text())
+            except json.JSONDecodeError:
+                logger.warning("Stage state is corrupt, rebuilding all stages")
+        return {}
+
+    def save_state(self, state: Dict[str, Dict]) -> None:
+        """Write the stage keys atomically"""
+        tmp_file = self.state_file.with_suffix(".tmp")
+        tmp_file.write_text(json.dumps(state, indent=2))
+        tmp_file.replace(self.state_file)
+
+    def get_remote_head(self, repo: str, recorded: str = "") -> str:
+        """Commit the default branch of a repository points to, or the
+        recorded one when the remote cannot be reached (offline rebuilds)"""
+        try:
+            result = subprocess.run(["git", "ls-remote", repo, "HEAD"],
+                                    capture_output=True, text=True, timeout=60)
+            if result.returncode == 0 and result.stdout:
+                return result.stdout.split()[0]
+        except (OSError, subprocess.SubprocessError):
+            pass
+        if recorded:
+            logger.warning(f"Cannot reach {repo}, assuming it is still at {recorded[:12]}")
+            return recorded
+        return "unknown"
+
+    def get_stage_inputs(self, stage: str) -> Dict:
+        """Inputs of a stage besides the stages before it"""
+        if stage == "fetch":
+            return {"version": self.version, "iso": self.iso_path.name}
+        if stage == "extract":
+            stat = self.iso_path.stat()
+            return {"size": stat.st_size, "mtime": int(stat.st_mtime), "iso_mode": self.iso_mode}
+        if stage == "unsquash":
+            return {"customize_mode": self.customize_mode}
+        if stage == "inject":
+            payload = json.dumps([FIRST_BOOT_SETUP, NETWORK_SETUP, CLI_DESKTOP, GUI_DESKTOP,
+                                  APPENDED_LINES])
+            recorded = self.load_state().get("inject", {}).get("inputs", {})
+            return {
+                "cli": self.get_remote_head(HARDCLONE_CLI_REPO, recorded.get("cli", "")),
+                "gui": self.get_remote_head(HARDCLONE_GUI_REPO, recorded.get("gui", "")),
+                "payload": hashlib.sha256(payload.encode()).hexdigest(),
+            }
+        if stage == "resquash":
+            inputs = {"options": self.squashfs_options}
+            if self.sort_file:
+                inputs["sort"] = hashlib.sha256(self.sort_file.read_bytes()).hexdigest()
+            return inputs
+        if stage == "master":
+            return {"iso_name": self.iso_name, "volume_id": self.volume_id}
+        return {}
+
+    def stage_outputs_exist(self, stage: str) -> bool:
+        """Check a stage's output is still on disk"""
+        if stage == "fetch":
+            return self.iso_path.exists()
+        if stage == "extract":
+            return (self.extract_dir / "live").is_dir()
+        if stage in ("unsquash", "inject"):
+            return self.rootfs_dir.is_dir()
+        if stage == "resquash":
+            name = LAYER_NAME if self.customize_mode == "delta" else "filesystem.squashfs"
+            return (self.overlay_dir / "live" / name).exists()
+        if stage == "master":
+            return (self.work_dir / self.iso_name).exists()
+        return False
+
+    # --- Stages ---------------------------------------------------------
+
+    def stage_fetch(self) -> None:
+        """Download and verify the Clonezilla ISO"""
+        self.fetch_iso()
+
+    def stage_extract(self) -> None:
+        """Extract the ISO, or only the files we change in patch mode"""
+        shutil.rmtree(self.extract_dir, ignore_errors=True)
+        self.extract_dir.mkdir(parents=True)
+        if self.iso_mode == "patch":
+            # Files missing from this Clonezilla release are simply skipped
+            for path in PATCH_FILES:
+                subprocess.run(["xorriso", "-osirrox", "on", "-indev", str(self.iso_path),
+                                "-extract", f"/{path}", str(self.extract_dir / path)],
+                               capture_output=True)
+            self.run(["chmod", "-R", "u+w", self.extract_dir])
+        else:
+            self.run(["7z", "x", self.iso_path, f"-o{self.extract_dir}"])
+
+    def stage_unsquash(self) -> None:
+        """Unpack the root filesystem (only the files we append to in delta mode)"""
+        squashfs = self.extract_dir / "live" / "filesystem.squashfs"
+        shutil.rmtree(self.build_dir / "squashfs-root", ignore_errors=True)
+        shutil.rmtree(self.build_dir / "hardclone-layer", ignore_errors=True)
+        if self.customize_mode == "delta":
+            self.run(["unsquashfs", "-d", self.rootfs_dir, squashfs, *DELTA_BASE_FILES], check=False)
+            self.rootfs_dir.mkdir(exist_ok=True)
+        else:
+            self.run(["unsquashfs", "-d", self.rootfs_dir, squashfs])
+
+    def stage_inject(self) -> None:
+        """Add the HardClone applications and configuration to the root filesystem
+
+        Safe to rerun on the same tree, so a changed application commit
+        does not require unpacking the base image again.
+        """
+        rootfs = self.rootfs_dir
+
+        self.print_colored("Downloading HardClone applications...", Colors.YELLOW)
+        for repo, name in ((HARDCLONE_CLI_REPO, "hardclone-cli"), (HARDCLONE_GUI_REPO, "hardclone-gui")):
+            target = rootfs / "opt" / name
+            shutil.rmtree(target, ignore_errors=True)
+            self.run(["git", "clone", repo, target])
+            for path in target.iterdir():
+                if path.is_file():
+                    path.chmod(path.stat().st_mode | 0o111)
+
+        (rootfs / "usr/local/bin").mkdir(parents=True, exist_ok=True)
+        (rootfs / "var/log").mkdir(parents=True, exist_ok=True)
+        for name, content in (("first-boot-setup.sh", FIRST_BOOT_SETUP),
+                              ("network-setup.sh", NETWORK_SETUP)):
+            script = rootfs / "usr/local/bin" / name
+            script.write_text(content)
+            script.chmod(0o755)
+
+        desktop = rootfs / "home/user/Desktop"
+        desktop.mkdir(parents=True, exist_ok=True)
+        for name, content in (("HardClone-CLI.desktop", CLI_DESKTOP),
+                              ("HardClone-GUI.desktop", GUI_DESKTOP)):
+            (desktop / name).write_text(content)
+            (desktop / name).chmod(0o755)
+
+        for path, line in APPENDED_LINES:
+            target = rootfs / path
+            target.parent.mkdir(parents=True, exist_ok=True)
+            text = target.read_text() if target.exists() else ""
+            if line not in text.splitlines():
+                if text and not text.endswith("\n"):
+                    text += "\n"
+                target.write_text(text + line + "\n")
+
+        # Custom branding
+        (rootfs / "etc/motd").write_text("HardClone Live - Custom Clonezilla Distribution\n")
+
+    def stage_resquash(self) -> None:
+        """Pack the root filesystem (or the delta layer) into the overlay"""
+        live = self.overlay_dir / "live"
+        shutil.rmtree(self.overlay_dir, ignore_errors=True)
+        live.mkdir(parents=True)
+
+        if self.customize_mode == "delta":
+            output = live / LAYER_NAME
+            # live-boot mounts the images listed here in order, later ones on top
+            module_file = self.extract_dir / "live" / "filesystem.module"
+            modules = module_file.read_text().split() if module_file.exists() else ["filesystem.squashfs"]
+            if LAYER_NAME not in modules:
+                modules.append(LAYER_NAME)
+            (live / "filesystem.module").write_text("\n".join(modules) + "\n")
+        else:
+            output = live / "filesystem.squashfs"
+
+        options = list(self.squashfs_options)
+        if self.sort_file and self.customize_mode != "delta":
+            # The delta layer holds only our own files, boot order is about the base
+            options += ["-sort", self.sort_file]
+        part = output.with_name(output.name + ".part")
+        self.run(["mksquashfs", self.rootfs_dir, part, *options, "-noappend"])
+        part.rename(output)
+
+    def write_boot_configs(self) -> None:
+        """Rebrand the bootloader menus into the overlay"""
+        for path, old, new in (("isolinux/isolinux.cfg", "Clonezilla live", "HardClone Live"),
+                               ("boot/grub/grub.cfg", "Clonezilla", "HardClone")):
+            source = self.extract_dir / path
+            if source.exists():
+                target = self.overlay_dir / path
+                target.parent.mkdir(parents=True, exist_ok=True)
+                target.write_text(source.read_text(errors="surrogateescape").replace(old, new),
+                                  errors="surrogateescape")
+
+    def overlay_files(self) -> List[str]:
+        """ISO paths present in the overlay"""
+        return [path for path in PATCH_FILES if (self.overlay_dir / path).exists()]
+
+    def stage_master(self) -> None:
+        """Write the final ISO"""
+        self.write_boot_configs()
+        output = self.build_dir / self.iso_name
+        output.unlink(missing_ok=True)
+
+        if self.iso_mode == "patch":
+            # Write a new ISO from the original, mapping in only the changed files;
+            # everything else is copied straight from the input image
+            self.print_colored("Patching ISO...", Colors.YELLOW)
+            copied = 0
+            map_args = []
+            for path in self.overlay_files():
+                map_args += ["-map", self.overlay_dir / path, f"/{path}"]
+                copied += (self.overlay_dir / path).stat().st_size
+            self.run(["xorriso", "-indev", self.iso_path, "-outdev", output,
+                      "-boot_image", "any", "replay", "-volid", self.volume_id, *map_args])
+            total = output.stat().st_size
+            self.print_colored(f"Copied from build tree: {copied / (1024*1024):.1f} MB", Colors.YELLOW)
+            self.print_colored(f"Reused from original ISO: {(total - copied) / (1024*1024):.1f} MB",
+                               Colors.YELLOW)
+        else:
+            self.remaster(output)
+
+        output.rename(self.work_dir / self.iso_name)
+
+    def remaster(self, output: Path) -> None:
+        """Build a new ISO from the extracted tree with the overlay applied"""
+        # Hard links keep iso-extract pristine for later reruns
+        tree = self.build_dir / "iso-root"
+        shutil.rmtree(tree, ignore_errors=True)
+        self.run(["cp", "-al", self.extract_dir, tree])
+        for path in self.overlay_files():
+            (tree / path).unlink(missing_ok=True)
+            try:
+                os.link(self.overlay_dir / path, tree / path)  # xorriso only reads the tree
+            except OSError:
+                shutil.copy2(self.overlay_dir / path, tree / path)
+
+        try:
+            isolinux_bin = next(tree.rglob("isolinux.bin"), None)
+            efi_img = next(tree.rglob("efi.img"), None) or next(tree.rglob("*.efi"), None)
+            self.print_colored(f"Found isolinux.bin at: {isolinux_bin}", Colors.YELLOW)
+            self.print_colored(f"Found EFI image at: {efi_img}", Colors.YELLOW)
+
+            cmd = ["xorriso", "-as", "mkisofs", "-r", "-V", self.volume_id, "-J", "-l"]
+            if isolinux_bin and efi_img:
+                isolinux_bin = isolinux_bin.relative_to(tree)
+                cmd += [
+                    "-b", isolinux_bin,
+                    "-c", isolinux_bin.parent / "boot.cat",
+                    "-no-emul-boot", "-boot-load-size", "4", "-boot-info-table",
+                    "-eltorito-alt-boot",
+                    "-e", efi_img.relative_to(tree),
+                    "-no-emul-boot", "-isohybrid-gpt-basdat",
+                ]
+            else:
+                self.print_colored("Boot files not found, creating basic ISO...", Colors.YELLOW)
+            self.run([*cmd, "-o", output, "."], cwd=tree)
+        finally:
+            shutil.rmtree(tree, ignore_errors=True)
+
+    # --- Orchestration --------------------------------------------------
+
+    def show_status(self) -> None:
+        """Print the recorded state of each stage"""
+        state = self.load_state()
+        self.print_colored("\n=== Stage checkpoints ===", Colors.BLUE)
+        for stage in STAGES:
+            entry = state.get(stage)
+            if entry:
+                print(f"{stage:<10} {entry['key'][:12]}  {entry['seconds']:>8.1f}s  {entry['finished']}")
+            else:
+                print(f"{stage:<10} {'-':<12}")
+
+    def print_timings(self) -> None:
+        """Print per-stage timing table"""
+        total = sum(t["seconds"] for t in self.timings) or 1
+        self.print_colored("\n=== Stage timings ===", Colors.BLUE)
+        print(f"{'Stage':<10} {'Status':<8} {'Wall (s)':>10} {'Share':>7}")
+        for t in self.timings:
+            print(f"{t['stage']:<10} {t['status']:<8} {t['seconds']:>10.1f} {t['seconds'] / total:>7.1%}")
+        print(f"{'total':<10} {'':<8} {total:>10.1f}")
+
+    def build(self) -> bool:
+        """Run the stages, resuming from the first one whose inputs changed"""
+        self.print_colored("\n=== Building HardClone Live ISO ===", Colors.GREEN)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.build_dir.mkdir(parents=True, exist_ok=True)
+
+        self.version = self.resolve_version()
+        if not self.version:
+            self.print_colored("ERROR: Cannot determine Clonezilla version and no ISO is cached",
+                               Colors.RED)
+            return False
+        self.print_colored(f"Clonezilla version: {self.version}", Colors.YELLOW)
+
+        state = self.load_state()
+        previous_key = ""
+        resumed = False
+        for stage in STAGES:
+            started = time.monotonic()
+            # Earlier stages have run by now, so their outputs can be inspected
+            inputs = self.get_stage_inputs(stage)
+            key = hashlib.sha256(json.dumps([previous_key, inputs],
+                                            sort_keys=True).encode()).hexdigest()
+            previous_key = key
+
+            if (not resumed and stage != self.force_from and state.get(stage, {}).get("key") == key
+                    and self.stage_outputs_exist(stage)):
+                self.print_colored(f"[{stage}] up to date ({key[:12]})", Colors.GREEN)
+                self.timings.append({"stage": stage, "status": "cached",
+                                     "seconds": time.monotonic() - started})
+                continue
+
+            # Everything after the first rebuilt stage is rebuilt too
+            resumed = True
+            self.print_colored(f"\n=== [{stage}] ===", Colors.BLUE)
+            try:
+                getattr(self, f"stage_{stage}")()
+            except (StageError, OSError, subprocess.SubprocessError) as e:
+                self.timings.append({"stage": stage, "status": "failed",
+                                     "seconds": time.monotonic() - started})
+                self.print_colored(f"[{stage}] failed: {e}", Colors.RED)
+                self.print_colored("Rerun to resume from this stage", Colors.YELLOW)
+                state.pop(stage, None)
+                self.save_state(state)
+                return False
+
+            seconds = time.monotonic() - started
+            state[stage] = {"key": key, "inputs": inputs, "seconds": round(seconds, 3),
+                            "finished": datetime.now().isoformat(timespec="seconds")}
+            self.save_state(state)
+            self.timings.append({"stage": stage, "status": "built", "seconds": seconds})
+            self.print_colored(f"[{stage}] done in {seconds:.1f}s", Colors.GREEN)
+
+        self.print_colored("\nBuild completed successfully!", Colors.GREEN)
+        self.print_colored(f"ISO created: {self.work_dir / self.iso_name}", Colors.YELLOW)
+        return True
+
+    def clean(self) -> None:
+        """Remove all stage checkpoints"""
+        shutil.rmtree(self.build_dir, ignore_errors=True)
+        self.print_colored(f"Removed {self.build_dir}", Colors.GREEN)
+
+
+def main():
+    """Main function"""
+    parser = argparse.ArgumentParser(description="Build HardClone Live on top of Clonezilla")
+    parser.add_argument("--work-dir", default="/workspace",
+                        help="Directory for checkpoints and the finished ISO (default: /workspace)")
+    parser.add_argument("--customize-mode", choices=["full", "delta"],
+                        help="full: rebuild filesystem.squashfs, delta: add a layer on top "
+                             "(default: $CUSTOMIZE_MODE or full)")
+    parser.add_argument("--iso-mode", choices=["remaster", "patch"],
+                        help="remaster: rebuild the ISO from an extracted tree, patch: rewrite "
+                             "only changed files (default: $ISO_MODE or remaster)")
+    parser.add_argument("--sort-file", metavar="FILE",
+                        help="mksquashfs sort file from scripts/boot_trace.py "
+                             "(default: $SQUASHFS_SORT, full mode only)")
+    parser.add_argument("--from", dest="force_from", choices=STAGES, metavar="STAGE",
+                        help=f"Rebuild from this stage even if it is up to date ({', '.join(STAGES)})")
+    parser.add_argument("--status", action="store_true",
+                        help="Show stage checkpoints and exit")
+    parser.add_argument("--clean", action="store_true",
+                        help="Remove stage checkpoints after a successful build")
+    parser.add_argument("--clean-only", action="store_true",
+                        help="Remove stage checkpoints and exit")
+    parser.add_argument("--print-version", action="store_true",
+                        help="Print the Clonezilla version a build would use and exit")
+
+    args = parser.parse_args()
+
+    builder = ClonezillaBuilder(args.work_dir)
+    if args.customize_mode:
+        builder.customize_mode = args.customize_mode
+    if args.iso_mode:
+        builder.iso_mode = args.iso_mode
+    builder.force_from = args.force_from
+    sort_file = args.sort_file or os.environ.get("SQUASHFS_SORT")
+    if sort_file:
+        builder.sort_file = Path(sort_file).resolve()
+
+    if args.status:
+        builder.show_status()
+        return
+
+    if args.clean_only:
+        builder.clean()
+        return
+
+    if args.print_version:
+        version = builder.resolve_version()
+        print(version)
+        sys.exit(0 if version else 1)
+
+    success = builder.build()
+    builder.print_timings()
+    if success and args.clean:
+        builder.clean()
+    sys.exit(0 if success else 1)
+
+
+if __name__ == "__main__":
+    main()
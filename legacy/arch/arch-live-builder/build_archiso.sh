@@ -30,11 +30,23 @@ fi
 # --save-config plik.json - zapisz konfigurację
 # --load-config plik.json - wczytaj konfigurację
 # --build - zbuduj ISO (domyślnie)
+# --verbose - pełne wyjście kontenera zamiast linii postępu (pełny log zawsze w <projekt>/logs/build.log.gz)
+# --warm - buduje w długo żyjącym kontenerze (docker exec), --warm-max-builds N, --stop-warm
+# --dev - szybki profil deweloperski (zstd -1, tylko BIOS, osobny katalog roboczy), porównanie z buildem release
+# --matrix cli.json kde.json --jobs 2 - buduje kilka konfiguracji równolegle na wspólnej bazie rootfs
+# --profile - tabela czasów poszczególnych faz (raport JSON zawsze w build-profile-*.json)
+# --squashfs-sort boot-order.sort - układa airootfs.sfs w kolejności odczytu przy starcie (scripts/boot_trace.py)
 #
 # Cache:
 # --cache-info - pokazuje informacje o cache (rozmiar, ilość paczek)
 # --clean-cache - czyści cache paczek
 # --clean-work - czyści katalog roboczy
+# --no-build-cache - buduje od nowa, nawet gdy wejścia (pakiety, skrypty, Dockerfile) się nie zmieniły
+# --prefetch - pobiera brakujące paczki równolegle przed budowaniem (--prefetch-workers N)
+# --prefetch-only - tylko pobiera paczki do cache (--mirror URL/katalog z $repo i $arch)
+# --cache-max-size 20G - usuwa najdawniej używane paczki powyżej limitu
+# --cache-keep-versions N - zostawia N ostatnio używanych wersji każdej paczki
+# --prune-cache - stosuje limity cache od razu
 # show_cache_info() - automatycznie pokazuje info o cache przed i po buildzie
 
 
@@ -7,10 +7,24 @@ import os
 import sys
 import subprocess
 import shutil
+import hashlib
+import fcntl
+import gzip
+import re
+import resource
+import tarfile
+import tempfile
+import time
+import http.client
+import urllib.request
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
 from pathlib import Path
 import json
 import logging
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Set
 import argparse
 
 # Setup logging
@@ -27,6 +41,304 @@ class Colors:
     BLUE = '\033[0;34m'
     NC = '\033[0m'  # No Color
 
+# mkarchiso _run_once stages in execution order, with the build input groups
+# each stage consumes (directly or through the airootfs of earlier stages).
+# A stage is rebuilt only when one of its groups changed. Names are marker
+# prefixes: _make_bootmode_ covers one _make_bootmode_<mode> per boot mode.
+ARCHISO_STAGES = [
+    ("_make_pacman_conf", ("profile",)),
+    ("_make_custom_airootfs", ("profile", "airootfs")),
+    ("_make_packages", ("profile", "packages")),
+    ("_make_version", ("profile",)),
+    ("_make_customize_airootfs", ("profile", "packages", "airootfs")),
+    ("_make_pkglist", ("profile", "packages")),
+    ("_make_bootmode_", ("profile", "packages")),
+    ("_make_boot_on_iso9660", ("profile", "packages")),
+    ("_cleanup_pacstrap_dir", ("profile", "packages", "airootfs")),
+    ("_prepare_airootfs_image", ("profile", "packages", "airootfs", "squashfs")),
+    ("_build_iso_image", ("profile", "packages", "airootfs", "squashfs")),
+]
+
+# Linux limit for one argv string; the build script is passed as one (bash -c)
+MAX_ARG_STRLEN = 128 * 1024
+
+# Stages that need a freshly pacstrapped airootfs. _cleanup_pacstrap_dir
+# empties /boot and the pacman database, so rerunning any of these means
+# starting the work directory over.
+ARCHISO_ROOTFS_STAGES = {"_make_packages", "_make_bootmode_", "_make_boot_on_iso9660"}
+
+# Lines in the container output that start a new build phase. mkarchiso -v
+# prints one INFO line per stage, the rest are echoes from our build script.
+PHASE_MARKERS = [
+    (re.compile(r"=== Invalidating stale stages ==="), "stage_invalidation"),
+    (re.compile(r"=== Configuring archiso ==="), "profile_setup"),
+    (re.compile(r"=== Building ISO ==="), "mkarchiso_setup"),
+    (re.compile(r"INFO: Copying custom airootfs"), "custom_airootfs"),
+    (re.compile(r"INFO: Installing packages"), "pacstrap"),
+    (re.compile(r"INFO: Creating version files"), "version_files"),
+    (re.compile(r"INFO: Running customize_airootfs"), "customize_airootfs"),
+    (re.compile(r"INFO: Creating a list of installed packages"), "pkglist"),
+    (re.compile(r"INFO: (Setting up|Preparing an /EFI|Preparing a FAT image)"), "bootloaders"),
+    (re.compile(r"INFO: Cleaning up in pacstrap"), "cleanup"),
+    (re.compile(r"INFO: Creating SquashFS image"), "squashfs"),
+    (re.compile(r"INFO: Creating checksum"), "checksum"),
+    (re.compile(r"INFO: Creating ISO image"), "iso_image"),
+    (re.compile(r"=== Done! ==="), "finish"),
+]
+
+class BuildProfiler:
+    """Collect wall time, CPU time and bytes written per build phase
+
+    Container phases are read from the container's cgroup and are exact.
+    Host phases are approximations, see sample_process.
+    """
+
+    # Written into the report next to the numbers
+    COUNTER_NOTES = {
+        "container": "cgroup cpu.stat/io.stat of the build container",
+        "host": "this process and its finished children only; work done by the docker "
+                "daemon (image builds) is missing, and during matrix builds each variant's "
+                "host phases include the CPU of the others running in this process",
+    }
+
+    def __init__(self):
+        self.phases: List[Dict] = []
+        self.current: Optional[Dict] = None
+        self.cgroup_dir: Optional[Path] = None
+        self.container_sample = (0.0, 0)
+        self.container_sampled_at = 0.0
+
+    def sample_process(self) -> tuple:
+        """CPU seconds and bytes written by this process and its children
+
+        Children are only counted once they have been waited for. The
+        docker daemon is not a child, so docker build/pull work is not
+        counted, and with several builds in one process (matrix) the
+        threads' usage cannot be told apart.
+        """
+        cpu = 0.0
+        for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+            usage = resource.getrusage(who)
+            cpu += usage.ru_utime + usage.ru_stime
+        written = 0
+        try:
+            for line in Path("/proc/self/io").read_text().splitlines():
+                if line.startswith("write_bytes:"):
+                    written = int(line.split()[1])
+        except OSError:
+            pass
+        return cpu, written
+
+    def attach_container(self, container_id: str) -> None:
+        """Locate the cgroup v2 directory of a running container"""
+        try:
+            pid = subprocess.run(
+                ["docker", "inspect", "-f", "{{.State.Pid}}", container_id],
+                capture_output=True, text=True, check=True
+            ).stdout.strip()
+            cgroup = Path(f"/proc/{pid}/cgroup").read_text().splitlines()[0]
+        except (OSError, IndexError, subprocess.CalledProcessError):
+            return
+        # cgroup v2 has a single "0::/path" line
+        if cgroup.startswith("0::"):
+            self.cgroup_dir = Path("/sys/fs/cgroup") / cgroup[3:].lstrip("/")
+            # A warm container carries the usage of earlier builds: measure
+            # the running phase from here, not from zero
+            baseline = self.sample_container()
+            if self.current and self.current["sampler"] == self.sample_container:
+                self.current["sample"] = baseline
+
+    def sample_container(self) -> tuple:
+        """CPU seconds and bytes written by the build container"""
+        # The cgroup disappears with the container, so keep the last good sample
+        if self.cgroup_dir is None:
+            return self.container_sample
+        try:
+            cpu_usec = 0
+            for line in (self.cgroup_dir / "cpu.stat").read_text().splitlines():
+                if line.startswith("usage_usec"):
+                    cpu_usec = int(line.split()[1])
+            written = 0
+            for line in (self.cgroup_dir / "io.stat").read_text().splitlines():
+                for field in line.split()[1:]:
+                    if field.startswith("wbytes="):
+                        written += int(field[7:])
+            self.container_sample = (cpu_usec / 1e6, written)
+            self.container_sampled_at = time.monotonic()
+        except OSError:
+            pass
+        return self.container_sample
+
+    def begin(self, name: str, sampler) -> None:
+        """Finish the current phase and start a new one"""
+        self.end()
+        self.current = {"name": name, "sampler": sampler,
+                        "start": time.monotonic(), "sample": sampler()}
+
+    def end(self) -> None:
+        """Finish the current phase"""
+        if self.current is None:
+            return
+        cpu, written = self.current["sampler"]()
+        start_cpu, start_written = self.current["sample"]
+        self.phases.append({
+            "name": self.current["name"],
+            "counters": "container" if self.current["sampler"] == self.sample_container else "host",
+            "wall_seconds": round(time.monotonic() - self.current["start"], 3),
+            "cpu_seconds": round(cpu - start_cpu, 3),
+            "bytes_written": written - start_written,
+        })
+        self.current = None
+
+    def feed(self, line: str) -> None:
+        """Switch phase when a container output line is a phase marker"""
+        for pattern, name in PHASE_MARKERS:
+            if pattern.search(line):
+                self.begin(name, self.sample_container)
+                return
+        # Keep the cached container sample fresh between markers, for the
+        # phase that ends after the container is gone
+        if time.monotonic() - self.container_sampled_at >= 0.2:
+            self.sample_container()
+
+# Progress lines from tools running inside mkarchiso, mapped to a short label
+PROGRESS_PATTERNS = [
+    (re.compile(r"\(\s*(\d+)/(\d+)\)\s+(installing|upgrading|checking|loading)\s*(\S*)"),
+     lambda m: f"pacman: {m.group(3)} {m.group(1)}/{m.group(2)} {m.group(4)}"),
+    (re.compile(r"\]\s+(\d+)/(\d+)\s+(\d+)%"),
+     lambda m: f"mksquashfs: {m.group(3)}% ({m.group(1)}/{m.group(2)})"),
+    (re.compile(r"UPDATE\s*:\s*([\d.]+)% done"),
+     lambda m: f"xorriso: {m.group(1)}%"),
+]
+
+class BuildLogPipeline:
+    """Stream container output to a rotating gzip log with bounded memory
+
+    Logs rotate per build: build.log.gz is the current build, build.log.N.gz
+    the Nth one before it. A build whose log outgrows max_bytes continues in
+    build.log.part2.gz, part3 and so on; every part of a build is kept, so
+    its log stays complete, and all of them rotate together.
+    """
+
+    def __init__(self, log_dir: Path, verbose: bool = False, ring_size: int = 200,
+                 max_bytes: int = 128 * 1024 * 1024, keep: int = 8, label: str = ""):
+        self.log_dir = log_dir
+        self.verbose = verbose
+        # Concurrent builds share the terminal: prefix lines, no \r progress line
+        self.prefix = f"[{label}] " if label else ""
+        self.recent = deque(maxlen=ring_size)
+        self.max_bytes = max_bytes
+        self.keep = keep
+        self.log_path = log_dir / "build.log.gz"
+        self.log_file = None
+        self.log_bytes = 0
+        self.log_part = 1
+        self.tty = sys.stdout.isatty() and not label
+        self.progress = ""
+        self.progress_at = 0.0
+
+    def build_files(self, n: int) -> List[Path]:
+        """Log parts of the nth previous build (0: the current one)"""
+        base = "build.log" if n == 0 else f"build.log.{n}"
+        return [self.log_dir / f"{base}.gz", *self.log_dir.glob(f"{base}.part*.gz")]
+
+    def part_path(self, part: int) -> Path:
+        return self.log_path if part == 1 else self.log_dir / f"build.log.part{part}.gz"
+
+    def rotate(self) -> None:
+        """Shift build.log* -> build.log.1* -> ... and drop the oldest build"""
+        if self.log_file:
+            self.log_file.close()
+            self.log_file = None
+        for n in range(self.keep, -1, -1):
+            base = "build.log" if n == 0 else f"build.log.{n}"
+            for path in self.build_files(n):
+                if not path.exists():
+                    continue
+                if n == self.keep:
+                    path.unlink()
+                else:
+                    path.replace(self.log_dir / f"build.log.{n + 1}{path.name[len(base):]}")
+
+    def open(self) -> None:
+        """Start a fresh log for this build"""
+        self.log_dir.mkdir(parents=True, exist_ok=True)
+        self.rotate()
+        self.log_part = 1
+        self.log_file = gzip.open(self.log_path, "wt", compresslevel=3)
+        self.log_bytes = 0
+
+    def next_part(self) -> None:
+        """Continue this build's log in a new part"""
+        self.log_file.close()
+        self.log_part += 1
+        self.log_file = gzip.open(self.part_path(self.log_part), "wt", compresslevel=3)
+        self.log_bytes = 0
+
+    def feed(self, line: str) -> None:
+        """Handle one line of container output"""
+        self.recent.append(line)
+        if self.log_file:
+            if self.log_bytes > self.max_bytes:
+                self.next_part()
+            self.log_file.write(line)
+            self.log_bytes += len(line)
+
+        if self.verbose:
+            sys.stdout.write(self.prefix + line)
+            return
+
+        for pattern, label in PROGRESS_PATTERNS:
+            match = pattern.search(line)
+            if match:
+                self.show_progress(label(match))
+                return
+
+        # Phase markers and errors are always worth a full line
+        if "===" in line or "INFO:" in line or "ERROR" in line or "error:" in line:
+            self.clear_progress()
+            sys.stdout.write(self.prefix + line)
+
+    def show_progress(self, text: str) -> None:
+        """Update the live progress line"""
+        self.progress = text
+        if self.tty:
+            sys.stdout.write(f"\r\033[K{text[:100]}")
+            sys.stdout.flush()
+        elif time.monotonic() - self.progress_at >= 30:
+            # Without a terminal, print progress sparingly
+            print(self.prefix + text)
+            self.progress_at = time.monotonic()
+
+    def clear_progress(self) -> None:
+        """Remove the progress line before printing a full line"""
+        if self.tty and self.progress:
+            sys.stdout.write("\r\033[K")
+        self.progress = ""
+
+    def close(self, success: bool) -> None:
+        """Finish the log, dumping recent output on failure"""
+        self.clear_progress()
+        if self.log_file:
+            self.log_file.close()
+            self.log_file = None
+        if not success and not self.verbose:
+            print(f"{Colors.RED}=== Last {len(self.recent)} lines of build output ==={Colors.NC}")
+            sys.stdout.writelines(self.prefix + line for line in self.recent)
+        if self.log_part > 1:
+            logger.info(f"Full build log: {self.log_path} to "
+                        f"{self.part_path(self.log_part)} ({self.log_part} parts)")
+        else:
+            logger.info(f"Full build log: {self.log_path}")
+
+def parse_size(text: str) -> int:
+    """Parse size like 500M or 20G into bytes"""
+    units = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?", text.strip().upper())
+    if not match:
+        raise argparse.ArgumentTypeError(f"invalid size: {text}")
+    return int(float(match.group(1)) * units[match.group(2)])
+
 class ArchISOBuilder:
     def __init__(self, project_name: str = "imaging-distro", version: str = "1.0"):
         self.project_name = project_name
@@ -35,11 +347,35 @@ class ArchISOBuilder:
         self.docker_image = "archiso-builder"
         self.cache_dir = Path.cwd() / "pacman_cache"  # Cache directory for packages
         self.work_dir = Path.cwd() / "archiso_work"   # Work directory for archiso
+        self.build_cache_file = self.project_dir / ".build-cache.json"  # Input hash -> ISO
+        self.use_build_cache = True
+        self.stage_state_file = self.work_dir / ".stage-inputs.json"  # Inputs of last mkarchiso run
+        self.mirror = "https://geo.mirror.pkgbuild.com/$repo/os/$arch"  # Also file:// or a local path
+        self.repos = ["core", "extra"]
+        self.prefetch_workers = 8
+        self.prefetch = False
+        self.cache_index_file = self.cache_dir / ".cache-index.json"  # Package file -> size, last use
+        self.cache_max_size = 0       # Bytes, 0 = unlimited
+        self.cache_keep_versions = 0  # Versions kept per package, 0 = all
+        self.profiler = BuildProfiler()
+        self.show_profile = False
+        self.profile_keep = 20  # build-profile-*.json reports kept per project directory
+        self.verbose = False
+        self.warm = False
+        self.warm_container = "archiso-builder-warm"
+        self.warm_max_builds = 20
+        self.log_label = ""
+        self.dev = False
+        self.release_project_dir = self.project_dir
+        self.squashfs_sort_file: Optional[Path] = None  # Boot read order from scripts/boot_trace.py
+        self.shared_cache_dir: Optional[Path] = None  # Read-only cache shared by matrix variants
+        self.base_rootfs_dir: Optional[Path] = None   # Shared base rootfs for matrix variants
 
         # Package lists organized by category
         self.packages = {
             "imaging_tools": [
-                "ddrescue", "clonezilla", "partclone", "fsarchiver", "testdisk"
+                "ddrescue", "clonezilla", "partclone", "fsarchiver", "testdisk",
+                "python", "zstd"  # imaging-engine
             ],
             "disk_tools": [
                 "util-linux", "gparted", "grub"
@@ -73,6 +409,7 @@ class ArchISOBuilder:
         self.scripts = {
             "ssh_setup": self._get_ssh_setup_script(),
             "imaging_tools": self._get_imaging_tools_script(),
+            "imaging_engine": self._get_imaging_engine_script(),
             "sshd_config": self._get_sshd_config(),
             "systemd_service": self._get_systemd_service(),
             "kde_setup": self._get_kde_setup_script(),
@@ -95,7 +432,7 @@ class ArchISOBuilder:
 
     def create_project_directory(self) -> None:
         """Create project directory and cache directories"""
-        self.project_dir.mkdir(exist_ok=True)
+        self.project_dir.mkdir(parents=True, exist_ok=True)
         self.cache_dir.mkdir(exist_ok=True)
         self.work_dir.mkdir(exist_ok=True)
         logger.info(f"Created project directory: {self.project_dir}")
@@ -125,32 +462,32 @@ RUN echo "CacheDir = /var/cache/pacman/pkg" >> /etc/pacman.conf
 CMD ["bash"]
 '''
 
+    def get_docker_image_tag(self) -> str:
+        """Get image tag derived from the Dockerfile content"""
+        digest = hashlib.sha256(self.get_dockerfile_content().encode()).hexdigest()
+        return f"{self.docker_image}:{digest[:12]}"
+
     def build_docker_image(self) -> bool:
         """Build Docker image"""
+        image_tag = self.get_docker_image_tag()
         try:
-            # Check if image exists
+            # Check if image for this exact Dockerfile exists
             result = subprocess.run(
-                ["docker", "image", "inspect", self.docker_image],
+                ["docker", "image", "inspect", image_tag],
                 capture_output=True, check=False
             )
 
             if result.returncode != 0:
-                self.print_colored("Building Docker image from Dockerfile...", Colors.YELLOW)
-
-                # Create Dockerfile
-                dockerfile_path = Path("Dockerfile")
-                dockerfile_path.write_text(self.get_dockerfile_content())
+                self.print_colored(f"Building Docker image {image_tag}...", Colors.YELLOW)
 
-                # Build image
+                # Feed the Dockerfile on stdin so no build context is sent
+                # (the cwd holds pacman_cache/, archiso_work/ and ISOs)
                 subprocess.run(
-                    ["docker", "build", "-t", self.docker_image, "."],
-                    check=True
+                    ["docker", "build", "-t", image_tag, "-t", self.docker_image, "-"],
+                    input=self.get_dockerfile_content(), text=True, check=True
                 )
-
-                # Clean up
-                dockerfile_path.unlink()
             else:
-                self.print_colored("Using existing Docker image...", Colors.GREEN)
+                self.print_colored(f"Using existing Docker image {image_tag}...", Colors.GREEN)
 
             return True
 
@@ -201,33 +538,75 @@ echo "Connect: ssh root@$(hostname -I | awk '{print $1}')"
         return '''#!/bin/bash
 echo "=== Imaging Tools ==="
 echo "1. Show disks"
-echo "2. Create disk image (dd)"
-echo "3. Create compressed image"
+echo "2. Back up disk (used blocks only)"
+echo "3. Back up disk, compressed (used blocks only)"
 echo "4. Check disk health"
+echo "5. Restore disk backup or image"
+echo "6. Create full disk image (every sector)"
+echo "7. Back up several disks at once"
+echo "8. Restore one image to several disks"
 echo "0. Exit"
 read -p "Choose option: " choice
 case $choice in
     1) lsblk -f ;;
-    2)
+    2|3)
         echo "Available disks:"
-        lsblk -d -o NAME,SIZE,MODEL
+        lsblk -o NAME,SIZE,FSTYPE,MODEL
         read -p "Source disk (e.g. /dev/sda): " source
-        read -p "Destination path: " target
-        dd if="$source" of="$target" bs=4M status=progress
+        read -p "Backup directory: " target
+        read -p "Shared chunk store for repeated backups (Enter for none): " store
+        if [ "$choice" = 3 ]; then
+            read -p "Compression level (Enter for default): " level
+            imaging-engine backup "$source" "$target" --codec zstd ${level:+--level "$level"} ${store:+--store "$store"}
+        else
+            imaging-engine backup "$source" "$target" --codec none ${store:+--store "$store"}
+        fi
+        ;;
+    4) smartctl -H /dev/sda ;;
+    5)
+        read -p "Backup directory or image file: " source
+        echo "Available disks:"
+        lsblk -d -o NAME,SIZE,MODEL
+        read -p "Target disk, will be overwritten (e.g. /dev/sdb): " target
+        read -p "Type YES to overwrite $target: " confirm
+        read -p "Read the disk back to verify it? [y/N]: " verify
+        case $verify in [yY]*) verify=--verify ;; *) verify= ;; esac
+        [ "$confirm" = YES ] && imaging-engine restore "$source" "$target" $verify
         ;;
-    3)
+    6)
         echo "Available disks:"
         lsblk -d -o NAME,SIZE,MODEL
         read -p "Source disk (e.g. /dev/sda): " source
-        read -p "Destination file (.gz): " target
-        dd if="$source" bs=4M status=progress | gzip -c > "$target"
+        read -p "Destination file (.zst, .gz or raw): " target
+        read -p "Compression level (Enter for default): " level
+        imaging-engine create "$source" "$target" ${level:+--level "$level"}
+        ;;
+    7)
+        echo "Available disks:"
+        lsblk -d -o NAME,SIZE,TRAN,MODEL
+        read -p "Source disks, space separated (e.g. /dev/sda /dev/sdb): " sources
+        read -p "Backup directory: " target
+        imaging-engine batch "$target" $sources
+        ;;
+    8)
+        read -p "Image file: " source
+        echo "Available disks:"
+        lsblk -d -o NAME,SIZE,TRAN,MODEL
+        read -p "Target disks, space separated, will be overwritten: " targets
+        read -p "Type YES to overwrite $targets: " confirm
+        read -p "Read the disks back to verify them? [y/N]: " verify
+        case $verify in [yY]*) verify=--verify ;; *) verify= ;; esac
+        [ "$confirm" = YES ] && imaging-engine duplicate "$source" $targets $verify
         ;;
-    4) smartctl -H /dev/sda ;;
     0) exit 0 ;;
     *) echo "Invalid option!" ;;
 esac
 '''
 
+    def _get_imaging_engine_script(self) -> str:
+        """Get the multithreaded imaging engine used by imaging-tools.sh"""
+        return (Path(__file__).parent / "imaging_engine.py").read_text()
+
     def _get_sshd_config(self) -> str:
         """Get SSH daemon configuration"""
         return '''Port 22
@@ -333,18 +712,9 @@ RemainAfterExit=yes
 WantedBy=multi-user.target
 '''
 
-    def generate_build_commands(self) -> str:
-        """Generate build commands for Docker container"""
-        packages_content = self.generate_packages_content()
-
-        commands = f'''
-echo "=== Configuring archiso ==="
-
-# Append packages to packages.x86_64
-cat >> packages.x86_64 << 'PACKAGES_EOF'
-{packages_content}
-PACKAGES_EOF
-
+    def generate_airootfs_commands(self) -> str:
+        """Generate commands that populate the airootfs overlay"""
+        return f'''
 echo "=== Creating required directories ==="
 mkdir -p airootfs/etc/systemd/system
 mkdir -p airootfs/usr/local/bin
@@ -391,6 +761,9 @@ cat > airootfs/usr/local/bin/imaging-tools.sh << 'TOOLS_EOF'
 
 chmod +x airootfs/usr/local/bin/imaging-tools.sh
 
+# Multithreaded imaging engine (too big for the command line, see get_input_files)
+install -m 755 /inputs/imaging-engine airootfs/usr/local/bin/imaging-engine
+
 # Enable services
 ln -sf /etc/systemd/system/auto-ssh.service airootfs/etc/systemd/system/multi-user.target.wants/auto-ssh.service
 ln -sf /etc/systemd/system/auto-kde.service airootfs/etc/systemd/system/multi-user.target.wants/auto-kde.service
@@ -402,13 +775,91 @@ echo "live:!:::::::" >> airootfs/etc/shadow
 
 # Set ownership for live user home
 echo "chown -R 1000:1000 /home/live" >> airootfs/etc/rc.local
+'''
 
+    def generate_profile_commands(self) -> str:
+        """Generate commands that adjust the releng profile itself"""
+        commands = '''
 # Modify profiledef.sh to change default target
 sed -i 's/multi-user.target/graphical.target/' profiledef.sh
+'''
+        if self.dev:
+            commands += self.generate_dev_profile_commands()
+        return commands
+
+    def generate_dev_profile_commands(self) -> str:
+        """Generate profiledef.sh overrides for the fast development profile"""
+        return '''
+# Development profile: fast squashfs compression and BIOS boot only.
+# profiledef.sh is sourced, so values appended here win.
+cat >> profiledef.sh << 'DEV_EOF'
+airootfs_image_tool_options=('-comp' 'zstd' '-Xcompression-level' '1' '-b' '1M')
+DEV_EOF
+bios_modes=$(bash -c 'source ./profiledef.sh; for m in "${bootmodes[@]}"; do [[ $m == bios* ]] && printf "%q " "$m"; done')
+echo "bootmodes=(${bios_modes})" >> profiledef.sh
+echo "Development profile boot modes: ${bios_modes}"
+'''
+
+    def generate_squashfs_commands(self) -> str:
+        """Generate commands that order the airootfs image by boot access"""
+        if not self.squashfs_sort_file:
+            return ""
+        return '''
+# Files read during boot go first in airootfs.sfs (paths relative to the airootfs)
+echo "airootfs_image_tool_options+=('-sort' '/inputs/squashfs.sort')" >> profiledef.sh
+'''
+
+    @property
+    def inputs_dir(self) -> Path:
+        """Host directory mounted read-only at /inputs, next to the work directory"""
+        return self.work_dir.with_name(f"{self.work_dir.name}-inputs")
+
+    def get_input_files(self) -> Dict[str, bytes]:
+        """Files the build reads from /inputs
+
+        Anything large goes here rather than into the bash -c command line:
+        a single argument is limited to MAX_ARG_STRLEN.
+        """
+        files = {"imaging-engine": self.scripts["imaging_engine"].encode()}
+        if self.squashfs_sort_file:
+            files["squashfs.sort"] = self.squashfs_sort_file.read_bytes()
+        return files
+
+    def write_input_files(self) -> None:
+        """Refresh the /inputs directory for this build"""
+        self.inputs_dir.mkdir(parents=True, exist_ok=True)
+        files = self.get_input_files()
+        for path in self.inputs_dir.iterdir():
+            if path.name not in files:
+                path.unlink()
+        for name, content in files.items():
+            (self.inputs_dir / name).write_bytes(content)
+
+    def enable_dev_profile(self) -> None:
+        """Switch to the fast development profile with its own work and output dirs"""
+        self.dev = True
+        # Dev and release builds differ in profile inputs; separate work
+        # directories keep switching between them from resetting either one
+        self.project_dir = self.release_project_dir / "dev"
+        self.work_dir = Path.cwd() / "archiso_work_dev"
+        self.build_cache_file = self.project_dir / ".build-cache.json"
+        self.stage_state_file = self.work_dir / ".stage-inputs.json"
+
+    def generate_build_commands(self) -> str:
+        """Generate build commands for Docker container"""
+        packages_content = self.generate_packages_content()
+
+        commands = f'''
+echo "=== Configuring archiso ==="
 
+# Append packages to packages.x86_64
+cat >> packages.x86_64 << 'PACKAGES_EOF'
+{packages_content}
+PACKAGES_EOF
+{self.generate_airootfs_commands()}{self.generate_profile_commands()}{self.generate_squashfs_commands()}
 echo "=== Building ISO ==="
 # Use persistent work directory to avoid rebuilding everything
-mkarchiso -v -w /work -o /output .
+mkarchiso -v -w /work -o /output . || exit 1
 
 echo "=== Done! ==="
 echo "ISO created in /output:"
@@ -417,34 +868,355 @@ ls -la /output/
 '''
         return commands
 
+    def get_stage_inputs(self) -> Dict[str, str]:
+        """Hash each group of inputs consumed by mkarchiso stages"""
+        groups = {
+            "profile": (self.get_dockerfile_content(), self.get_docker_image_id(),
+                        self.generate_profile_commands()),
+            "packages": (self.generate_packages_content(),),
+            "airootfs": (self.generate_airootfs_commands(), self.scripts["imaging_engine"]),
+            "squashfs": (self.generate_squashfs_commands(),
+                         self.get_input_files().get("squashfs.sort", b"").decode(errors="replace")),
+        }
+        inputs = {}
+        for group, parts in groups.items():
+            digest = hashlib.sha256()
+            for part in parts:
+                digest.update(part.encode())
+                digest.update(b"\0")
+            inputs[group] = digest.hexdigest()
+        return inputs
+
+    def get_invalidated_stages(self, previous: Dict[str, str],
+                               current: Dict[str, str]) -> List[str]:
+        """Get stages whose inputs changed since the last run"""
+        changed = {group for group in current if previous.get(group) != current[group]}
+        return [stage for stage, groups in ARCHISO_STAGES
+                if changed.intersection(groups)]
+
+    def get_stage_invalidation_commands(self) -> str:
+        """Generate commands that drop stale mkarchiso stage markers"""
+        current = self.get_stage_inputs()
+        try:
+            previous = json.loads(self.stage_state_file.read_text())
+        except (FileNotFoundError, json.JSONDecodeError):
+            # Unknown history: nothing in the work directory can be trusted
+            previous = {}
+
+        stages = self.get_invalidated_stages(previous, current)
+        # Until mkarchiso succeeds, only the unchanged groups count as built
+        # (get_stage_record_commands writes the rest afterwards)
+        unchanged = {group: value for group, value in current.items()
+                     if previous.get(group) == value}
+
+        if not stages:
+            self.print_colored("All mkarchiso stages are up to date", Colors.GREEN)
+            commands = ""
+        elif ARCHISO_ROOTFS_STAGES.intersection(stages):
+            self.print_colored("Package or profile inputs changed, starting work directory over",
+                               Colors.YELLOW)
+            commands = "find /work -mindepth 1 -delete\n"
+        else:
+            self.print_colored(f"Rebuilding stages: {', '.join(stages)}", Colors.YELLOW)
+            # Markers are named <mode>.<stage> (build.<stage>_<arch> on older archiso)
+            commands = "".join(f"rm -f /work/*.{stage}*\n" for stage in stages)
+
+        return f'''
+echo "=== Invalidating stale stages ==="
+{commands}cat > /work/{self.stage_state_file.name} << 'STAGES_EOF'
+{json.dumps(unchanged, indent=2)}
+STAGES_EOF
+'''
+
+    def get_stage_record_commands(self) -> str:
+        """Generate commands recording the inputs of a finished mkarchiso run"""
+        return f'''
+cat > /work/{self.stage_state_file.name} << 'STAGES_EOF'
+{json.dumps(self.get_stage_inputs(), indent=2)}
+STAGES_EOF
+'''
+
+    def get_volume_args(self) -> List[str]:
+        """Get docker volume arguments for output, cache and work directories"""
+        volumes = [
+            "-v", f"{self.project_dir}:/output",
+            "-v", f"{self.cache_dir}:/var/cache/pacman/pkg",  # Persistent package cache
+            "-v", f"{self.work_dir}:/work",                   # Persistent work directory
+            "-v", f"{self.inputs_dir}:/inputs:ro",            # Files too big for the command line
+        ]
+        if self.shared_cache_dir:
+            volumes += ["-v", f"{self.shared_cache_dir}:/var/cache/pacman/shared:ro"]
+        if self.base_rootfs_dir:
+            volumes += ["-v", f"{self.base_rootfs_dir}:/base:ro"]
+        return volumes
+
+    def get_variant_prefix_commands(self) -> str:
+        """Commands that build this variant's airootfs on top of the shared base"""
+        packages = " ".join(self.get_packages_list())
+        return f'''
+echo "=== Preparing variant airootfs from shared base ==="
+set -e
+# Read from the shared cache, download into this variant's own cache (the
+# first writable CacheDir). pacman only reads CacheDir under [options];
+# mkarchiso copies the host's cache dirs into its pacman.conf, pacstrap
+# below gets the profile's pacman.conf with the same dirs.
+cache_dirs=(-e '/^CacheDir/d'
+            -e '/^\[options\]/a CacheDir = /var/cache/pacman/pkg/'
+            -e '/^\[options\]/a CacheDir = /var/cache/pacman/shared/')
+sed -i "${{cache_dirs[@]}}" /etc/pacman.conf
+sed "${{cache_dirs[@]}}" pacman.conf > /tmp/variant-pacman.conf
+mkdir -p /work/x86_64/airootfs
+if [ ! -e /work/.base-clone ]; then
+    mkdir -p /work/overlay/upper /work/overlay/work
+    if mount -t overlay overlay -o lowerdir=/base/airootfs,upperdir=/work/overlay/upper,workdir=/work/overlay/work /work/x86_64/airootfs; then
+        echo overlay > /work/.base-clone
+    else
+        # No overlayfs: reflink copy is still copy-on-write on btrfs/xfs
+        cp -a --reflink=auto /base/airootfs/. /work/x86_64/airootfs/
+        echo copy > /work/.base-clone
+    fi
+elif [ "$(cat /work/.base-clone)" = overlay ]; then
+    mount -t overlay overlay -o lowerdir=/base/airootfs,upperdir=/work/overlay/upper,workdir=/work/overlay/work /work/x86_64/airootfs
+fi
+echo "Base clone: $(cat /work/.base-clone)"
+if ! ls /work/*._make_packages* >/dev/null 2>&1; then
+    # Only packages missing from the base get installed
+    pacstrap -C /tmp/variant-pacman.conf -c -G -M /work/x86_64/airootfs $(grep -v '^#' packages.x86_64 | grep .) {packages} --needed
+    # Tell mkarchiso its pacstrap stage is done (marker is <mode>.<stage>)
+    touch /work/base._make_packages
+fi
+set +e
+'''
+
+    def get_warm_prefix_commands(self) -> str:
+        """Commands giving each build in the warm container a pristine profile"""
+        return '''
+mkdir -p /var/lib/hardclone
+echo $(( $(cat /var/lib/hardclone/builds 2>/dev/null || echo 0) + 1 )) > /var/lib/hardclone/builds
+rm -rf /build/run
+cp -a /build/my-imaging-distro /build/run
+cd /build/run
+'''
+
+    def stop_warm_container(self) -> None:
+        """Remove the warm builder container"""
+        result = subprocess.run(["docker", "rm", "-f", self.warm_container],
+                                capture_output=True, check=False)
+        if result.returncode == 0:
+            logger.info(f"Removed warm container {self.warm_container}")
+
+    def get_warm_container(self) -> Optional[str]:
+        """Get a healthy warm builder container, recycling it when needed"""
+        image_tag = self.get_docker_image_tag()
+        mounts = " ".join(self.get_volume_args()[1::2])
+
+        result = subprocess.run(
+            ["docker", "inspect", "-f",
+             '{{.State.Running}}|{{index .Config.Labels "hardclone.image"}}'
+             '|{{index .Config.Labels "hardclone.mounts"}}',
+             self.warm_container],
+            capture_output=True, text=True, check=False
+        )
+        reason = None
+        if result.returncode != 0:
+            reason = "not running"
+        else:
+            running, label_image, label_mounts = result.stdout.strip().split("|", 2)
+            if running != "true":
+                reason = "stopped"
+            elif label_image != image_tag:
+                reason = "image changed"
+            elif label_mounts != mounts:
+                reason = "volumes changed"
+            else:
+                # Health check: the container answers and the work volume is usable
+                probe = subprocess.run(
+                    ["docker", "exec", self.warm_container, "sh", "-c",
+                     "test -w /work || exit 1; cat /var/lib/hardclone/builds 2>/dev/null || echo 0"],
+                    capture_output=True, text=True, check=False
+                )
+                if probe.returncode != 0:
+                    reason = "health check failed"
+                elif int(probe.stdout.strip() or 0) >= self.warm_max_builds:
+                    reason = f"reached {self.warm_max_builds} builds"
+
+        if reason is None:
+            self.print_colored(f"Reusing warm container {self.warm_container}", Colors.GREEN)
+            return self.warm_container
+
+        self.print_colored(f"Starting warm container {self.warm_container} ({reason})", Colors.YELLOW)
+        self.stop_warm_container()
+        try:
+            subprocess.run([
+                "docker", "run", "-d",
+                "--privileged",
+                "--name", self.warm_container,
+                "--label", f"hardclone.image={image_tag}",
+                "--label", f"hardclone.mounts={mounts}",
+                *self.get_volume_args(),
+                image_tag,
+                "sleep", "infinity"
+            ], capture_output=True, check=True)
+        except subprocess.CalledProcessError as e:
+            logger.error(f"Failed to start warm container: {e.stderr.decode().strip()}")
+            return None
+        return self.warm_container
+
     def run_build(self) -> bool:
         """Run the build process with persistent volumes"""
         try:
-            build_commands = self.generate_build_commands()
+            # Stage invalidation and variant setup stay out of
+            # generate_build_commands() so they don't change the build cache key
+            build_commands = self.get_stage_invalidation_commands()
+            if self.base_rootfs_dir:
+                build_commands += self.get_variant_prefix_commands()
+            build_commands += self.generate_build_commands()
+            # Only reached when mkarchiso succeeded
+            build_commands += self.get_stage_record_commands()
+
+            if len(build_commands.encode()) > MAX_ARG_STRLEN - 4096:  # Prefix commands too
+                logger.error(f"Build commands are {len(build_commands.encode())} bytes, over the "
+                             f"{MAX_ARG_STRLEN} byte argument limit; move content to /inputs")
+                return False
+            self.write_input_files()
 
             # Create named volumes for persistence
             self.print_colored("Creating/checking persistent volumes...", Colors.YELLOW)
 
-            # Create container with persistent volumes
-            cmd = [
-                "docker", "run", "-it", "--rm",
-                "--privileged",
-                "-v", f"{self.project_dir}:/output",
-                "-v", f"{self.cache_dir}:/var/cache/pacman/pkg",  # Persistent package cache
-                "-v", f"{self.work_dir}:/work",                   # Persistent work directory
-                self.docker_image,
-                "bash", "-c", build_commands
-            ]
+            cid_dir = Path(tempfile.mkdtemp(prefix="archiso-build-"))
+            cidfile = cid_dir / "container.cid"
+
+            if self.warm:
+                container = self.get_warm_container()
+                if not container:
+                    shutil.rmtree(cid_dir, ignore_errors=True)
+                    return False
+                cidfile.write_text(container)
+                cmd = ["docker", "exec", container,
+                       "bash", "-c", self.get_warm_prefix_commands() + build_commands]
+            else:
+                # Create container with persistent volumes
+                cmd = [
+                    "docker", "run", "--rm",
+                    "--privileged",
+                    "--cidfile", str(cidfile),
+                    *self.get_volume_args(),
+                    self.get_docker_image_tag(),
+                    "bash", "-c", build_commands
+                ]
 
             self.print_colored("Running container with persistent cache...", Colors.GREEN)
-            result = subprocess.run(cmd, check=True)
-
-            return result.returncode == 0
+            self.profiler.begin("container_start", self.profiler.sample_container)
+            build_log = BuildLogPipeline(self.project_dir / "logs", verbose=self.verbose,
+                                         label=self.log_label)
+            build_log.open()
+            returncode = 1
+            try:
+                # Stream the output so phase markers can be timed as they appear.
+                # Universal newlines also split pacman/mksquashfs \r progress updates.
+                process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                           text=True, errors="replace")
+                for line in process.stdout:
+                    if self.profiler.cgroup_dir is None and cidfile.exists():
+                        self.profiler.attach_container(cidfile.read_text().strip())
+                    build_log.feed(line)
+                    self.profiler.feed(line)
+                returncode = process.wait()
+            finally:
+                self.profiler.end()
+                build_log.close(returncode == 0)
+                shutil.rmtree(cid_dir, ignore_errors=True)
+
+            if returncode != 0:
+                if self.warm:
+                    # Don't reuse a container a failed build may have left dirty
+                    self.stop_warm_container()
+                raise subprocess.CalledProcessError(returncode, cmd[:2])
+            return True
 
         except subprocess.CalledProcessError as e:
             logger.error(f"Build failed: {e}")
             return False
 
+    def get_docker_image_id(self) -> str:
+        """Get ID of the builder image (empty if it cannot be inspected)"""
+        result = subprocess.run(
+            ["docker", "image", "inspect", "-f", "{{.Id}}", self.get_docker_image_tag()],
+            capture_output=True, text=True, check=False
+        )
+        return result.stdout.strip() if result.returncode == 0 else ""
+
+    def get_build_key(self) -> str:
+        """Hash every input that ends up in the build container"""
+        digest = hashlib.sha256()
+        for part in (
+            self.get_dockerfile_content(),
+            self.get_docker_image_id(),
+            self.generate_build_commands(),
+        ):
+            digest.update(part.encode())
+            digest.update(b"\0")
+        for name, content in sorted(self.get_input_files().items()):
+            digest.update(name.encode() + b"\0" + content + b"\0")
+        return digest.hexdigest()
+
+    def load_build_cache(self) -> Dict[str, Dict]:
+        """Load build cache index"""
+        try:
+            return json.loads(self.build_cache_file.read_text())
+        except FileNotFoundError:
+            return {}
+        except json.JSONDecodeError:
+            logger.warning(f"Ignoring corrupt build cache {self.build_cache_file}")
+            return {}
+
+    def find_cached_iso(self, key: str) -> Optional[Path]:
+        """Return ISO recorded for this key if it is still intact"""
+        entry = self.load_build_cache().get(key)
+        if not entry:
+            return None
+
+        iso_path = self.project_dir / entry["iso"]
+        try:
+            stat = iso_path.stat()
+        except FileNotFoundError:
+            return None
+
+        if stat.st_size != entry["size"] or stat.st_mtime_ns != entry["mtime_ns"]:
+            logger.info(f"Cached ISO {iso_path.name} was modified, rebuilding")
+            return None
+        return iso_path
+
+    def list_isos(self) -> Dict[Path, int]:
+        """Map ISO files in project directory to their mtime"""
+        return {p: p.stat().st_mtime_ns for p in self.project_dir.glob("*.iso")}
+
+    def record_build(self, key: str, before: Dict[Path, int]) -> None:
+        """Remember the ISO produced by a successful build"""
+        after = self.list_isos()
+        produced = [p for p, mtime in after.items() if before.get(p) != mtime]
+        if not produced:
+            logger.warning("No new ISO found in project directory, build not cached")
+            return
+
+        iso_path = max(produced, key=lambda p: after[p])
+        stat = iso_path.stat()
+        cache = self.load_build_cache()
+        # Drop entries whose ISO was overwritten by this build
+        cache = {k: v for k, v in cache.items() if v["iso"] != iso_path.name}
+        cache[key] = {
+            "iso": iso_path.name,
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "version": self.version,
+            "created": datetime.now().isoformat(timespec="seconds"),
+        }
+
+        tmp_path = self.build_cache_file.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(cache, indent=2))
+        tmp_path.replace(self.build_cache_file)
+        logger.info(f"Recorded build {key[:12]} -> {iso_path.name}")
+
     def clean_cache(self) -> None:
         """Clean package cache"""
         if self.cache_dir.exists():
@@ -465,16 +1237,269 @@ ls -la /output/
         else:
             logger.info("Work directory doesn't exist")
 
+    def get_repo_url(self, repo: str) -> str:
+        """Expand mirror template for a repository"""
+        url = self.mirror.replace("$repo", repo).replace("$arch", "x86_64").rstrip("/")
+        if "://" not in url:
+            url = Path(url).resolve().as_uri()
+        return url
+
+    def _parse_desc(self, text: str) -> Dict[str, List[str]]:
+        """Parse a pacman sync database desc entry"""
+        fields = {}
+        for block in text.strip().split("\n\n"):
+            lines = block.strip().splitlines()
+            if lines and lines[0].startswith("%"):
+                fields[lines[0].strip("%")] = lines[1:]
+        return fields
+
+    def load_sync_databases(self) -> List[Dict]:
+        """Download and parse the sync databases of all repositories"""
+        packages = []
+        for repo in self.repos:
+            url = f"{self.get_repo_url(repo)}/{repo}.db"
+            with urllib.request.urlopen(url, timeout=60) as response:
+                data = response.read()
+
+            tmp_path = self.cache_dir / f".{repo}.db"
+            tmp_path.write_bytes(data)
+            try:
+                with tarfile.open(tmp_path, "r:*") as db:
+                    for member in db:
+                        if not member.name.endswith("/desc"):
+                            continue
+                        desc = self._parse_desc(db.extractfile(member).read().decode())
+                        packages.append({
+                            "repo": repo,
+                            "name": desc["NAME"][0],
+                            "filename": desc["FILENAME"][0],
+                            "size": int(desc.get("CSIZE", ["0"])[0]),
+                            "sha256": desc.get("SHA256SUM", [""])[0],
+                            "depends": desc.get("DEPENDS", []),
+                            "provides": desc.get("PROVIDES", []),
+                            "groups": desc.get("GROUPS", []),
+                        })
+            finally:
+                tmp_path.unlink()
+        return packages
+
+    def resolve_dependencies(self, names: List[str], sync_db: List[Dict]) -> List[Dict]:
+        """Resolve the full dependency closure of package names"""
+        strip_version = lambda dep: re.split(r"[<>=]", dep, maxsplit=1)[0]
+
+        by_name, providers, groups = {}, {}, {}
+        for pkg in sync_db:
+            # Repositories are searched in order, first match wins like in pacman
+            by_name.setdefault(pkg["name"], pkg)
+            for provided in pkg["provides"]:
+                providers.setdefault(strip_version(provided), pkg)
+            for group in pkg["groups"]:
+                groups.setdefault(group, []).append(pkg)
+
+        resolved: Dict[str, Dict] = {}
+        pending = list(names)
+        missing: Set[str] = set()
+        while pending:
+            name = strip_version(pending.pop())
+            if name in by_name:
+                candidates = [by_name[name]]
+            elif name in providers:
+                candidates = [providers[name]]
+            elif name in groups:
+                candidates = groups[name]
+            else:
+                missing.add(name)
+                continue
+
+            for pkg in candidates:
+                if pkg["name"] not in resolved:
+                    resolved[pkg["name"]] = pkg
+                    pending.extend(pkg["depends"])
+
+        if missing:
+            logger.warning(f"Not found in {', '.join(self.repos)}: {', '.join(sorted(missing))}")
+        return list(resolved.values())
+
+    def _download_package(self, pkg: Dict) -> int:
+        """Download one package into the cache, return bytes fetched"""
+        target = self.cache_dir / pkg["filename"]
+        part = target.with_name(target.name + ".part")
+        url = f"{self.get_repo_url(pkg['repo'])}/{pkg['filename']}"
+
+        digest = hashlib.sha256()
+        fetched = 0
+        with urllib.request.urlopen(url, timeout=60) as response, open(part, "wb") as f:
+            while chunk := response.read(1024 * 1024):
+                f.write(chunk)
+                digest.update(chunk)
+                fetched += len(chunk)
+
+        if pkg["sha256"] and digest.hexdigest() != pkg["sha256"]:
+            part.unlink()
+            raise ValueError(f"Checksum mismatch for {pkg['filename']}")
+        part.replace(target)
+        return fetched
+
+    def prefetch_packages(self) -> bool:
+        """Download missing packages into the cache concurrently"""
+        self.print_colored(f"\n=== Prefetching packages ({self.prefetch_workers} workers) ===",
+                           Colors.BLUE)
+        self.cache_dir.mkdir(exist_ok=True)
+        start = time.monotonic()
+
+        try:
+            sync_db = self.load_sync_databases()
+        except (OSError, http.client.HTTPException, tarfile.TarError) as e:
+            logger.error(f"Failed to load sync databases from {self.mirror}: {e}")
+            return False
+
+        closure = self.resolve_dependencies(self.get_packages_list(), sync_db)
+        missing = [pkg for pkg in closure
+                   if not (self.cache_dir / pkg["filename"]).exists()
+                   and not (self.shared_cache_dir and (self.shared_cache_dir / pkg["filename"]).exists())]
+        hits = len(closure) - len(missing)
+
+        fetched_bytes = 0
+        failed = 0
+        with ThreadPoolExecutor(max_workers=self.prefetch_workers) as pool:
+            futures = {pool.submit(self._download_package, pkg): pkg for pkg in missing}
+            for done, future in enumerate(as_completed(futures), 1):
+                pkg = futures[future]
+                try:
+                    fetched_bytes += future.result()
+                    logger.info(f"[{done}/{len(missing)}] {pkg['filename']}")
+                except (OSError, http.client.HTTPException, ValueError) as e:
+                    failed += 1
+                    logger.error(f"Failed to fetch {pkg['filename']}: {e}")
+
+        self.update_cache_index([pkg["filename"] for pkg in closure])
+
+        elapsed = time.monotonic() - start
+        hit_ratio = hits / len(closure) if closure else 1.0
+        self.print_colored(f"Packages in closure: {len(closure)}", Colors.YELLOW)
+        self.print_colored(f"Cache hits: {hits} ({hit_ratio:.1%})", Colors.YELLOW)
+        self.print_colored(f"Fetched: {len(missing) - failed} packages, "
+                           f"{fetched_bytes / (1024*1024):.2f} MB in {elapsed:.1f}s "
+                           f"({fetched_bytes / (1024*1024) / max(elapsed, 0.001):.2f} MB/s)",
+                           Colors.YELLOW)
+        if failed:
+            self.print_colored(f"Failed: {failed} packages (pacman will retry them)", Colors.RED)
+        return failed == 0
+
+    def load_cache_index(self) -> Dict[str, Dict]:
+        """Load package cache index"""
+        try:
+            return json.loads(self.cache_index_file.read_text())
+        except FileNotFoundError:
+            return {}
+        except json.JSONDecodeError:
+            logger.warning(f"Rebuilding corrupt cache index {self.cache_index_file}")
+            return {}
+
+    def save_cache_index(self, index: Dict[str, Dict]) -> None:
+        """Atomically write package cache index"""
+        tmp_path = self.cache_index_file.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(index))
+        tmp_path.replace(self.cache_index_file)
+
+    def update_cache_index(self, used: Optional[List[str]] = None) -> Dict[str, Dict]:
+        """Sync index with cache directory and mark package files as used"""
+        index = self.load_cache_index()
+        present = {}
+        # Package files are never rewritten in place, so only new names need a stat()
+        with os.scandir(self.cache_dir) as entries:
+            for entry in entries:
+                if ".pkg.tar." not in entry.name or entry.name.endswith((".sig", ".part")):
+                    continue
+                if entry.name in index:
+                    present[entry.name] = index[entry.name]
+                else:
+                    stat = entry.stat()
+                    present[entry.name] = {"size": stat.st_size, "last_used": stat.st_mtime}
+
+        now = time.time()
+        for filename in used or []:
+            if filename in present:
+                present[filename]["last_used"] = now
+
+        self.save_cache_index(present)
+        return present
+
+    def mark_built_packages_used(self, pkglist: Optional[Path] = None) -> None:
+        """Mark package files listed in the last build's pkglist as used"""
+        pkglist = pkglist or self.work_dir / "iso" / "arch" / "pkglist.x86_64.txt"
+        try:
+            # Lines are "name pkgver-pkgrel"
+            built = {"-".join(line.split()) for line in pkglist.read_text().splitlines()
+                     if line.strip()}
+        except FileNotFoundError:
+            logger.warning(f"No {pkglist.name} in work directory, cache usage not updated")
+            return
+
+        # name-pkgver-pkgrel-arch.pkg.tar.* -> name-pkgver-pkgrel
+        used = [filename for filename in self.load_cache_index()
+                if filename.rsplit("-", 1)[0] in built]
+        self.update_cache_index(used)
+
+    def _remove_cached_package(self, filename: str) -> None:
+        """Remove package file and its signature from the cache"""
+        for path in (self.cache_dir / filename, self.cache_dir / f"{filename}.sig"):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def prune_cache(self) -> None:
+        """Evict package files according to keep-versions and max-size policy"""
+        if not self.cache_dir.exists():
+            return
+        index = self.update_cache_index()
+        evicted = []
+
+        if self.cache_keep_versions:
+            # name-pkgver-pkgrel-arch.pkg.tar.* -> name
+            versions: Dict[str, List[str]] = {}
+            for filename in index:
+                versions.setdefault(filename.rsplit("-", 3)[0], []).append(filename)
+            for files in versions.values():
+                files.sort(key=lambda f: index[f]["last_used"], reverse=True)
+                evicted.extend(files[self.cache_keep_versions:])
+
+        evicted_set = set(evicted)
+        total = sum(e["size"] for f, e in index.items() if f not in evicted_set)
+        if self.cache_max_size and total > self.cache_max_size:
+            by_age = sorted((f for f in index if f not in evicted_set),
+                            key=lambda f: index[f]["last_used"])
+            for filename in by_age:
+                if total <= self.cache_max_size:
+                    break
+                evicted.append(filename)
+                total -= index[filename]["size"]
+
+        freed = 0
+        for filename in evicted:
+            self._remove_cached_package(filename)
+            freed += index.pop(filename)["size"]
+        self.save_cache_index(index)
+
+        if evicted:
+            self.print_colored(f"Evicted {len(evicted)} package files, "
+                               f"freed {freed / (1024*1024):.2f} MB", Colors.YELLOW)
+
     def show_cache_info(self) -> None:
         """Show cache information"""
         if self.cache_dir.exists():
-            cache_size = sum(f.stat().st_size for f in self.cache_dir.rglob('*') if f.is_file())
-            cache_files = len(list(self.cache_dir.rglob('*.pkg.tar.*')))
+            index = self.load_cache_index() or self.update_cache_index()
+            cache_size = sum(entry["size"] for entry in index.values())
+            cache_files = len(index)
 
             self.print_colored(f"\n=== Cache Information ===", Colors.BLUE)
             self.print_colored(f"Cache directory: {self.cache_dir}", Colors.YELLOW)
             self.print_colored(f"Cached packages: {cache_files}", Colors.YELLOW)
             self.print_colored(f"Cache size: {cache_size / (1024*1024):.2f} MB", Colors.YELLOW)
+            if self.cache_max_size:
+                self.print_colored(f"Cache limit: {self.cache_max_size / (1024*1024):.2f} MB",
+                                   Colors.YELLOW)
         else:
             self.print_colored("Cache directory doesn't exist", Colors.RED)
 
@@ -539,8 +1564,111 @@ ls -la /output/
         except json.JSONDecodeError:
             logger.error(f"Invalid JSON in configuration file {filepath}")
 
+    def write_profile_report(self, success: bool, started: datetime) -> Path:
+        """Write the per-phase timing report as JSON"""
+        report = {
+            "project": self.project_name,
+            "version": self.version,
+            "started": started.isoformat(timespec="seconds"),
+            "success": success,
+            "build_profile": "dev" if self.dev else "release",
+            "total_wall_seconds": round(sum(p["wall_seconds"] for p in self.profiler.phases), 3),
+            "phases": self.profiler.phases,
+            "counters": BuildProfiler.COUNTER_NOTES,
+        }
+        if self.dev:
+            release = self.find_release_profile()
+            if release:
+                report["release_baseline"] = {
+                    "started": release["started"],
+                    "total_wall_seconds": release["total_wall_seconds"],
+                    "speedup": round(release["total_wall_seconds"]
+                                     / max(report["total_wall_seconds"], 0.001), 2),
+                }
+        report_path = self.project_dir / f"build-profile-{started:%Y%m%d-%H%M%S}.json"
+        report_path.write_text(json.dumps(report, indent=2))
+        logger.info(f"Build profile written to {report_path}")
+        self.prune_profile_reports()
+        return report_path
+
+    def prune_profile_reports(self) -> None:
+        """Keep the newest profile_keep reports, and the release baseline dev builds compare with"""
+        reports = sorted(self.project_dir.glob("build-profile-*.json"), reverse=True)
+        baseline = self.find_release_profile_path()
+        for report_path in reports[self.profile_keep:]:
+            if report_path != baseline:
+                report_path.unlink(missing_ok=True)
+
+    def find_release_profile_path(self) -> Optional[Path]:
+        """Newest successful release build report that ran mkarchiso"""
+        for report_path in sorted(self.release_project_dir.glob("build-profile-*.json"),
+                                  reverse=True):
+            try:
+                report = json.loads(report_path.read_text())
+            except json.JSONDecodeError:
+                continue
+            phases = {p["name"] for p in report.get("phases", [])}
+            if (report.get("success") and report.get("build_profile", "release") == "release"
+                    and "iso_image" in phases):
+                return report_path
+        return None
+
+    def find_release_profile(self) -> Optional[Dict]:
+        """Load the newest successful release build report that ran mkarchiso"""
+        report_path = self.find_release_profile_path()
+        return json.loads(report_path.read_text()) if report_path else None
+
+    def print_dev_comparison(self) -> None:
+        """Compare this development build with the last release build"""
+        release = self.find_release_profile()
+        if release is None:
+            self.print_colored("No release build profile to compare with "
+                               "(run a build without --dev first)", Colors.YELLOW)
+            return
+
+        dev_phases = {p["name"]: p["wall_seconds"] for p in self.profiler.phases}
+        release_phases = {p["name"]: p["wall_seconds"] for p in release["phases"]}
+        self.print_colored(f"\n=== Dev vs Release ({release['started']}) ===", Colors.BLUE)
+        print(f"{'Phase':<20} {'Release (s)':>12} {'Dev (s)':>10}")
+        for name in dict.fromkeys([*release_phases, *dev_phases]):
+            print(f"{name:<20} {release_phases.get(name, 0):>12.1f} {dev_phases.get(name, 0):>10.1f}")
+
+        dev_total = sum(dev_phases.values())
+        release_total = release["total_wall_seconds"]
+        print(f"{'total':<20} {release_total:>12.1f} {dev_total:>10.1f}")
+        self.print_colored(f"Dev build is {release_total / max(dev_total, 0.001):.1f}x faster",
+                           Colors.GREEN)
+
+    def print_profile_summary(self) -> None:
+        """Print per-phase timing table"""
+        total = sum(p["wall_seconds"] for p in self.profiler.phases) or 1
+        self.print_colored("\n=== Build Profile ===", Colors.BLUE)
+        print(f"{'Phase':<20} {'Wall (s)':>10} {'Share':>7} {'CPU (s)':>10} {'Written (MB)':>13}")
+        for phase in self.profiler.phases:
+            mark = "*" if phase.get("counters") == "host" else " "
+            print(f"{phase['name']:<20} {phase['wall_seconds']:>10.1f} "
+                  f"{phase['wall_seconds'] / total:>7.1%} {phase['cpu_seconds']:>10.1f}{mark}"
+                  f"{phase['bytes_written'] / (1024*1024):>12.1f}{mark}")
+        print(f"{'total':<20} {total:>10.1f}")
+        print("* host phase, approximate: " + BuildProfiler.COUNTER_NOTES["host"])
+
     def build(self) -> bool:
         """Main build process"""
+        started = datetime.now()
+        self.profiler = BuildProfiler()
+        success = self._build()
+        self.profiler.end()
+
+        if self.project_dir.exists():
+            self.write_profile_report(success, started)
+        if self.show_profile:
+            self.print_profile_summary()
+        if self.dev and success and "iso_image" in {p["name"] for p in self.profiler.phases}:
+            self.print_dev_comparison()
+        return success
+
+    def _build(self) -> bool:
+        """Run build steps"""
         self.print_colored("\n=== Building Imaging Distribution with Docker (Cached) ===", Colors.GREEN)
 
         # Check Docker
@@ -553,16 +1681,38 @@ ls -la /output/
 
         # Build Docker image
         self.print_colored("Creating Docker container...", Colors.YELLOW)
+        self.profiler.begin("docker_image", self.profiler.sample_process)
         if not self.build_docker_image():
             return False
 
+        # Skip the container entirely if these inputs were already built
+        self.profiler.begin("build_cache", self.profiler.sample_process)
+        build_key = self.get_build_key()
+        if self.use_build_cache:
+            cached_iso = self.find_cached_iso(build_key)
+            if cached_iso:
+                self.print_colored("\n=== Inputs unchanged, reusing cached ISO ===", Colors.GREEN)
+                self.print_colored(f"Build key: {build_key[:12]}", Colors.YELLOW)
+                self.print_colored(f"ISO: {cached_iso}", Colors.YELLOW)
+                return True
+
+        if self.prefetch:
+            # A failed prefetch only costs speed, pacman fetches the rest itself
+            self.profiler.begin("prefetch", self.profiler.sample_process)
+            self.prefetch_packages()
+
         # Show cache info
         self.show_cache_info()
 
         # Run build
+        isos_before = self.list_isos()
         success = self.run_build()
 
+        self.profiler.begin("post_build", self.profiler.sample_process)
         if success:
+            self.record_build(build_key, isos_before)
+            self.mark_built_packages_used()
+            self.prune_cache()
             self.print_colored("\n=== Build finished! ===", Colors.GREEN)
             self.print_colored(f"Check directory: {self.project_dir}", Colors.YELLOW)
             self.print_colored(f"Project: {self.project_name} v{self.version}", Colors.YELLOW)
@@ -575,6 +1725,172 @@ ls -la /output/
         return success
 
 
+class MatrixBuild:
+    """Build several saved configurations in parallel on a shared base rootfs"""
+
+    def __init__(self, config_files: List[str], jobs: int = 2):
+        self.jobs = jobs
+        self.work_root = Path.cwd() / "archiso_matrix"
+        self.base_dir = self.work_root / "matrix-base"
+        self.cache = ArchISOBuilder()  # Owner of the shared pacman cache
+        self.builders: List[ArchISOBuilder] = []
+
+        for filepath in config_files:
+            config = json.loads(Path(filepath).read_text())
+            builder = ArchISOBuilder(config.get("project_name", Path(filepath).stem),
+                                     config.get("version", "1.0"))
+            builder.load_config(filepath)
+            if any(b.project_name == builder.project_name for b in self.builders):
+                raise ValueError(f"Duplicate project name '{builder.project_name}' in matrix")
+
+            name = builder.project_name
+            builder.work_dir = self.work_root / name
+            builder.stage_state_file = builder.work_dir / ".stage-inputs.json"
+            builder.cache_dir = self.cache.cache_dir / ".variants" / name
+            builder.cache_index_file = builder.cache_dir / ".cache-index.json"
+            builder.shared_cache_dir = self.cache.cache_dir
+            builder.base_rootfs_dir = self.base_dir
+            builder.warm_container = f"archiso-builder-warm-{name}"  # Mounts differ per variant
+            builder.log_label = name
+            self.builders.append(builder)
+
+    @contextmanager
+    def cache_lock(self):
+        """Exclusive lock for writers of the shared package cache"""
+        with open(self.cache.cache_dir / ".lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def get_common_packages(self) -> List[str]:
+        """Packages every variant installs"""
+        common = set(self.builders[0].get_packages_list())
+        for builder in self.builders[1:]:
+            common &= set(builder.get_packages_list())
+        return sorted(common)
+
+    def build_base(self) -> bool:
+        """Install the shared base rootfs unless it is already current"""
+        common = self.get_common_packages()
+        image_tag = self.cache.get_docker_image_tag()
+        key = hashlib.sha256("\n".join([image_tag, *common]).encode()).hexdigest()
+
+        key_file = self.base_dir / ".base-key"
+        if key_file.exists() and key_file.read_text().strip() == key:
+            self.cache.print_colored("Shared base rootfs is up to date", Colors.GREEN)
+            return True
+
+        self.cache.print_colored(f"Installing shared base rootfs ({len(common)} common packages)...",
+                                 Colors.YELLOW)
+        script = f'''
+set -e
+# Variants were layered on the old base, they start over too
+find /matrix -mindepth 1 -maxdepth 1 -exec rm -rf {{}} +
+mkdir -p /matrix/matrix-base/airootfs
+pacstrap -c -G -M /matrix/matrix-base/airootfs $(grep -v '^#' packages.x86_64 | grep .) {" ".join(common)}
+echo {key} > /matrix/matrix-base/.base-key
+'''
+        with self.cache_lock():
+            result = subprocess.run([
+                "docker", "run", "--rm", "--privileged",
+                "-v", f"{self.work_root}:/matrix",
+                "-v", f"{self.cache.cache_dir}:/var/cache/pacman/pkg",
+                image_tag, "bash", "-c", script
+            ], check=False)
+        if result.returncode != 0:
+            logger.error("Failed to install shared base rootfs")
+            return False
+        return True
+
+    def merge_variant_cache(self, builder: ArchISOBuilder) -> None:
+        """Move packages a variant downloaded into the shared cache"""
+        moved = 0
+        with self.cache_lock():
+            with os.scandir(builder.cache_dir) as entries:
+                for entry in entries:
+                    if ".pkg.tar." not in entry.name or entry.name.endswith(".part"):
+                        continue
+                    target = self.cache.cache_dir / entry.name
+                    if target.exists():
+                        os.unlink(entry.path)
+                    else:
+                        os.replace(entry.path, target)
+                        moved += 1
+            self.cache.update_cache_index()
+            # Packages the variant installed straight from the shared cache
+            self.cache.mark_built_packages_used(
+                builder.work_dir / "iso" / "arch" / "pkglist.x86_64.txt")
+        logger.info(f"[{builder.project_name}] Merged {moved} packages into shared cache")
+
+    def build_variant(self, builder: ArchISOBuilder) -> tuple:
+        """Build one variant, return (success, seconds)"""
+        start = time.monotonic()
+        try:
+            success = builder.build()
+        finally:
+            self.merge_variant_cache(builder)
+        return success, time.monotonic() - start
+
+    def run(self) -> bool:
+        """Build all variants"""
+        self.cache.print_colored(f"\n=== Matrix build: {len(self.builders)} variants, "
+                                 f"{self.jobs} at a time ===", Colors.GREEN)
+        if not self.cache.check_docker():
+            self.cache.print_colored("Docker is not installed!", Colors.RED)
+            return False
+
+        self.work_root.mkdir(exist_ok=True)
+        self.cache.cache_dir.mkdir(exist_ok=True)
+        for builder in self.builders:
+            builder.cache_dir.mkdir(parents=True, exist_ok=True)
+
+        if not self.cache.build_docker_image() or not self.build_base():
+            return False
+
+        results = {}
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            futures = {pool.submit(self.build_variant, b): b for b in self.builders}
+            for future in as_completed(futures):
+                builder = futures[future]
+                try:
+                    results[builder.project_name] = future.result()
+                except Exception as e:
+                    logger.error(f"[{builder.project_name}] {e}")
+                    results[builder.project_name] = (False, 0.0)
+
+        if self.cache.cache_max_size or self.cache.cache_keep_versions:
+            with self.cache_lock():
+                self.cache.prune_cache()
+
+        self.cache.print_colored("\n=== Matrix Results ===", Colors.BLUE)
+        for name, (success, seconds) in results.items():
+            color = Colors.GREEN if success else Colors.RED
+            self.cache.print_colored(f"{name:<24} {'OK' if success else 'FAILED':<8} {seconds:>8.1f}s",
+                                     color)
+        return all(success for success, _ in results.values())
+
+
+def configure_builder(builder: ArchISOBuilder, args) -> None:
+    """Apply the build options shared by single and matrix builds"""
+    builder.use_build_cache = not args.no_build_cache
+    builder.prefetch = args.prefetch
+    builder.cache_max_size = args.cache_max_size
+    builder.show_profile = args.profile
+    builder.verbose = args.verbose
+    builder.warm = args.warm
+    if args.dev:
+        builder.enable_dev_profile()
+    builder.warm_max_builds = args.warm_max_builds
+    builder.cache_keep_versions = args.cache_keep_versions
+    builder.prefetch_workers = args.prefetch_workers
+    if args.mirror:
+        builder.mirror = args.mirror
+    if args.squashfs_sort:
+        builder.squashfs_sort_file = Path(args.squashfs_sort)
+
+
 def main():
     """Main function"""
     parser = argparse.ArgumentParser(description="Build Arch ISO with Docker (with caching)")
@@ -600,10 +1916,58 @@ def main():
                        help="Show cache information")
     parser.add_argument("--build", action="store_true", default=True,
                        help="Build the ISO (default action)")
+    parser.add_argument("--no-build-cache", action="store_true",
+                       help="Rebuild even if an ISO for identical inputs exists")
+    parser.add_argument("--prefetch", action="store_true",
+                       help="Download missing packages in parallel before building")
+    parser.add_argument("--prefetch-only", action="store_true",
+                       help="Only prefetch packages into the cache, don't build")
+    parser.add_argument("--prefetch-workers", type=int, default=8,
+                       help="Concurrent package downloads (default: 8)")
+    parser.add_argument("--cache-max-size", type=parse_size, default=0, metavar="SIZE",
+                       help="Evict least recently used packages above this size (e.g. 20G)")
+    parser.add_argument("--cache-keep-versions", type=int, default=0, metavar="N",
+                       help="Keep only the N most recently used versions of each package")
+    parser.add_argument("--prune-cache", action="store_true",
+                       help="Apply cache size/version limits now")
+    parser.add_argument("--warm", action="store_true",
+                       help="Build inside a long-lived builder container (docker exec)")
+    parser.add_argument("--warm-max-builds", type=int, default=20, metavar="N",
+                       help="Recycle the warm container after N builds (default: 20)")
+    parser.add_argument("--stop-warm", action="store_true",
+                       help="Remove the warm builder container")
+    parser.add_argument("--dev", action="store_true",
+                       help="Fast development profile: zstd-1 squashfs, BIOS boot only")
+    parser.add_argument("--matrix", nargs="+", metavar="CONFIG",
+                       help="Build several saved configurations in parallel")
+    parser.add_argument("--jobs", type=int, default=2,
+                       help="Concurrent variant builds in matrix mode (default: 2)")
+    parser.add_argument("--verbose", action="store_true",
+                       help="Print full container output instead of a progress line")
+    parser.add_argument("--profile", action="store_true",
+                       help="Print per-phase build timing summary")
+    parser.add_argument("--squashfs-sort", metavar="FILE",
+                       help="Order airootfs.sfs by this boot trace (scripts/boot_trace.py)")
+    parser.add_argument("--mirror",
+                       help="Mirror URL template with $repo/$arch, file:// URL or local path")
 
     args = parser.parse_args()
 
+    if args.matrix:
+        if args.dev:
+            # The dev profile has one work directory, variants need their own
+            parser.error("--dev cannot be combined with --matrix")
+        matrix = MatrixBuild(args.matrix, args.jobs)
+        for variant in matrix.builders:
+            configure_builder(variant, args)
+            # Variant caches are emptied into the shared one, which the limits apply to
+            variant.cache_max_size = variant.cache_keep_versions = 0
+        matrix.cache.cache_max_size = args.cache_max_size
+        matrix.cache.cache_keep_versions = args.cache_keep_versions
+        sys.exit(0 if matrix.run() else 1)
+
     builder = ArchISOBuilder(args.project_name, args.version)
+    configure_builder(builder, args)
 
     # Load config if specified
     if args.load_config:
@@ -626,10 +1990,23 @@ def main():
         builder.clean_work()
         return
 
+    if args.stop_warm:
+        builder.stop_warm_container()
+        return
+
+    if args.prune_cache:
+        builder.prune_cache()
+        builder.show_cache_info()
+        return
+
     if args.cache_info:
         builder.show_cache_info()
         return
 
+    if args.prefetch_only:
+        success = builder.prefetch_packages()
+        sys.exit(0 if success else 1)
+
     # List packages if requested
     if args.list_packages:
         builder.list_packages()
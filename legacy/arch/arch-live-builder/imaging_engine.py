@@ -0,0 +1,1898 @@
+#!/usr/bin/env python3
+"""
+imaging_engine.py - Disk imaging engine behind the live ISO's imaging-tools.sh
+
+Installed on the ISO as /usr/local/bin/imaging-engine. Compressed images are
+written as a run of independently compressed blocks (gzip members or zstd
+frames) compressed on all cores. Plain gzip and zstd read such a file as one
+stream, and the block index written next to it (IMAGE.idx) lets this engine
+decompress the blocks in parallel too.
+
+    imaging-engine create /dev/sda /mnt/backup/sda.img.zst --codec zstd --level 3
+    imaging-engine unpack /mnt/backup/sda.img.zst | dd of=/dev/sda bs=4M
+
+Whole disks are better backed up with 'backup', which stores the partition
+table and only the used blocks of each filesystem (partclone):
+
+    imaging-engine backup /dev/sda /mnt/backup/sda
+    imaging-engine restore /mnt/backup/sda /dev/sdb
+
+'restore' also takes a single image. It is decompressed on all cores,
+checked block by block and, with --verify, read back from the disk:
+
+    imaging-engine restore /mnt/backup/sda.img.zst /dev/sdb --verify --report restore.json
+
+Weekly backups of the same machines can share a deduplicating chunk store,
+so each one only stores the chunks that changed:
+
+    imaging-engine backup /dev/sda /mnt/backup/pc1-week42 --store /mnt/backup/chunks
+
+Several disks are imaged at once with 'batch', one at a time per shared
+SATA port or USB root hub:
+
+    imaging-engine batch /mnt/backup/server /dev/sda /dev/sdb /dev/nvme0n1 /dev/nvme1n1
+
+'duplicate' restores one image to many disks, reading and decompressing it
+once. A disk that stalls or falls far behind the others is dropped:
+
+    imaging-engine duplicate /mnt/golden/win11.img.zst /dev/sd[b-q] --verify
+
+Block devices are benchmarked for a second or two before they are read or
+written, to pick the request size, the number of requests in flight and
+O_DIRECT or the page cache for that device ('bench' shows the numbers).
+"""
+
+import os
+import re
+import sys
+import mmap
+import stat
+import errno
+import ctypes
+import zlib
+import hashlib
+import shutil
+import struct
+import subprocess
+import threading
+import time
+import queue
+import statistics
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+import json
+import logging
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+import argparse
+
+try:
+    from compression import zstd  # Python 3.14+
+except ImportError:
+    zstd = None
+DECODE_ERRORS = (zlib.error,) + ((zstd.ZstdError,) if zstd else ())
+
+# Setup logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+class Colors:
+    RED = '\033[0;31m'
+    GREEN = '\033[0;32m'
+    YELLOW = '\033[1;33m'
+    BLUE = '\033[0;34m'
+    NC = '\033[0m'  # No Color
+
+INDEX_FORMAT = "hardclone-blocks"
+INDEX_VERSION = 1
+DEFAULT_BLOCK_SIZE = 8 * 1024 * 1024
+ZERO_BLOCK = 1  # Index entry flag: the block is all zeros
+
+# Zero detection granularity, also the smallest hole in a sparse image
+ZERO_GRANULE = 64 * 1024
+ZERO_BYTES = bytes(ZERO_GRANULE)
+
+FALLOC_KEEP_SIZE = 0x01
+FALLOC_PUNCH_HOLE = 0x02 | FALLOC_KEEP_SIZE
+FALLOC_ZERO_RANGE = 0x10
+ZERO_MODES = ["auto", "discard", "zeroout", "skip", "write"]
+_libc = ctypes.CDLL(None, use_errno=True)
+_libc.fallocate.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64]
+_libc.syncfs.argtypes = [ctypes.c_int]
+
+BACKUP_FORMAT = "hardclone-disk"
+BACKUP_MANIFEST = "backup.json"
+PARTITION_TABLE = "table.sfdisk"
+DISK_HEAD = "head.img"
+CODEC_SUFFIXES = {"none": ".img", "gzip": ".gz", "zstd": ".zst"}
+
+# Content-defined chunking for the chunk store: chunks of 16 KiB to 256 KiB,
+# about 80 KiB on average for random data
+STORE_FORMAT = "hardclone-chunks"
+STORE_CONFIG = "store.json"
+STORE_LOG = "streams.jsonl"
+CHUNK_MIN = 16 * 1024
+CHUNK_MAX = 256 * 1024
+CHUNK_MASK = (1 << 8) - 1
+CHUNK_ANCHOR = b"\x8f"
+CHUNK_WINDOW = 32
+RECIPE_MAGIC = b"HCRECIPE1\n"
+RECIPE_ENTRY = struct.Struct("<32sII")  # SHA-256, chunk size, repeat count
+
+# Filesystem type (blkid) -> partclone.<tool>, which copies used blocks only
+PARTCLONE_TOOLS = {
+    "ext2": "extfs", "ext3": "extfs", "ext4": "extfs",
+    "vfat": "fat", "exfat": "exfat", "ntfs": "ntfs",
+    "btrfs": "btrfs", "xfs": "xfs", "f2fs": "f2fs", "nilfs2": "nilfs2", "hfsplus": "hfsp",
+}
+
+
+def print_colored(message: str, color: str = Colors.NC) -> None:
+    """Print colored message (stderr, stdout may carry image data)"""
+    print(f"{color}{message}{Colors.NC}", file=sys.stderr, flush=True)
+
+
+def parse_size(text: str) -> int:
+    """Parse sizes like 512K, 8M or 1G"""
+    units = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+    value = text.strip().upper().rstrip("B").rstrip("I")
+    try:
+        if value and value[-1] in units:
+            return int(float(value[:-1]) * units[value[-1]])
+        return int(value)
+    except ValueError:
+        raise ValueError(f"Invalid size '{text}' (expected e.g. 512K, 8M or 1G)") from None
+
+
+def format_bytes(count: float) -> str:
+    """Human readable byte count"""
+    for unit in ["B", "KiB", "MiB", "GiB"]:
+        if count < 1024:
+            return f"{count:.1f} {unit}"
+        count /= 1024
+    return f"{count:.1f} TiB"
+
+
+class Codec:
+    """Compresses single blocks into self-contained gzip members or zstd frames"""
+
+    def __init__(self, name: str, level: Optional[int] = None):
+        self.name = name
+        self.level = level if level is not None else {"gzip": 6, "zstd": 3}.get(name, 0)
+
+    def compress(self, data: bytes) -> bytes:
+        if self.name == "gzip":
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED, 31)  # 31: gzip header
+            return compressor.compress(data) + compressor.flush()
+        if self.name == "zstd":
+            if zstd:
+                return zstd.compress(data, level=self.level)
+            return self._run_zstd([f"-{self.level}"] + (["--ultra"] if self.level > 19 else []), data)
+        return data
+
+    def decompress(self, data: bytes) -> bytes:
+        if self.name == "gzip":
+            return zlib.decompress(data, 31)
+        if self.name == "zstd":
+            if zstd:
+                return zstd.decompress(data)
+            return self._run_zstd(["-d"], data)
+        return data
+
+    def stream_command(self) -> Optional[List[str]]:
+        """Sequential decompressor for images without an index"""
+        return {"gzip": ["gzip", "-dc"], "zstd": ["zstd", "-dcq"]}.get(self.name)
+
+    @staticmethod
+    def _run_zstd(args: List[str], data: bytes) -> bytes:
+        # Without Python bindings the zstd CLI does the work, still one block per thread
+        result = subprocess.run(["zstd", "-q", "-c"] + args, input=data, capture_output=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"zstd failed: {result.stderr.decode(errors='replace').strip()}")
+        return result.stdout
+
+
+def guess_codec(path: Path) -> str:
+    """Codec from the image file name"""
+    if path.suffix == ".gz":
+        return "gzip"
+    if path.suffix in (".zst", ".zstd"):
+        return "zstd"
+    return "none"
+
+
+def index_path(image: Path) -> Path:
+    return image.with_name(image.name + ".idx")
+
+
+def load_index(image: Path) -> Optional[Dict]:
+    """Block index of an image, None for plain streams"""
+    try:
+        index = json.loads(index_path(image).read_text())
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    if index.get("format") != INDEX_FORMAT or index.get("version", 0) > INDEX_VERSION:
+        return None
+    return index
+
+
+def get_size(fd: int) -> int:
+    """Size of a file or block device"""
+    size = os.lseek(fd, 0, os.SEEK_END)
+    os.lseek(fd, 0, os.SEEK_SET)
+    return size
+
+
+def read_blocks(fd: int, block_size: int) -> Iterator[bytes]:
+    """Read a file descriptor in full blocks (the last one may be short)"""
+    while True:
+        block = os.read(fd, block_size)
+        if not block:
+            return
+        while len(block) < block_size:
+            more = os.read(fd, block_size - len(block))
+            if not more:
+                break
+            block += more
+        yield block
+
+
+def ordered_map(pool: ThreadPoolExecutor, func: Callable, items: Iterable,
+                window: int) -> Iterator:
+    """pool.map with at most window items in flight, results in input order"""
+    pending = deque()
+    for item in items:
+        pending.append(pool.submit(func, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def write_all(fd: int, data) -> None:
+    view = memoryview(data)
+    while view:
+        written = os.write(fd, view)
+        view = view[written:]
+
+
+def is_zero(block: bytes) -> bool:
+    """True if block is all zeros (memcmp per granule, no copies)"""
+    for start in range(0, len(block), ZERO_GRANULE):
+        end = min(start + ZERO_GRANULE, len(block))
+        if not block.startswith(ZERO_BYTES if end - start == ZERO_GRANULE
+                                else ZERO_BYTES[:end - start], start, end):
+            return False
+    return True
+
+
+def data_runs(block: bytes) -> List[Tuple[int, int]]:
+    """(start, end) of the parts of block that are not zero granules"""
+    runs = []
+    for start in range(0, len(block), ZERO_GRANULE):
+        end = min(start + ZERO_GRANULE, len(block))
+        if block.startswith(ZERO_BYTES[:end - start], start, end):
+            continue
+        if runs and runs[-1][1] == start:
+            runs[-1] = (runs[-1][0], end)
+        else:
+            runs.append((start, end))
+    return runs
+
+
+def write_at(fd: int, data, offset: int) -> None:
+    view = memoryview(data)
+    while view:
+        written = os.pwrite(fd, view, offset)
+        view = view[written:]
+        offset += written
+
+
+def fallocate(fd: int, mode: int, offset: int, length: int) -> None:
+    """fallocate(2), which os does not expose with modes"""
+    if _libc.fallocate(fd, mode, offset, length) != 0:
+        error = ctypes.get_errno()
+        raise OSError(error, os.strerror(error))
+
+
+def default_zero_mode(path: str) -> str:
+    """discard on SSDs and for files (holes), zeroout on spinning disks"""
+    if not is_block_device(path):
+        return "discard"
+    return "zeroout" if is_rotational(path) else "discard"
+
+
+class Progress:
+    """Throughput line on stderr, refreshed once a second"""
+
+    board: Optional["ProgressBoard"] = None  # Set during batch runs, replaces the line
+
+    def __init__(self, label: str, total: int = 0):
+        self.label = label
+        self.total = total
+        self.done = 0
+        self.started = time.monotonic()
+        self.last = 0.0
+        self.job = getattr(ProgressBoard.current, "job", None)
+        self.enabled = sys.stderr.isatty() and Progress.board is None
+
+    def rate(self) -> float:
+        return self.done / max(time.monotonic() - self.started, 1e-6)
+
+    def update(self, count: int) -> None:
+        self.done += count
+        if Progress.board:
+            Progress.board.add(self.job, count)
+        now = time.monotonic()
+        if self.enabled and now - self.last >= 1:
+            self.last = now
+            total = f" / {format_bytes(self.total)}" if self.total else ""
+            sys.stderr.write(f"\r{self.label}: {format_bytes(self.done)}{total}  "
+                             f"{format_bytes(self.rate())}/s   ")
+            sys.stderr.flush()
+
+    def finish(self) -> float:
+        if self.enabled:
+            sys.stderr.write("\r\033[K")
+        return time.monotonic() - self.started
+
+
+class ProgressBoard:
+    """Per-job and aggregate throughput of concurrent jobs on one stderr line"""
+
+    current = threading.local()  # .job: name of the job the calling thread works for
+
+    def __init__(self, jobs: List[str], interval: float = 2.0):
+        self.jobs = jobs
+        self.interval = interval
+        self.done = {job: 0 for job in jobs}
+        self.state = {job: "queued" for job in jobs}
+        self._reported = dict(self.done)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def add(self, job: Optional[str], count: int) -> None:
+        if job in self.done:
+            with self._lock:
+                self.done[job] += count
+
+    def set_state(self, job: str, state: str) -> None:
+        self.state[job] = state
+
+    def line(self, seconds: float) -> str:
+        """Throughput since the previous line"""
+        with self._lock:
+            rates = {job: (self.done[job] - self._reported[job]) / seconds for job in self.jobs}
+            self._reported = dict(self.done)
+        parts = [f"{job} {format_bytes(rates[job])}/s" if self.state[job] == "running"
+                 else f"{job} {self.state[job]}" for job in self.jobs]
+        return f"{' | '.join(parts)} | total {format_bytes(sum(rates.values()))}/s"
+
+    def _run(self) -> None:
+        last = time.monotonic()
+        while not self._stop.wait(self.interval):
+            now = time.monotonic()
+            line = self.line(now - last)
+            last = now
+            if sys.stderr.isatty():
+                sys.stderr.write(f"\r\033[K{line}")
+                sys.stderr.flush()
+            else:
+                print(line, file=sys.stderr, flush=True)
+
+    def __enter__(self) -> "ProgressBoard":
+        Progress.board = self
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        self._thread.join()
+        Progress.board = None
+        if sys.stderr.isatty():
+            sys.stderr.write("\r\033[K")
+
+
+class IOSettings:
+    """Request size, requests in flight and page cache use for one device"""
+
+    def __init__(self, request_size: int = 4 * 1024 * 1024, queue_depth: int = 1,
+                 direct: bool = False):
+        self.request_size = request_size
+        self.queue_depth = queue_depth
+        self.direct = direct
+        self.measured = 0.0  # Bytes/s reached while tuning
+
+    def __str__(self) -> str:
+        return (f"{format_bytes(self.request_size)} requests, queue depth {self.queue_depth}, "
+                f"{'O_DIRECT' if self.direct else 'buffered'}")
+
+
+def aligned_buffer(size: int) -> mmap.mmap:
+    """Page-aligned buffer, as O_DIRECT requires"""
+    return mmap.mmap(-1, max(size, mmap.PAGESIZE))
+
+
+def open_device(path: str, flags: int, direct: bool) -> int:
+    """Open with O_DIRECT if asked and supported (tmpfs and some FUSE filesystems refuse it)"""
+    if direct:
+        try:
+            return os.open(path, flags | os.O_DIRECT)
+        except OSError:
+            pass
+    return os.open(path, flags)
+
+
+def is_block_device(path: str) -> bool:
+    try:
+        return stat.S_ISBLK(os.stat(path).st_mode)
+    except OSError:
+        return False
+
+
+def block_queue_value(path: str, attribute: str) -> Optional[str]:
+    """A /sys/class/block/*/queue attribute of a block device"""
+    name = Path(os.path.realpath(path)).name
+    sysfs = Path(os.path.realpath(f"/sys/class/block/{name}"))
+    for queue_dir in (sysfs / "queue", sysfs.parent / "queue"):  # Partitions use the disk's
+        if (queue_dir / attribute).exists():
+            return (queue_dir / attribute).read_text().strip()
+    return None
+
+
+def is_rotational(path: str) -> bool:
+    return block_queue_value(path, "rotational") == "1"
+
+
+def logical_block_size(path: str) -> int:
+    """Alignment of O_DIRECT writes and device fallocate ranges on path"""
+    if is_block_device(path):
+        return int(block_queue_value(path, "logical_block_size") or 512)
+    return os.stat(path).st_blksize
+
+
+_read_buffers = threading.local()  # One aligned buffer per reading thread
+
+
+def pread_aligned(fd: int, size: int, offset: int) -> bytes:
+    buffer = getattr(_read_buffers, "buffer", None)
+    if buffer is None or len(buffer) < size:
+        if buffer is not None:
+            buffer.close()
+        buffer = _read_buffers.buffer = aligned_buffer(size)
+    view = memoryview(buffer)[:max(size, mmap.PAGESIZE)]
+    try:
+        count = os.preadv(fd, [view], offset)
+    finally:
+        view.release()
+    return buffer[:count]
+
+
+class DeviceReader:
+    """Sequential reads of a device issued as parallel aligned requests"""
+
+    def __init__(self, path: str, settings: Optional[IOSettings] = None, limit: int = 0):
+        self.path = path
+        self.settings = settings or IOSettings()
+        self.limit = limit  # Read only this many bytes from the start, 0: all
+
+    def blocks(self) -> Iterator[bytes]:
+        """The device's data in request-sized pieces, in order"""
+        fd = open_device(self.path, os.O_RDONLY, self.settings.direct)
+        try:
+            size = get_size(fd)
+            if self.limit:
+                size = min(size, self.limit)
+            request = self.settings.request_size
+            if self.settings.queue_depth == 1:
+                for offset in range(0, size, request):
+                    data = pread_aligned(fd, request, offset)
+                    if not data:
+                        return
+                    yield data[:size - offset]
+                return
+            with ThreadPoolExecutor(max_workers=self.settings.queue_depth) as pool:
+                for offset, data in zip(range(0, size, request), ordered_map(
+                        pool, lambda offset: pread_aligned(fd, request, offset),
+                        range(0, size, request), self.settings.queue_depth)):
+                    if not data:
+                        return
+                    yield data[:size - offset]
+        finally:
+            os.close(fd)
+
+
+class DeviceWriter:
+    """Sequential writes to a device as parallel, aligned, request-sized writes
+
+    All-zero requests are not written. Depending on zero_mode they become
+    holes or TRIMmed ranges (discard: fallocate PUNCH_HOLE, which reads
+    back as zeros on devices and files alike), zeroed ranges the device
+    clears itself (zeroout), nothing at all on targets known to be zero
+    (skip), or ordinary writes (write).
+    """
+
+    def __init__(self, path: str, settings: Optional[IOSettings] = None, zero_mode: str = "auto"):
+        self.path = path
+        self.settings = settings or IOSettings()
+        self.zero_mode = default_zero_mode(path) if zero_mode == "auto" else zero_mode
+        self.zero_size = 0  # Bytes of zeros not written
+        self._alignment = 0
+
+    def clear(self, fd: int, offset: int, length: int) -> None:
+        """Make a range read back as zeros without writing it"""
+        self.zero_size += length
+        if self.zero_mode == "skip":
+            return
+        if not self._alignment:
+            self._alignment = logical_block_size(self.path)
+        end = offset + length
+        start = min(-(-offset // self._alignment) * self._alignment, end)
+        stop = max(end // self._alignment * self._alignment, start)
+        # Unaligned ends (the end of a short stream) are neither valid for
+        # O_DIRECT writes nor for device fallocate, zero them through the page cache
+        for at, size in ((offset, start - offset), (stop, end - stop)):
+            if size:
+                self.zero_size -= size
+                with open(self.path, "r+b") as f:
+                    f.seek(at)
+                    f.write(bytes(size))
+                    f.flush()
+                    os.fsync(f.fileno())
+        if stop > start:
+            self.clear_aligned(fd, start, stop - start)
+
+    def clear_aligned(self, fd: int, offset: int, length: int) -> None:
+        while self.zero_mode in ("discard", "zeroout"):
+            mode = FALLOC_PUNCH_HOLE if self.zero_mode == "discard" else FALLOC_ZERO_RANGE
+            try:
+                fallocate(fd, mode, offset, length)
+                return
+            except OSError as e:
+                if e.errno == errno.EINVAL:
+                    # Refused for this range only, the mode may still work for others
+                    logger.debug(f"{self.path}: {self.zero_mode} refused at {offset}+{length}")
+                    break
+                if e.errno not in (errno.EOPNOTSUPP, errno.ENOTTY):
+                    raise
+                fallback = "zeroout" if self.zero_mode == "discard" else "write"
+                logger.info(f"{self.path}: {self.zero_mode} not supported, using {fallback}")
+                self.zero_mode = fallback
+        self.zero_size -= length
+        zeros = aligned_buffer(min(length, self.settings.request_size))
+        try:
+            for at in range(offset, offset + length, len(zeros)):
+                os.pwritev(fd, [memoryview(zeros)[:min(len(zeros), offset + length - at)]], at)
+        finally:
+            zeros.close()
+
+    def write(self, blocks: Iterable[bytes], progress: Optional[Progress] = None) -> int:
+        """Write a stream from offset 0, return bytes written"""
+        request = self.settings.request_size
+        fd = open_device(self.path, os.O_WRONLY, self.settings.direct)
+        offset = 0
+        zero_start = None
+        tail = b""
+        pending = deque()
+
+        def flush(data: mmap.mmap, at: int) -> None:
+            try:
+                os.pwritev(fd, [data], at)
+            finally:
+                data.close()
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.settings.queue_depth) as pool:
+                for piece in rechunk(blocks, request):
+                    if self.zero_mode != "write" and is_zero(piece):
+                        if zero_start is None:
+                            zero_start = offset
+                    else:
+                        if zero_start is not None:
+                            self.clear(fd, zero_start, offset - zero_start)
+                            zero_start = None
+                        if len(piece) < request:
+                            tail = piece  # Only the last piece can be short
+                        else:
+                            buffer = aligned_buffer(request)
+                            buffer[:] = piece
+                            pending.append(pool.submit(flush, buffer, offset))
+                            if len(pending) >= self.settings.queue_depth:
+                                pending.popleft().result()
+                    offset += len(piece)
+                    if progress:
+                        progress.update(len(piece))
+                while pending:
+                    pending.popleft().result()
+            if zero_start is not None:
+                self.clear(fd, zero_start, offset - zero_start)
+            if tail:
+                # The tail may not be sector aligned, write it through the page cache
+                with open(self.path, "r+b") as f:
+                    f.seek(offset - len(tail))
+                    f.write(tail)
+                    f.flush()
+                    os.fsync(f.fileno())
+            if stat.S_ISREG(os.fstat(fd).st_mode) and os.fstat(fd).st_size < offset:
+                os.ftruncate(fd, offset)  # Trailing zeros of a file stay a hole
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        return offset
+
+
+class IOTuner:
+    """Pick request size, queue depth and O_DIRECT for a device by measuring it
+
+    Each trial runs for a fraction of a second on a different region of the
+    device, so no trial reads what the page cache kept from the one before.
+    """
+
+    REQUEST_SIZES = [256 * 1024, 1024 * 1024, 4 * 1024 * 1024, 16 * 1024 * 1024]
+    QUEUE_DEPTHS = [1, 2, 4, 8, 16, 32]
+
+    def __init__(self, path: str, trial_seconds: float = 0.3, write: bool = False,
+                 write_limit: int = 0):
+        self.path = path
+        self.trial_seconds = trial_seconds
+        self.write = write  # Destructive, only for targets about to be overwritten
+        self.write_limit = write_limit  # Stay inside the region that will be written
+        self.results: List[tuple] = []
+        self._next_offset = 0
+
+    def trial(self, settings: IOSettings) -> float:
+        """Bytes/s for one combination"""
+        fd = open_device(self.path, os.O_RDWR if self.write else os.O_RDONLY, settings.direct)
+        try:
+            size = get_size(fd)
+            if self.write and self.write_limit:
+                size = min(size, self.write_limit)
+            request = settings.request_size
+            # Writes stay whole requests inside size, reads may cover a short device
+            span = size // request if self.write else max(size // request, 1)
+            if not span:
+                self.results.append((str(settings), 0.0))
+                return 0.0
+            start = self._next_offset % span
+            self._next_offset += span // 7 + 1  # Walk the device between trials
+            if not settings.direct and hasattr(os, "posix_fadvise"):
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+            payload = aligned_buffer(request)
+
+            def one(index: int) -> int:
+                offset = ((start + index) % span) * request
+                if self.write:
+                    return os.pwritev(fd, [payload], offset)
+                return len(pread_aligned(fd, request, offset))
+
+            done = 0
+            started = time.monotonic()
+            index = 0
+            with ThreadPoolExecutor(max_workers=settings.queue_depth) as pool:
+                while time.monotonic() - started < self.trial_seconds and index < span:
+                    batch = range(index, min(index + settings.queue_depth, span))
+                    done += sum(pool.map(one, batch))
+                    index += len(batch)
+            if self.write:
+                os.fsync(fd)
+            payload.close()
+            rate = done / max(time.monotonic() - started, 1e-6)
+        finally:
+            os.close(fd)
+        self.results.append((str(settings), rate))
+        return rate
+
+    def tune(self) -> IOSettings:
+        """Best settings found: request size first, then queue depth, then O_DIRECT"""
+        rotational = is_rotational(self.path)
+        direct = True
+        try:
+            os.close(os.open(self.path, os.O_RDONLY | os.O_DIRECT))
+        except OSError:
+            direct = False
+        depths = [1, 2] if rotational else self.QUEUE_DEPTHS
+        sizes = self.REQUEST_SIZES
+        if self.write and self.write_limit:
+            # A larger request would write past the region about to be overwritten
+            sizes = [size for size in sizes if size <= self.write_limit] or sizes[:1]
+
+        best = max((IOSettings(size, 2 if rotational else 4, direct) for size in sizes),
+                   key=self.trial)
+        best = max((IOSettings(best.request_size, depth, direct) for depth in depths),
+                   key=self.trial)
+        best.measured = dict(self.results)[str(best)]
+        if direct:
+            buffered = IOSettings(best.request_size, best.queue_depth, False)
+            buffered.measured = self.trial(buffered)
+            if buffered.measured > best.measured:
+                best = buffered
+        return best
+
+
+def tune_device(path: str, write: bool = False, write_limit: int = 0) -> IOSettings:
+    """Tuned settings for a block device, defaults for plain files"""
+    if not is_block_device(path):
+        return IOSettings()
+    if write and write_limit and write_limit < IOTuner.REQUEST_SIZES[0]:
+        return IOSettings()  # Too little is written to tune for, or to trial on
+    settings = IOTuner(path, write=write, write_limit=write_limit).tune()
+    print_colored(f"Tuned {path}: {settings} ({format_bytes(settings.measured)}/s measured)",
+                  Colors.BLUE)
+    return settings
+
+
+def rechunk(blocks: Iterable[bytes], size: int) -> Iterator[bytes]:
+    """Regroup a stream into pieces of exactly size bytes (the last may be short)"""
+    pending = []  # Less than size bytes carried over from earlier blocks
+    pending_size = 0
+    for block in blocks:
+        if not pending and len(block) == size:
+            yield block
+            continue
+        start = 0
+        if pending:
+            # Only a piece spanning block boundaries is joined
+            need = size - pending_size
+            if len(block) < need:
+                pending.append(block)
+                pending_size += len(block)
+                continue
+            yield b"".join(pending + [block[:need]])
+            pending = []
+            pending_size = 0
+            start = need
+        while len(block) - start >= size:
+            yield block[start:start + size]
+            start += size
+        if start < len(block):
+            pending = [block[start:]]
+            pending_size = len(block) - start
+    if pending:
+        yield b"".join(pending)
+
+
+class ImageWriter:
+    """Compress a source into a block-framed image on a thread pool"""
+
+    def __init__(self, codec: Codec, threads: int = 0, block_size: int = DEFAULT_BLOCK_SIZE):
+        self.codec = codec
+        self.threads = threads or os.cpu_count() or 1
+        self.block_size = block_size
+        self.tune = True  # Benchmark block device sources before reading them
+        self._zero_blocks: Dict[int, tuple] = {}
+
+    def compress_block(self, block: bytes) -> tuple:
+        if is_zero(block):
+            # Common on fresh disks: compress each zero block size only once
+            if len(block) not in self._zero_blocks:
+                self._zero_blocks[len(block)] = (self.codec.compress(block), zlib.crc32(block))
+            data, crc = self._zero_blocks[len(block)]
+            return data, len(block), crc, True
+        return self.codec.compress(block), len(block), zlib.crc32(block), False
+
+    def write(self, blocks: Iterable[bytes], image: Path, progress: Progress) -> Dict:
+        """Write the image and its index from a stream of raw blocks, return the index"""
+        dst = os.open(image, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        index_blocks = []
+        offset = 0
+        zero_size = 0
+        try:
+            with ThreadPoolExecutor(max_workers=self.threads) as pool:
+                for data, raw_size, crc, zero in ordered_map(pool, self.compress_block, blocks,
+                                                             self.threads * 2):
+                    if zero:
+                        zero_size += raw_size
+                        if self.codec.name != "none":
+                            write_at(dst, data, offset)
+                    elif self.codec.name == "none":
+                        # Raw images are sparse: zero granules stay holes
+                        written = 0
+                        for start, end in data_runs(data):
+                            write_at(dst, memoryview(data)[start:end], offset + start)
+                            written += end - start
+                        zero_size += raw_size - written
+                    else:
+                        write_at(dst, data, offset)
+                    index_blocks.append([offset, len(data), raw_size, crc] +
+                                        ([ZERO_BLOCK] if zero else []))
+                    offset += len(data)
+                    progress.update(raw_size)
+            os.ftruncate(dst, offset)
+        finally:
+            os.close(dst)
+
+        index = {
+            "format": INDEX_FORMAT,
+            "version": INDEX_VERSION,
+            "codec": self.codec.name,
+            "level": self.codec.level,
+            "block_size": self.block_size,
+            "size": progress.done,
+            "compressed_size": offset,
+            "zero_size": zero_size,
+            "seconds": round(progress.finish(), 3),
+            # [image offset, compressed length, raw length, crc32(, ZERO_BLOCK)]
+            "blocks": index_blocks,
+        }
+        index_path(image).write_text(json.dumps(index))
+        return index
+
+    def create(self, source: str, image: Path) -> Dict:
+        """Image a device or file"""
+        settings = tune_device(source) if self.tune else IOSettings()
+        reader = DeviceReader(source, settings)
+        return self.write(rechunk(reader.blocks(), self.block_size), image,
+                          Progress(f"Reading {source}", device_size(source)))
+
+    def create_from_command(self, command: List[str], image: Path, label: str,
+                            log: Path) -> Dict:
+        """Image the stdout of a command such as partclone"""
+        with open(log, "w") as log_file:
+            process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=log_file)
+            try:
+                index = self.write(read_blocks(process.stdout.fileno(), self.block_size), image,
+                                   Progress(label))
+            finally:
+                process.stdout.close()
+                status = process.wait()
+        if status != 0:
+            raise RuntimeError(f"{command[0]} failed with status {status}, see {log}")
+        return index
+
+
+class ImageReader:
+    """Decompress an image in parallel using its block index"""
+
+    def __init__(self, image: Path, threads: int = 0):
+        self.image = image
+        self.threads = threads or os.cpu_count() or 1
+        self.index = load_index(image)
+        self.codec = Codec(self.index["codec"] if self.index else guess_codec(image))
+        # What catches corrupt data while it is read
+        self.checks = "block CRC-32" if self.index else \
+            {"gzip": "gzip CRC-32", "zstd": "zstd checksum"}.get(self.codec.name, "none")
+
+    @property
+    def size(self) -> int:
+        """Raw size, 0 if unknown before decompressing"""
+        if self.index:
+            return self.index["size"]
+        return self.image.stat().st_size if self.codec.name == "none" else 0
+
+    def read_block(self, fd: int, entry: List[int]) -> bytes:
+        offset, length, raw_size, crc, *flags = entry
+        if flags and flags[0] & ZERO_BLOCK:
+            return bytes(raw_size)
+        try:
+            data = self.codec.decompress(os.pread(fd, length, offset))
+        except DECODE_ERRORS:
+            data = b""
+        if len(data) != raw_size or zlib.crc32(data) != crc:
+            raise RuntimeError(f"Block at image offset {offset} is corrupt")
+        return data
+
+    def blocks(self) -> Iterator[bytes]:
+        """Raw data of the image, in order"""
+        if self.index:
+            fd = os.open(self.image, os.O_RDONLY)
+            try:
+                with ThreadPoolExecutor(max_workers=self.threads) as pool:
+                    yield from ordered_map(pool, lambda entry: self.read_block(fd, entry),
+                                           self.index["blocks"], self.threads * 2)
+            finally:
+                os.close(fd)
+            return
+
+        # No index: a plain image or someone else's gzip/zstd file
+        command = self.codec.stream_command()
+        if command is None:
+            fd = os.open(self.image, os.O_RDONLY)
+            try:
+                yield from read_blocks(fd, DEFAULT_BLOCK_SIZE)
+            finally:
+                os.close(fd)
+            return
+        logger.warning(f"No block index for {self.image}, decompressing on one core")
+        with open(self.image, "rb") as f:
+            process = subprocess.Popen(command, stdin=f, stdout=subprocess.PIPE)
+            try:
+                yield from read_blocks(process.stdout.fileno(), DEFAULT_BLOCK_SIZE)
+            finally:
+                process.stdout.close()
+                if process.wait() != 0:
+                    raise RuntimeError(f"{command[0]} failed on {self.image}")
+
+
+def chunk_stream(blocks: Iterable[bytes], min_size: int = CHUNK_MIN, max_size: int = CHUNK_MAX,
+                 mask: int = CHUNK_MASK) -> Iterator[bytes]:
+    """Split a stream into content-defined chunks
+
+    A chunk ends after an anchor byte whose preceding window hashes to zero
+    under the mask, so an insertion only changes the chunks around it and
+    the rest of the stream chunks (and deduplicates) exactly as before.
+    Candidates are found with bytes.find and hashed with crc32, both in C,
+    which keeps this fast enough for disk streams in pure Python. Runs
+    without anchors (zeros, for one) are cut at max_size.
+    """
+    buffer = b""
+    for block in blocks:
+        buffer = buffer + block if buffer else block
+        start = 0
+        while True:
+            limit = start + max_size
+            end = min(limit, len(buffer))
+            cut = None
+            position = buffer.find(CHUNK_ANCHOR, start + min_size, end)
+            while position != -1:
+                if zlib.crc32(buffer[position - CHUNK_WINDOW:position]) & mask == 0:
+                    cut = position + 1
+                    break
+                position = buffer.find(CHUNK_ANCHOR, position + 1, end)
+            if cut is None:
+                if limit > len(buffer):
+                    break  # Need more data to decide
+                cut = limit
+            yield buffer[start:cut]
+            start = cut
+        buffer = buffer[start:]
+    if buffer:
+        yield buffer
+
+
+class ChunkStore(ImageWriter):
+    """Deduplicating store of compressed chunks named by their SHA-256
+
+    Images written here become recipes: the list of chunk hashes that
+    rebuild the stream. Chunks already in the store are not written again,
+    so repeated backups of the same machine only add what changed.
+    """
+
+    def __init__(self, root: Path, codec: Optional[Codec] = None, threads: int = 0):
+        config_file = root / STORE_CONFIG
+        if config_file.exists():
+            config = json.loads(config_file.read_text())
+            codec = Codec(config["codec"], config["level"])
+        else:
+            codec = codec or Codec("zstd")
+            (root / "chunks").mkdir(parents=True, exist_ok=True)
+            config_file.write_text(json.dumps({"format": STORE_FORMAT, "version": INDEX_VERSION,
+                                               "codec": codec.name, "level": codec.level}))
+        super().__init__(codec, threads)
+        self.root = root
+        self._lock = threading.Lock()
+        self._writing: Dict[bytes, Future] = {}  # Chunks being written, done when on disk
+
+    def chunk_path(self, digest: bytes) -> Path:
+        name = digest.hex()
+        return self.root / "chunks" / name[:2] / name[2:]
+
+    def store_chunk(self, chunk: bytes) -> tuple:
+        """Add a chunk unless present, return (digest, size, bytes stored)"""
+        digest = hashlib.sha256(chunk).digest()
+        path = self.chunk_path(digest)
+        with self._lock:
+            writing = self._writing.get(digest)
+            if writing is None:
+                if path.exists():
+                    return digest, len(chunk), 0
+                self._writing[digest] = Future()
+        if writing is not None:
+            # Another stream is writing it: only its outcome says whether it is stored
+            writing.result()
+            return digest, len(chunk), 0
+        temp = path.with_name(f".{path.name}.{threading.get_ident()}")
+        try:
+            data = self.codec.compress(chunk)
+            path.parent.mkdir(exist_ok=True)
+            temp.write_bytes(data)
+            os.replace(temp, path)  # Readers never see half a chunk
+            self._writing[digest].set_result(None)
+        except BaseException as e:
+            # ENOSPC and the like: the chunk is not stored, nor must it look so
+            temp.unlink(missing_ok=True)
+            self._writing[digest].set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._writing[digest]
+        return digest, len(chunk), len(data)
+
+    def sync(self) -> None:
+        """Flush chunks to disk, before a recipe refers to them"""
+        fd = os.open(self.root, os.O_RDONLY)
+        try:
+            # One syncfs instead of an fsync per chunk and chunk directory
+            if _libc.syncfs(fd) != 0:
+                error = ctypes.get_errno()
+                raise OSError(error, os.strerror(error))
+        finally:
+            os.close(fd)
+
+    def load_chunk(self, digest: bytes) -> bytes:
+        chunk = self.codec.decompress(self.chunk_path(digest).read_bytes())
+        if hashlib.sha256(chunk).digest() != digest:
+            raise RuntimeError(f"Chunk {digest.hex()} is corrupt")
+        return chunk
+
+    def write(self, blocks: Iterable[bytes], recipe: Path, progress: Progress) -> Dict:
+        """Store a stream and write its recipe, return the stream's stats"""
+        stats = {"chunks": 0, "new_chunks": 0, "stored_size": 0}
+        entries = []  # [digest, size, repeat], runs of one chunk (zeros) kept as one entry
+        with ThreadPoolExecutor(max_workers=self.threads) as pool:
+            for digest, size, stored in ordered_map(pool, self.store_chunk, chunk_stream(blocks),
+                                                    self.threads * 4):
+                stats["chunks"] += 1
+                if stored:
+                    stats["new_chunks"] += 1
+                    stats["stored_size"] += stored
+                if entries and entries[-1][0] == digest and entries[-1][1] == size:
+                    entries[-1][2] += 1
+                else:
+                    entries.append([digest, size, 1])
+                progress.update(size)
+
+        self.sync()
+        with open(recipe, "wb") as f:
+            f.write(RECIPE_MAGIC)
+            for digest, size, repeat in entries:
+                f.write(RECIPE_ENTRY.pack(digest, size, repeat))
+            f.flush()
+            os.fsync(f.fileno())
+        stats.update(size=progress.done, seconds=round(progress.finish(), 3),
+                     store=str(self.root.resolve()))
+        with self._lock, open(self.root / STORE_LOG, "a") as log:
+            log.write(json.dumps({"recipe": str(recipe.resolve()), "date": time.time(),
+                                  **stats}) + "\n")
+        return stats
+
+    def stats(self) -> Dict:
+        """Logical bytes written through the store against bytes it holds
+
+        Totals come from the stream log, where each stream records the chunks
+        it added, so this does not walk the chunk directories.
+        """
+        chunks = stored = logical = streams = 0
+        if (self.root / STORE_LOG).exists():
+            for line in (self.root / STORE_LOG).read_text().splitlines():
+                entry = json.loads(line)
+                chunks += entry["new_chunks"]
+                stored += entry["stored_size"]
+                logical += entry["size"]
+                streams += 1
+        return {"chunks": chunks, "stored_size": stored, "logical_size": logical,
+                "streams": streams, "dedup_ratio": logical / max(stored, 1)}
+
+
+class RecipeReader:
+    """Rebuild a stream from its recipe, fetching chunks in parallel"""
+
+    def __init__(self, store: ChunkStore, recipe: Path, threads: int = 0):
+        self.store = store
+        self.recipe = recipe
+        self.threads = threads or os.cpu_count() or 1
+        self.checks = "chunk SHA-256"
+
+    def entries(self) -> Iterator[tuple]:
+        with open(self.recipe, "rb") as f:
+            if f.read(len(RECIPE_MAGIC)) != RECIPE_MAGIC:
+                raise RuntimeError(f"{self.recipe} is not a chunk recipe")
+            while True:
+                entry = f.read(RECIPE_ENTRY.size)
+                if not entry:
+                    return
+                yield RECIPE_ENTRY.unpack(entry)
+
+    def load_entry(self, entry: tuple) -> tuple:
+        digest, size, repeat = entry
+        chunk = self.store.load_chunk(digest)
+        if len(chunk) != size:
+            raise RuntimeError(f"Chunk {digest.hex()} has the wrong size")
+        return chunk, repeat
+
+    def blocks(self) -> Iterator[bytes]:
+        with ThreadPoolExecutor(max_workers=self.threads) as pool:
+            for chunk, repeat in ordered_map(pool, self.load_entry, self.entries(),
+                                             self.threads * 4):
+                for _ in range(repeat):
+                    yield chunk
+
+
+class ImageRestorer:
+    """Write an image to a device or file and check what landed there
+
+    The reader decompresses on all cores and checks each block as it goes
+    (see its checks attribute); DeviceWriter writes the result in tuned,
+    aligned, parallel requests. With verify set, a running CRC-32 of the
+    written stream is compared with the target read back past the page cache.
+    """
+
+    def __init__(self, threads: int = 0):
+        self.threads = threads
+        self.tune = True  # Benchmark block device targets first
+        self.zero_mode = "auto"  # See DeviceWriter
+        self.verify = False
+
+    def restore(self, reader, target: str, size: int = 0, label: str = "") -> Dict:
+        """Write reader.blocks() to target from offset 0, return the report"""
+        zero_mode = self.zero_mode
+        if is_block_device(target):
+            if size and device_size(target) < size:
+                raise RuntimeError(f"{target} is smaller than the image ({format_bytes(size)})")
+            # Tuning writes land where the image is about to be written anyway
+            settings = tune_device(target, write=True, write_limit=size) \
+                if self.tune and size else IOSettings()
+        else:
+            settings = IOSettings(request_size=1024 * 1024)  # Finer holes
+            os.close(os.open(target, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644))
+            if zero_mode == "auto":
+                zero_mode = "skip"  # A truncated file reads as zeros already
+        writer = DeviceWriter(target, settings, zero_mode)
+
+        crc = 0
+        waited = 0.0  # Time the writer spent waiting for decompressed data
+
+        def source() -> Iterator[bytes]:
+            nonlocal crc, waited
+            blocks = iter(reader.blocks())
+            while True:
+                started = time.monotonic()
+                block = next(blocks, None)
+                waited += time.monotonic() - started
+                if block is None:
+                    return
+                if self.verify:
+                    crc = zlib.crc32(block, crc)
+                yield block
+
+        progress = Progress(label or f"Restoring {target}", size)
+        written = writer.write(source(), progress)
+        seconds = max(progress.finish(), 1e-6)
+        report = {
+            "target": target,
+            "size": written,
+            "seconds": round(seconds, 3),
+            "rate": round(written / seconds),
+            "source_wait": round(waited, 3),
+            "bound": "source" if waited > seconds / 2 else "target",
+            "io": str(settings),
+            "zero_mode": writer.zero_mode,
+            "zero_size": writer.zero_size,
+            "checks": reader.checks,
+            "verified": None,
+        }
+        if self.verify:
+            report.update(self.read_back(target, written, settings, crc))
+        return report
+
+    def read_back(self, target: str, size: int, settings: IOSettings, crc: int) -> Dict:
+        """Compare the CRC-32 of the target's first size bytes with crc"""
+        fd = os.open(target, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)  # Read the media, not the cache
+        finally:
+            os.close(fd)
+        check = IOSettings(settings.request_size, settings.queue_depth, direct=True)
+        progress = Progress(f"Verifying {target}", size)
+        found = 0
+        for block in DeviceReader(target, check, limit=size).blocks():
+            found = zlib.crc32(block, found)
+            progress.update(len(block))
+        seconds = max(progress.finish(), 1e-6)
+        return {"verified": found == crc and progress.done == size,
+                "verify_seconds": round(seconds, 3), "verify_rate": round(progress.done / seconds)}
+
+
+def print_restore_report(report: Dict) -> None:
+    """Throughput and verification status of one restored target"""
+    line = f"{report['target']}: {format_bytes(report['size'])} in {report['seconds']:.1f}s, " \
+           f"{format_bytes(report['rate'])}/s"
+    if "io" in report:
+        line += f", {report['source_wait']:.1f}s waiting for decompressed data " \
+                f"({report['bound']} bound)"
+    print_colored(line, Colors.GREEN)
+    if "io" in report:
+        print_colored(f"  writes: {report['io']}, {format_bytes(report['zero_size'])} of zeros "
+                      f"not written ({report['zero_mode']})")
+    if report["verified"] is None:
+        print_colored(f"  checked while reading: {report['checks']}, not read back")
+    elif report["verified"]:
+        print_colored(f"  checked while reading: {report['checks']}, read back and matched at "
+                      f"{format_bytes(report['verify_rate'])}/s", Colors.GREEN)
+    else:
+        print_colored("  read back does NOT match what was written", Colors.RED)
+
+
+class DiskBackup:
+    """Back up a whole disk as its partition table plus one image per partition
+
+    Partitions with a filesystem partclone knows are imaged with partclone,
+    which copies allocated blocks only. Everything else (unknown filesystems,
+    LVM, LUKS) is copied raw. Swap is recreated rather than copied.
+    """
+
+    def __init__(self, writer: Optional[ImageWriter] = None, threads: int = 0):
+        self.writer = writer or ImageWriter(Codec("none"), threads)  # Or a ChunkStore
+        self.threads = threads
+        self.restorer = ImageRestorer(threads)  # Writes and verifies raw partitions
+
+    def open_image(self, backup_dir: Path, manifest: Dict, entry: Dict,
+                   store: Optional[Path] = None):
+        """Reader for a partition image or chunk recipe of a backup"""
+        image = backup_dir / entry["image"]
+        if image.suffix == ".recipe":
+            return RecipeReader(ChunkStore(store or Path(manifest["store"])), image, self.threads)
+        return ImageReader(image, self.threads)
+
+    def backup(self, disk: str, out_dir: Path) -> Dict:
+        """Image a disk into out_dir, return the manifest"""
+        out_dir.mkdir(parents=True, exist_ok=True)
+        partitions = list_partitions(disk)
+        manifest = {
+            "format": BACKUP_FORMAT,
+            "version": INDEX_VERSION,
+            "disk": disk,
+            "size": device_size(disk),
+            "codec": self.writer.codec.name,
+            "partitions": [],
+        }
+        if isinstance(self.writer, ChunkStore):
+            manifest["store"] = str(self.writer.root.resolve())
+
+        if partitions:
+            table = subprocess.run(["sfdisk", "--dump", disk], capture_output=True, text=True)
+            if table.returncode != 0:
+                raise RuntimeError(f"sfdisk --dump {disk} failed: {table.stderr.strip()}")
+            (out_dir / PARTITION_TABLE).write_text(table.stdout)
+            manifest["table"] = PARTITION_TABLE
+            # The gap before the first partition holds the MBR boot code and,
+            # on BIOS/GPT disks, GRUB's core image
+            head_size = min(partition["start"] for partition in partitions) * 512
+            with open(disk, "rb") as src:
+                (out_dir / DISK_HEAD).write_bytes(src.read(head_size))
+            manifest["head"] = DISK_HEAD
+        else:
+            # A filesystem directly on the disk, or nothing we can read
+            partitions = [{"path": disk, "number": 0, "start": 0, "size": manifest["size"],
+                           "fstype": blkid_value(disk, "TYPE"), "uuid": blkid_value(disk, "UUID"),
+                           "label": blkid_value(disk, "LABEL")}]
+
+        suffix = ".recipe" if "store" in manifest else CODEC_SUFFIXES[self.writer.codec.name]
+        for partition in partitions:
+            entry = dict(partition)
+            tool = PARTCLONE_TOOLS.get(partition["fstype"] or "")
+            if partition["fstype"] == "swap":
+                entry["method"] = "mkswap"
+                print_colored(f"{partition['path']}: swap, recreated on restore", Colors.YELLOW)
+            elif tool and shutil.which(f"partclone.{tool}"):
+                entry["method"] = f"partclone.{tool}"
+                entry["image"] = f"part{partition['number']}.partclone{suffix}"
+                print_colored(f"{partition['path']}: {partition['fstype']}, used blocks only "
+                              f"({entry['method']})", Colors.YELLOW)
+                result = self.writer.create_from_command(
+                    [entry["method"], "-c", "-s", partition["path"], "-o", "-"],
+                    out_dir / entry["image"], f"Reading {partition['path']}",
+                    out_dir / f"part{partition['number']}.log")
+            else:
+                entry["method"] = "raw"
+                entry["image"] = f"part{partition['number']}.raw{suffix}"
+                print_colored(f"{partition['path']}: {partition['fstype'] or 'unknown'}, "
+                              f"copying every block", Colors.YELLOW)
+                result = self.writer.create(partition["path"], out_dir / entry["image"])
+            if "image" in entry:
+                entry["image_size"] = result["size"]
+                # Bytes that actually went to disk: compressed, or new chunks only
+                entry["stored_size"] = result.get("stored_size", result.get("compressed_size"))
+            manifest["partitions"].append(entry)
+
+        (out_dir / BACKUP_MANIFEST).write_text(json.dumps(manifest, indent=2))
+        return manifest
+
+    def restore(self, backup_dir: Path, disk: str, store: Optional[Path] = None) -> List[Dict]:
+        """Recreate a backed up disk on another disk of at least the same size
+
+        Returns a report per restored partition, see ImageRestorer.restore.
+        """
+        manifest = json.loads((backup_dir / BACKUP_MANIFEST).read_text())
+        if device_size(disk) < manifest["size"]:
+            raise RuntimeError(f"{disk} is smaller than the backed up {manifest['disk']} "
+                               f"({format_bytes(manifest['size'])})")
+
+        targets = {0: disk}
+        if manifest.get("table"):
+            with open(disk, "r+b") as dst:
+                dst.write((backup_dir / manifest["head"]).read_bytes())
+            with open(backup_dir / manifest["table"]) as table:
+                result = subprocess.run(["sfdisk", "--quiet", disk], stdin=table,
+                                        capture_output=True, text=True)
+            if result.returncode != 0:
+                raise RuntimeError(f"sfdisk {disk} failed: {result.stderr.strip()}")
+            subprocess.run(["blockdev", "--rereadpt", disk], capture_output=True)
+            subprocess.run(["udevadm", "settle"], capture_output=True)
+            targets = {partition["number"]: partition["path"] for partition in list_partitions(disk)}
+
+        reports = []
+        for entry in manifest["partitions"]:
+            target = targets.get(entry["number"])
+            if not target:
+                raise RuntimeError(f"Partition {entry['number']} missing on {disk} after sfdisk")
+            if entry["method"] == "mkswap":
+                command = ["mkswap"] + (["-U", entry["uuid"]] if entry.get("uuid") else []) + \
+                          (["-L", entry["label"]] if entry.get("label") else []) + [target]
+                result = subprocess.run(command, capture_output=True, text=True)
+                if result.returncode != 0:
+                    raise RuntimeError(f"mkswap {target} failed: {result.stderr.strip()}")
+                continue
+
+            reader = self.open_image(backup_dir, manifest, entry, store)
+            print_colored(f"{target}: {entry['method']} from {entry['image']}", Colors.YELLOW)
+            if entry["method"] == "raw":
+                report = self.restorer.restore(reader, target, entry["image_size"])
+                if report["verified"] is False:
+                    raise RuntimeError(f"{target} does not read back as written")
+                reports.append(report)
+                continue
+
+            # partclone writes the used blocks only, nothing to read back as a whole
+            progress = Progress(f"Restoring {target}", entry.get("image_size", 0))
+            process = subprocess.Popen([entry["method"], "-r", "-s", "-", "-o", target],
+                                       stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                                       stderr=subprocess.DEVNULL)
+            try:
+                for block in reader.blocks():
+                    write_all(process.stdin.fileno(), block)
+                    progress.update(len(block))
+            finally:
+                process.stdin.close()
+                status = process.wait()
+            if status != 0:
+                raise RuntimeError(f"{entry['method']} failed restoring {target}")
+            seconds = max(progress.finish(), 1e-6)
+            reports.append({"target": target, "size": progress.done, "seconds": round(seconds, 3),
+                            "rate": round(progress.done / seconds), "checks": reader.checks,
+                            "verified": None})
+        return reports
+
+
+def get_bus(disk: str) -> str:
+    """Name of the link a disk shares bandwidth over
+
+    Disks behind one SATA port (a port multiplier) share ataN, USB disks
+    share their root hub's usbN. NVMe and other disks get a bus of their
+    own. Loop devices count as the disk their backing file lives on, so
+    loop stand-ins on one test disk are scheduled like that disk.
+    """
+    name = Path(os.path.realpath(disk)).name
+    sysfs = Path(os.path.realpath(f"/sys/class/block/{name}"))
+    backing = sysfs / "loop" / "backing_file"
+    if backing.exists():
+        dev = os.stat(backing.read_text().strip()).st_dev
+        holder = Path(f"/sys/dev/block/{os.major(dev)}:{os.minor(dev)}")
+        if not holder.exists():
+            return f"fs-{os.major(dev)}:{os.minor(dev)}"  # tmpfs, overlayfs, ...
+        sysfs = Path(os.path.realpath(holder))
+        if (sysfs / "partition").exists():
+            sysfs = sysfs.parent
+        return get_bus(f"/dev/{sysfs.name}")
+    for part in sysfs.parts:
+        if re.fullmatch(r"(ata|usb)\d+", part):
+            return part
+    return name
+
+
+class BatchImager:
+    """Back up several disks at once, limiting concurrent jobs per shared bus"""
+
+    def __init__(self, writer: ImageWriter, per_bus: int = 1, jobs: int = 0):
+        self.writer = writer
+        self.per_bus = per_bus
+        self.jobs = jobs
+
+    def run(self, disks: List[str], out_dir: Path) -> List[Dict]:
+        """Back up each disk into out_dir/<name>, return per-disk results"""
+        names = [Path(os.path.realpath(disk)).name for disk in disks]
+        buses = {disk: get_bus(disk) for disk in disks}
+        bus_slots = {bus: threading.Semaphore(self.per_bus) for bus in set(buses.values())}
+        job_slots = threading.Semaphore(self.jobs or len(disks))
+        for bus in sorted(bus_slots):
+            members = [name for disk, name in zip(disks, names) if buses[disk] == bus]
+            print_colored(f"Bus {bus}: {', '.join(members)}", Colors.BLUE)
+
+        def backup(disk: str, name: str) -> Dict:
+            result = {"disk": disk, "bus": buses[disk], "status": "failed"}
+            with bus_slots[buses[disk]], job_slots:
+                ProgressBoard.current.job = name
+                board.set_state(name, "running")
+                started = time.monotonic()
+                try:
+                    manifest = DiskBackup(self.writer, self.writer.threads).backup(disk, out_dir / name)
+                    result["status"] = "ok"
+                    result["copied"] = sum(entry.get("image_size", 0)
+                                           for entry in manifest["partitions"])
+                except (OSError, RuntimeError, subprocess.CalledProcessError) as e:
+                    result["error"] = str(e)
+                result["seconds"] = round(time.monotonic() - started, 3)
+                board.set_state(name, result["status"])
+            return result
+
+        out_dir.mkdir(parents=True, exist_ok=True)
+        with ProgressBoard(names) as board, ThreadPoolExecutor(max_workers=len(disks)) as pool:
+            results = list(pool.map(backup, disks, names))
+        (out_dir / "batch.json").write_text(json.dumps(results, indent=2))
+        return results
+
+
+class FanoutTarget:
+    """One disk of a duplicate run: its block queue and how fast its writer takes from it"""
+
+    def __init__(self, path: str, depth: int, checks: str):
+        self.path = path
+        self.name = Path(os.path.realpath(path)).name
+        self.queue = queue.Queue(depth)
+        self.checks = checks  # Of the source, for ImageRestorer's report
+        self.received = 0
+        self.waited = 0.0  # Time spent waiting for the next block
+        self.started = 0.0  # First block asked for, i.e. tuning done
+        self.active = time.monotonic()  # Last block taken (or thread start)
+        self.finished = 0.0  # End of stream taken
+        self.dropped = ""  # Why the producer gave up on this target
+        self.closed = False  # Writer thread finished, whatever the outcome
+        self.report: Dict = {"target": path}
+
+    def blocks(self) -> Iterator[bytes]:
+        while True:
+            asked = time.monotonic()
+            self.started = self.started or asked
+            block = self.queue.get()
+            self.active = time.monotonic()
+            self.waited += self.active - asked
+            if self.dropped:
+                raise RuntimeError(self.dropped)
+            if block is None:
+                self.finished = self.active
+                return
+            self.received += len(block)
+            yield block
+
+    def busy_seconds(self) -> float:
+        if not self.started:
+            return 0.0
+        return (self.finished or time.monotonic()) - self.started - self.waited
+
+    def speed(self) -> float:
+        """Bytes/s while writing, time spent waiting for data not counted"""
+        return self.received / max(self.busy_seconds(), 1e-6)
+
+
+class Duplicator:
+    """Restore one image to several disks, reading and decompressing it once
+
+    Each block is handed to every target's queue; the targets' writer
+    threads (ImageRestorer each) take from them at their own pace. A full
+    queue holds the source back, so memory stays at about `buffers` blocks
+    however many targets there are. A target whose queue stays full is
+    dropped when it has not taken a block for `stall` seconds, or when,
+    after WARMUP seconds of writing, it writes slower than `min_speed`
+    times the median of the others.
+    """
+
+    WARMUP = 10.0
+
+    def __init__(self, threads: int = 0, buffers: int = 8):
+        self.restorer = ImageRestorer(threads)
+        self.buffers = buffers
+        self.stall = 60.0
+        self.min_speed = 0.25
+
+    def check(self, target: FanoutTarget, targets: List[FanoutTarget]) -> None:
+        """Drop target if it is the one holding everybody back"""
+        idle = time.monotonic() - target.active
+        if idle > self.stall:
+            target.dropped = f"took no data for {idle:.0f}s"
+        elif self.min_speed and target.busy_seconds() > self.WARMUP:
+            others = [other.speed() for other in targets if other is not target
+                      and not other.dropped and other.busy_seconds() > self.WARMUP]
+            if others and target.speed() < self.min_speed * statistics.median(others):
+                target.dropped = (f"{format_bytes(target.speed())}/s against "
+                                  f"{format_bytes(statistics.median(others))}/s for the others")
+        if target.dropped:
+            print_colored(f"{target.path}: dropped, {target.dropped}", Colors.RED)
+            if Progress.board:
+                Progress.board.set_state(target.name, "dropped")
+
+    def feed(self, target: FanoutTarget, block: Optional[bytes],
+             targets: List[FanoutTarget]) -> None:
+        while not (target.dropped or target.closed):
+            try:
+                target.queue.put(block, timeout=0.5)
+                return
+            except queue.Full:
+                self.check(target, targets)
+
+    def run(self, reader, disks: List[str], size: int = 0) -> List[Dict]:
+        """Write reader.blocks() to every disk, return a report per disk"""
+        targets = [FanoutTarget(disk, self.buffers, reader.checks) for disk in disks]
+
+        def write(target: FanoutTarget) -> None:
+            ProgressBoard.current.job = target.name
+            board.set_state(target.name, "running")
+            try:
+                report = self.restorer.restore(target, target.path, size)
+                status = "ok" if report["verified"] is not False else "mismatch"
+            except (OSError, RuntimeError) as e:
+                report = {"target": target.path, "size": target.received,
+                          "error": target.dropped or str(e)}
+                status = "dropped" if target.dropped else "failed"
+            report.update(status=status, write_speed=round(target.speed()))
+            target.report = report
+            target.closed = True
+            board.set_state(target.name, status)
+
+        with ProgressBoard([target.name for target in targets]) as board:
+            threads = [threading.Thread(target=write, args=(target,), daemon=True)
+                       for target in targets]
+            for thread in threads:
+                thread.start()
+            try:
+                for block in reader.blocks():
+                    if all(target.dropped or target.closed for target in targets):
+                        break
+                    for target in targets:
+                        self.feed(target, block, targets)
+            except BaseException as e:
+                for target in targets:  # Stop the writers rather than finish short
+                    target.dropped = target.dropped or f"source failed: {e}"
+                    try:
+                        target.queue.put_nowait(None)
+                    except queue.Full:
+                        pass
+                raise
+            for target in targets:
+                self.feed(target, None, targets)
+            for target, thread in zip(targets, threads):
+                # A dropped disk may hang in a write for good, don't wait for it
+                thread.join(5 if target.dropped else None)
+        for target in targets:
+            if not target.closed:
+                target.report.update(status="dropped", size=target.received, error=target.dropped)
+        return [target.report for target in targets]
+
+
+def device_size(path: str) -> int:
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        return get_size(fd)
+    finally:
+        os.close(fd)
+
+
+def blkid_value(device: str, tag: str) -> Optional[str]:
+    result = subprocess.run(["blkid", "-o", "value", "-s", tag, device],
+                            capture_output=True, text=True)
+    return result.stdout.strip() or None
+
+
+def list_partitions(disk: str) -> List[Dict]:
+    """Partitions of a disk with number, start sector (512 bytes) and filesystem"""
+    result = subprocess.run(["lsblk", "-J", "-b", "-p", "-o", "NAME,KNAME,TYPE,FSTYPE,SIZE,UUID,LABEL",
+                             disk], capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"lsblk {disk} failed: {result.stderr.strip()}")
+    partitions = []
+    for device in json.loads(result.stdout)["blockdevices"]:
+        for child in device.get("children", []):
+            if child["type"] != "part":
+                continue
+            sysfs = Path("/sys/class/block") / Path(child["kname"]).name
+            partitions.append({
+                "path": child["name"],
+                "number": int((sysfs / "partition").read_text()),
+                "start": int((sysfs / "start").read_text()),
+                "size": int(child["size"]),
+                "fstype": child.get("fstype"),
+                "uuid": child.get("uuid"),
+                "label": child.get("label"),
+            })
+    return sorted(partitions, key=lambda partition: partition["number"])
+
+
+def cmd_create(args) -> bool:
+    image = Path(args.image)
+    codec = Codec(args.codec or guess_codec(image), args.level)
+    writer = ImageWriter(codec, args.threads, parse_size(args.block_size))
+    writer.tune = args.tune
+    print_colored(f"Imaging {args.source} -> {image} ({codec.name}"
+                  f"{f' level {codec.level}' if codec.name != 'none' else ''}, "
+                  f"{writer.threads} threads)", Colors.YELLOW)
+    index = writer.create(args.source, image)
+    seconds = max(index["seconds"], 1e-6)
+    ratio = index["size"] / max(index["compressed_size"], 1)
+    print_colored(f"Done: {format_bytes(index['size'])} -> {format_bytes(index['compressed_size'])} "
+                  f"({ratio:.2f}x) in {seconds:.1f}s, {format_bytes(index['size'] / seconds)}/s",
+                  Colors.GREEN)
+    if index["zero_size"]:
+        print_colored(f"{format_bytes(index['zero_size'])} of zeros "
+                      f"{'left as holes' if codec.name == 'none' else 'skipped by the compressor'}",
+                      Colors.GREEN)
+    return True
+
+
+def cmd_unpack(args) -> bool:
+    reader = ImageReader(Path(args.image), args.threads)
+    if args.output == "-":
+        progress = Progress(f"Unpacking {args.image}", reader.size)
+        for block in reader.blocks():
+            write_all(sys.stdout.fileno(), block)
+            progress.update(len(block))
+        progress.finish()
+        return True
+
+    restorer = ImageRestorer(args.threads)
+    restorer.tune = args.tune
+    restorer.zero_mode = args.zeros
+    print_restore_report(restorer.restore(reader, args.output, reader.size,
+                                          f"Unpacking {args.image}"))
+    return True
+
+
+def cmd_info(args) -> bool:
+    index = load_index(Path(args.image))
+    if not index:
+        print_colored(f"{args.image}: no block index, codec {guess_codec(Path(args.image))}",
+                      Colors.YELLOW)
+        return True
+    ratio = index["size"] / max(index["compressed_size"], 1)
+    print(f"Codec:       {index['codec']} level {index['level']}")
+    print(f"Blocks:      {len(index['blocks'])} x {format_bytes(index['block_size'])}")
+    print(f"Image size:  {format_bytes(index['size'])} ({index['size']} bytes)")
+    print(f"Compressed:  {format_bytes(index['compressed_size'])} ({ratio:.2f}x)")
+    print(f"Zeros:       {format_bytes(index.get('zero_size', 0))}")
+    return True
+
+
+def cmd_bench(args) -> bool:
+    if args.write:
+        print_colored(f"Write benchmark overwrites data on {args.device}", Colors.YELLOW)
+    tuner = IOTuner(args.device, trial_seconds=args.seconds, write=args.write)
+    best = tuner.tune()
+    print(f"{'Settings':<52} {'Speed':>12}")
+    for settings, rate in tuner.results:
+        print(f"{settings:<52} {format_bytes(rate) + '/s':>12}")
+    print_colored(f"Best: {best} ({format_bytes(best.measured)}/s)", Colors.GREEN)
+    return True
+
+
+def cmd_store(args) -> bool:
+    if not (Path(args.store) / STORE_CONFIG).exists():
+        print_colored(f"{args.store} is not a chunk store", Colors.RED)
+        return False
+    stats = ChunkStore(Path(args.store)).stats()
+    print(f"Streams:     {stats['streams']} ({format_bytes(stats['logical_size'])})")
+    print(f"Chunks:      {stats['chunks']} ({format_bytes(stats['stored_size'])} on disk)")
+    print(f"Dedup ratio: {stats['dedup_ratio']:.2f}x")
+    return True
+
+
+def cmd_backup(args) -> bool:
+    codec = Codec(args.codec, args.level)
+    if args.store:
+        writer = ChunkStore(Path(args.store), codec, args.threads)
+    else:
+        writer = ImageWriter(codec, args.threads)
+    writer.tune = args.tune
+    started = time.monotonic()
+    manifest = DiskBackup(writer, args.threads).backup(args.disk, Path(args.directory))
+    copied = sum(entry.get("image_size", 0) for entry in manifest["partitions"])
+    stored = sum(entry.get("stored_size", 0) for entry in manifest["partitions"])
+    seconds = time.monotonic() - started
+    print_colored(f"Done: {format_bytes(copied)} of {format_bytes(manifest['size'])} copied "
+                  f"in {seconds:.1f}s, {format_bytes(stored)} written to "
+                  f"{args.store or args.directory}", Colors.GREEN)
+    if args.store:
+        print_colored(f"Chunk store dedup ratio: {writer.stats()['dedup_ratio']:.2f}x", Colors.GREEN)
+    return True
+
+
+def cmd_batch(args) -> bool:
+    codec = Codec(args.codec, args.level)
+    # Compression threads are shared out between the disks imaged at once
+    concurrent = min(args.jobs or len(args.disks), len(args.disks))
+    threads = args.threads or max(1, (os.cpu_count() or 1) // concurrent)
+    if args.store:
+        writer = ChunkStore(Path(args.store), codec, threads)
+    else:
+        writer = ImageWriter(codec, threads)
+    writer.tune = args.tune
+    started = time.monotonic()
+    results = BatchImager(writer, args.per_bus, args.jobs).run(args.disks, Path(args.directory))
+    seconds = max(time.monotonic() - started, 1e-6)
+
+    print_colored("\n=== Batch imaging ===", Colors.BLUE)
+    print(f"{'Disk':<16} {'Bus':<12} {'Copied':>12} {'Time (s)':>9} {'Speed':>12}  Result",
+          file=sys.stderr)
+    for r in results:
+        speed = f"{format_bytes(r.get('copied', 0) / max(r['seconds'], 1e-6))}/s"
+        print(f"{r['disk']:<16} {r['bus']:<12} {format_bytes(r.get('copied', 0)):>12} "
+              f"{r['seconds']:>9.1f} {speed:>12}  {r['status']} {r.get('error', '')}",
+              file=sys.stderr)
+    total = sum(r.get("copied", 0) for r in results)
+    failed = [r for r in results if r["status"] != "ok"]
+    print_colored(f"Total: {format_bytes(total)} in {seconds:.1f}s, "
+                  f"{format_bytes(total / seconds)}/s aggregate",
+                  Colors.GREEN if not failed else Colors.RED)
+    return not failed
+
+
+def cmd_restore(args) -> bool:
+    started = time.monotonic()
+    source = Path(args.source)
+    backup = DiskBackup(threads=args.threads) if source.is_dir() else None
+    restorer = backup.restorer if backup else ImageRestorer(args.threads)
+    restorer.tune = args.tune
+    restorer.zero_mode = args.zeros
+    restorer.verify = args.verify
+
+    if backup:
+        reports = backup.restore(source, args.disk, Path(args.store) if args.store else None)
+    else:
+        reader = ImageReader(source, args.threads)
+        reports = [restorer.restore(reader, args.disk, reader.size)]
+    for report in reports:
+        print_restore_report(report)
+    if args.report:
+        Path(args.report).write_text(json.dumps({"source": str(source.resolve()),
+                                                 "disk": args.disk, "targets": reports}, indent=2))
+    ok = all(report["verified"] is not False for report in reports)
+    print_colored(f"Done: {args.disk} restored in {time.monotonic() - started:.1f}s",
+                  Colors.GREEN if ok else Colors.RED)
+    return ok
+
+
+def cmd_duplicate(args) -> bool:
+    if Path(args.image).is_dir():
+        raise RuntimeError("duplicate takes an image file, restore backup directories one by one")
+    reader = ImageReader(Path(args.image), args.threads)
+    duplicator = Duplicator(args.threads, args.buffers)
+    duplicator.restorer.tune = args.tune
+    duplicator.restorer.zero_mode = args.zeros
+    duplicator.restorer.verify = args.verify
+    duplicator.stall = args.stall
+    duplicator.min_speed = args.min_speed
+    started = time.monotonic()
+    results = duplicator.run(reader, args.disks, reader.size)
+    seconds = max(time.monotonic() - started, 1e-6)
+
+    print_colored("\n=== Duplicate ===", Colors.BLUE)
+    print(f"{'Disk':<16} {'Written':>12} {'Time (s)':>9} {'Speed':>12} {'Disk speed':>12} "
+          f"{'Verified':>9}  Result", file=sys.stderr)
+    for r in results:
+        verified = {True: "yes", False: "NO", None: "-"}[r.get("verified")]
+        speed = f"{format_bytes(r['rate'])}/s" if "rate" in r else "-"
+        print(f"{r['target']:<16} {format_bytes(r.get('size', 0)):>12} {r.get('seconds', 0):>9.1f} "
+              f"{speed:>12} {format_bytes(r.get('write_speed', 0)) + '/s':>12} {verified:>9}  "
+              f"{r['status']} {r.get('error', '')}", file=sys.stderr)
+    done = [r for r in results if r["status"] == "ok"]
+    total = sum(r["size"] for r in done)
+    print_colored(f"{len(done)} of {len(results)} disks written, {format_bytes(total)} in "
+                  f"{seconds:.1f}s, {format_bytes(total / seconds)}/s aggregate (source read once)",
+                  Colors.GREEN if len(done) == len(results) else Colors.RED)
+    if args.report:
+        Path(args.report).write_text(json.dumps({"source": str(Path(args.image).resolve()),
+                                                 "seconds": round(seconds, 3),
+                                                 "targets": results}, indent=2))
+    return len(done) == len(results)
+
+
+def main():
+    """Main function"""
+    parser = argparse.ArgumentParser(description="Multithreaded disk imaging engine")
+    parser.add_argument("--threads", type=int, default=0,
+                        help="Compression threads (default: all cores)")
+    parser.add_argument("--no-tune", dest="tune", action="store_false",
+                        help="Skip the request size / queue depth / O_DIRECT benchmark of devices")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    create_parser = subparsers.add_parser("create", help="Image a disk or partition")
+    create_parser.add_argument("source", help="Device or file to read")
+    create_parser.add_argument("image", help="Image file to write (.gz, .zst or raw)")
+    create_parser.add_argument("--codec", choices=["none", "gzip", "zstd"],
+                               help="Compression (default: from the file name)")
+    create_parser.add_argument("--level", type=int,
+                               help="Compression level (default: gzip 6, zstd 3)")
+    create_parser.add_argument("--block-size", default="8M",
+                               help="Independently compressed block size (default: 8M)")
+
+    unpack_parser = subparsers.add_parser("unpack", help="Decompress an image")
+    unpack_parser.add_argument("image")
+    unpack_parser.add_argument("output", nargs="?", default="-",
+                               help="File or device to write (default: stdout)")
+    unpack_parser.add_argument("--zeros", choices=ZERO_MODES, default="auto",
+                               help="Zero regions: discard (TRIM/holes), zeroout, skip if the "
+                                    "target is known zero, or write (default: by target type)")
+
+    backup_parser = subparsers.add_parser(
+        "backup", help="Back up a disk: partition table plus used blocks of each partition")
+    backup_parser.add_argument("disk")
+    backup_parser.add_argument("directory", help="Directory for the backup (created)")
+    backup_parser.add_argument("--codec", choices=["none", "gzip", "zstd"], default="zstd",
+                               help="Compression of the partition images (default: zstd)")
+    backup_parser.add_argument("--level", type=int,
+                               help="Compression level (default: gzip 6, zstd 3)")
+    backup_parser.add_argument("--store", metavar="DIR",
+                               help="Put partition data in this deduplicating chunk store, "
+                                    "shared between backups (created if missing)")
+
+    batch_parser = subparsers.add_parser("batch", help="Back up several disks at once")
+    batch_parser.add_argument("directory", help="Backups go to DIRECTORY/<disk name>")
+    batch_parser.add_argument("disks", nargs="+")
+    batch_parser.add_argument("--codec", choices=["none", "gzip", "zstd"], default="zstd",
+                              help="Compression of the partition images (default: zstd)")
+    batch_parser.add_argument("--level", type=int,
+                              help="Compression level (default: gzip 6, zstd 3)")
+    batch_parser.add_argument("--store", metavar="DIR", help="Shared deduplicating chunk store")
+    batch_parser.add_argument("--per-bus", type=int, default=1,
+                              help="Disks imaged at once per SATA port or USB root hub (default: 1)")
+    batch_parser.add_argument("--jobs", type=int, default=0,
+                              help="Disks imaged at once overall (default: no limit)")
+
+    restore_parser = subparsers.add_parser("restore", help="Restore a disk backup or image")
+    restore_parser.add_argument("source",
+                                help="Directory written by backup, or an image (raw, .gz, .zst)")
+    restore_parser.add_argument("disk", help="Disk to overwrite, at least as large as the source")
+    restore_parser.add_argument("--store", metavar="DIR",
+                                help="Chunk store, if it moved since the backup")
+    restore_parser.add_argument("--zeros", choices=ZERO_MODES, default="auto",
+                                help="Zero regions of images and raw partitions, as for unpack")
+    restore_parser.add_argument("--verify", action="store_true",
+                                help="Read the written data back from the disk and compare")
+    restore_parser.add_argument("--report", metavar="JSON",
+                                help="Write throughput and verification results here")
+
+    duplicate_parser = subparsers.add_parser(
+        "duplicate", help="Restore one image to several disks, decompressing it once")
+    duplicate_parser.add_argument("image", help="Image file (raw, .gz or .zst)")
+    duplicate_parser.add_argument("disks", nargs="+", help="Disks to overwrite")
+    duplicate_parser.add_argument("--zeros", choices=ZERO_MODES, default="auto",
+                                  help="Zero regions, as for unpack")
+    duplicate_parser.add_argument("--verify", action="store_true",
+                                  help="Read each disk back and compare")
+    duplicate_parser.add_argument("--report", metavar="JSON",
+                                  help="Write per-disk throughput and verification results here")
+    duplicate_parser.add_argument("--buffers", type=int, default=8,
+                                  help="Blocks queued per disk ahead of its writer (default: 8)")
+    duplicate_parser.add_argument("--stall", type=float, default=60, metavar="SECONDS",
+                                  help="Drop a disk that takes no data for this long (default: 60)")
+    duplicate_parser.add_argument("--min-speed", type=float, default=0.25, metavar="RATIO",
+                                  help="Drop a disk writing slower than RATIO times the median "
+                                       "of the others, 0 to keep it (default: 0.25)")
+
+    bench_parser = subparsers.add_parser("bench", help="Measure the I/O settings of a device")
+    bench_parser.add_argument("device")
+    bench_parser.add_argument("--write", action="store_true",
+                              help="Benchmark writes instead of reads (destroys data)")
+    bench_parser.add_argument("--seconds", type=float, default=0.3,
+                              help="Duration of each trial (default: 0.3)")
+
+    store_parser = subparsers.add_parser("store", help="Show a chunk store's dedup ratio")
+    store_parser.add_argument("store")
+
+    info_parser = subparsers.add_parser("info", help="Show an image's block index")
+    info_parser.add_argument("image")
+
+    args = parser.parse_args()
+    commands = {"create": cmd_create, "unpack": cmd_unpack, "backup": cmd_backup,
+                "batch": cmd_batch, "restore": cmd_restore, "duplicate": cmd_duplicate,
+                "info": cmd_info, "store": cmd_store, "bench": cmd_bench}
+    try:
+        success = commands[args.command](args)
+    except (OSError, RuntimeError, ValueError) as e:
+        print_colored(f"Error: {e}", Colors.RED)
+        success = False
+    sys.exit(0 if success else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+boot_bench.py - Headless boot-time benchmark for live ISOs
+
+Boots an ISO N times in QEMU (KVM, or TCG where /dev/kvm is missing) with
+the kernel console on serial and the firmware's debug port alongside it,
+and timestamps boot milestones seen on either. Results go to a JSON file
+that can be compared against an earlier one to catch boot-time regressions
+between builds:
+
+    boot_bench.py hardclone-live.iso --runs 5 -o bench.json
+    boot_bench.py hardclone-live-new.iso -o new.json --baseline bench.json --max-regression 10
+
+The ISO's default entry is booted directly (-kernel/-initrd), so the
+bootloader menu timeout, a fixed delay, is not part of the numbers.
+"""
+
+import sys
+import re
+import hashlib
+import platform
+import statistics
+import subprocess
+import tempfile
+from datetime import datetime
+from pathlib import Path
+import json
+import logging
+from typing import List, Dict, Optional
+import argparse
+
+from qemu_headless import QemuVM
+
+# Setup logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+class Colors:
+    RED = '\033[0;31m'
+    GREEN = '\033[0;32m'
+    YELLOW = '\033[1;33m'
+    BLUE = '\033[0;34m'
+    NC = '\033[0m'  # No Color
+
+# Milestones found in the console log, in boot order. The first line
+# matching each pattern gives its time since QEMU started.
+BOOT_MILESTONES = [
+    ("bootloader", r"Booting from "),                     # SeaBIOS hands over
+    ("kernel", r"Linux version \d"),
+    ("initramfs", r"Run /init as init process"),
+    ("squashfs_mount", r"loop\d+: detected capacity change"),
+    ("multi_user", r"Reached target .*(Multi-User System|multi-user\.target)"),
+]
+
+# Waited for on the console, after the log milestones
+LOGIN_PROMPT = r"(?m)login: ?$"
+READY_COMMAND = "test -x /opt/hardclone-cli/hardclone || command -v hardclone"
+
+# Kernel messages up to KERN_INFO must reach the console for the milestones
+DROPPED_ARGS = {"quiet", "splash"}
+BENCH_ARGS = "loglevel=7 systemd.show_status=1"
+
+
+def print_colored(message: str, color: str = Colors.NC) -> None:
+    """Print colored message"""
+    print(f"{color}{message}{Colors.NC}", flush=True)
+
+
+def get_qemu_version() -> str:
+    """First line of qemu-system-x86_64 --version"""
+    try:
+        result = subprocess.run(["qemu-system-x86_64", "--version"], capture_output=True, text=True,
+                                stdin=subprocess.DEVNULL)
+        return result.stdout.splitlines()[0] if result.stdout else ""
+    except FileNotFoundError:
+        return ""
+
+
+def get_iso_sha256(iso: Path) -> str:
+    """Content hash identifying the benchmarked build"""
+    digest = hashlib.sha256()
+    with open(iso, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def find_milestones(lines: List, milestones: List) -> Dict[str, float]:
+    """Time of the first console line matching each milestone"""
+    found = {}
+    for name, pattern in milestones:
+        regex = re.compile(pattern)
+        for seconds, line in lines:
+            if regex.search(line):
+                found[name] = round(seconds, 3)
+                break
+    return found
+
+
+def run_once(iso: Path, args, index: int, milestones: List) -> Dict[str, float]:
+    """Boot once and return milestone times"""
+    with tempfile.TemporaryDirectory(prefix="boot-bench-") as tmp:
+        vm = QemuVM(iso, memory=args.memory, smp=args.smp, accel=args.accel)
+        vm.firmware_log = True
+        vm.use_boot_entry(Path(tmp), BENCH_ARGS)
+        vm.append = " ".join(arg for arg in vm.append.split() if arg not in DROPPED_ARGS)
+        if args.log_dir:
+            vm.log_file = Path(args.log_dir) / f"{iso.stem}-run{index}.log"
+        vm.start()
+        extra = {}
+        try:
+            if vm.wait_for(LOGIN_PROMPT, args.timeout):
+                extra["login_prompt"] = round(vm.elapsed(), 3)
+                if args.ready_command and vm.login(args.user, args.password):
+                    if vm.run(args.ready_command, timeout=120) == 0:
+                        extra["hardclone_ready"] = round(vm.elapsed(), 3)
+        finally:
+            vm.stop()
+        result = find_milestones(vm.lines, milestones)
+        result.update(extra)
+        return result
+
+
+def summarize(runs: List[Dict[str, float]], names: List[str]) -> Dict[str, Dict]:
+    """Min/median/max per milestone over the runs that reached it"""
+    summary = {}
+    for name in names:
+        values = [run[name] for run in runs if name in run]
+        if not values:
+            continue
+        summary[name] = {
+            "min": min(values),
+            "median": round(statistics.median(values), 3),
+            "max": max(values),
+            "stdev": round(statistics.stdev(values), 3) if len(values) > 1 else 0.0,
+            "reached": len(values),
+        }
+    return summary
+
+
+def compare(report: Dict, baseline: Dict, max_regression: float) -> bool:
+    """Print median deltas against a baseline report, False on regression
+
+    A milestone the baseline reached and this run did not is a regression.
+    """
+    if report["accel"] != baseline.get("accel"):
+        print_colored(f"WARNING: baseline ran with {baseline.get('accel')}, "
+                      f"this run with {report['accel']}, not checking for regressions",
+                      Colors.YELLOW)
+        max_regression = 0
+    print_colored(f"\n=== Compared with {baseline.get('iso')} ({baseline.get('date')}) ===",
+                  Colors.BLUE)
+    print(f"{'Milestone':<16} {'Baseline (s)':>13} {'Now (s)':>9} {'Change':>8}")
+    ok = True
+    for name, stats in report["summary"].items():
+        old = baseline.get("summary", {}).get(name)
+        if not old:
+            print(f"{name:<16} {'-':>13} {stats['median']:>9.2f}")
+            continue
+        change = (stats["median"] - old["median"]) / max(old["median"], 0.001) * 100
+        color = Colors.NC
+        if max_regression and change > max_regression:
+            color = Colors.RED
+            ok = False
+        print_colored(f"{name:<16} {old['median']:>13.2f} {stats['median']:>9.2f} {change:>+7.1f}%",
+                      color)
+    for name, old in baseline.get("summary", {}).items():
+        if name not in report["summary"]:
+            print_colored(f"{name:<16} {old['median']:>13.2f} {'-':>9} {'missing':>8}", Colors.RED)
+            ok = False
+    return ok
+
+
+def main():
+    """Main function"""
+    parser = argparse.ArgumentParser(description="Benchmark live ISO boot time in headless QEMU")
+    parser.add_argument("iso")
+    parser.add_argument("--runs", type=int, default=3, help="Boots to run (default: 3)")
+    parser.add_argument("-o", "--output", default="boot-bench.json",
+                        help="JSON results file (default: boot-bench.json)")
+    parser.add_argument("--baseline", metavar="JSON", help="Earlier results to compare with")
+    parser.add_argument("--max-regression", type=float, default=0, metavar="PERCENT",
+                        help="Exit with 1 if a median milestone got slower than this")
+    parser.add_argument("--memory", default="2G", help="Guest memory (default: 2G)")
+    parser.add_argument("--smp", type=int, default=2, help="Guest CPUs (default: 2)")
+    parser.add_argument("--accel", default="auto", choices=["auto", "kvm", "tcg"],
+                        help="QEMU accelerator (default: kvm if available)")
+    parser.add_argument("--timeout", type=float, default=900,
+                        help="Seconds to wait for the login prompt (default: 900)")
+    parser.add_argument("--user", default="user",
+                        help="Console login for the ready check (default: user, Clonezilla live)")
+    parser.add_argument("--password", default="live", help="Console password (default: live)")
+    parser.add_argument("--ready-command", default=READY_COMMAND,
+                        help="Command that succeeds once HardClone is usable, '' to skip")
+    parser.add_argument("--milestone", action="append", default=[], metavar="NAME=REGEX",
+                        help="Extra console milestone, can be repeated")
+    parser.add_argument("--log-dir", help="Keep each run's console log here")
+
+    args = parser.parse_args()
+
+    milestones = list(BOOT_MILESTONES)
+    for spec in args.milestone:
+        name, _, pattern = spec.partition("=")
+        milestones.append((name, pattern))
+    names = [name for name, _ in milestones] + ["login_prompt", "hardclone_ready"]
+    if args.log_dir:
+        Path(args.log_dir).mkdir(parents=True, exist_ok=True)
+
+    iso = Path(args.iso).resolve()
+    vm = QemuVM(iso, accel=args.accel)
+    print_colored(f"Benchmarking {iso.name}: {args.runs} runs, accel={vm.accel}", Colors.GREEN)
+    if vm.accel == "tcg":
+        print_colored("KVM not available, using TCG (much slower, compare only with TCG runs)",
+                      Colors.YELLOW)
+
+    runs = []
+    for index in range(1, args.runs + 1):
+        result = run_once(iso, args, index, milestones)
+        reached = ", ".join(f"{name} {seconds:.1f}s" for name, seconds in result.items())
+        print_colored(f"Run {index}: {reached or 'no milestones reached'}",
+                      Colors.YELLOW if result else Colors.RED)
+        runs.append(result)
+
+    report = {
+        "iso": iso.name,
+        "iso_size": iso.stat().st_size,
+        "iso_sha256": get_iso_sha256(iso),
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "host": platform.node(),
+        "qemu": get_qemu_version(),
+        "accel": vm.accel,
+        "memory": args.memory,
+        "smp": args.smp,
+        "milestones": names,
+        "runs": runs,
+        "summary": summarize(runs, names),
+    }
+    Path(args.output).write_text(json.dumps(report, indent=2))
+
+    print_colored("\n=== Boot milestones (seconds since QEMU start) ===", Colors.BLUE)
+    print(f"{'Milestone':<16} {'Min':>8} {'Median':>8} {'Max':>8} {'Runs':>5}")
+    for name, stats in report["summary"].items():
+        print(f"{name:<16} {stats['min']:>8.2f} {stats['median']:>8.2f} {stats['max']:>8.2f} "
+              f"{stats['reached']:>5}")
+    print_colored(f"Results written to {args.output}", Colors.GREEN)
+
+    ok = "login_prompt" in report["summary"]
+    if args.baseline:
+        ok = compare(report, json.loads(Path(args.baseline).read_text()), args.max_regression) and ok
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
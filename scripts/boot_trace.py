@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+boot_trace.py - Record which root filesystem files a live ISO reads while booting
+
+Boots the ISO headless in QEMU with page cache tracing enabled from the
+kernel command line, waits for the login prompt (or the HardClone launcher),
+and turns the order in which squashfs files were first read into a
+mksquashfs sort file. Built with that file, the squashfs stores the boot
+working set at the start of the image, front to back, instead of scattered
+in directory order, which is what slow USB sticks and DVDs spend their
+boot time seeking for.
+
+    boot_trace.py trace hardclone-live.iso -o boot-order.sort
+    build_clonezilla.py --sort-file boot-order.sort
+    boot_trace.py measure old.iso new.iso --throttle-mbps 20 --iops 150
+"""
+
+import sys
+import re
+import statistics
+import tempfile
+from pathlib import Path
+import json
+import logging
+from typing import List, Dict, Optional, Tuple
+import argparse
+
+from qemu_headless import QemuVM
+
+# Setup logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+class Colors:
+    RED = '\033[0;31m'
+    GREEN = '\033[0;32m'
+    YELLOW = '\033[1;33m'
+    BLUE = '\033[0;34m'
+    NC = '\033[0m'  # No Color
+
+# Where live-boot (Clonezilla) and archiso mount the read-only squashfs
+ROOTFS_MOUNTS = [
+    "/run/live/rootfs/filesystem.squashfs",
+    "/lib/live/mount/rootfs/filesystem.squashfs",
+    "/run/archiso/airootfs",
+]
+
+# Page cache insertions, enabled before init runs. nooverwrite keeps the
+# earliest events if the buffer fills up, those matter most.
+TRACE_ARGS = ("trace_event=filemap:mm_filemap_add_to_page_cache "
+              "trace_buf_size=64M trace_options=nooverwrite")
+
+TRACE_EVENT = re.compile(r"mm_filemap_add_to_page_cache: dev (\d+:\d+) ino ([0-9a-f]+)")
+
+# mksquashfs places higher priorities first, range -32768..32767
+MAX_PRIORITY = 32767
+MAX_SORT_ENTRIES = 65536
+
+
+def print_colored(message: str, color: str = Colors.NC) -> None:
+    """Print colored message"""
+    print(f"{color}{message}{Colors.NC}", flush=True)
+
+
+def get_dump_command(rootfs_mount: Optional[str]) -> str:
+    """Guest shell command writing the trace and the rootfs inode map to ttyS1"""
+    mounts = [rootfs_mount] if rootfs_mount else ROOTFS_MOUNTS
+    return (
+        "sh -c '"
+        f"for d in {' '.join(mounts)}; do mountpoint -q $d && M=$d && break; done; "
+        "mount -t tracefs nodev /sys/kernel/tracing 2>/dev/null; "
+        "T=/sys/kernel/tracing; [ -e $T/trace ] || T=/sys/kernel/debug/tracing; "
+        "echo 0 > $T/tracing_on; stty -F /dev/ttyS1 raw; "
+        "{ echo \"ROOT $M $(mountpoint -d $M)\"; cat $T/trace; echo === INODES ===; "
+        "find $M -xdev -printf \"%i %P\\n\"; echo === END ===; } > /dev/ttyS1'"
+    )
+
+
+def parse_dump(text: str) -> Tuple[str, List[str]]:
+    """Return the squashfs device and its file paths in first-read order"""
+    root_line = re.search(r"^ROOT (\S*) (\d+:\d+)", text, re.M)
+    if not root_line:
+        raise RuntimeError("Trace dump has no ROOT line, was the squashfs mounted?")
+    device = root_line.group(2)
+
+    trace, _, inode_part = text.partition("=== INODES ===")
+    inode_part = inode_part.partition("=== END ===")[0]
+    paths: Dict[int, str] = {}
+    for line in inode_part.splitlines():
+        inode, _, path = line.strip("\r").partition(" ")
+        if inode.isdigit() and path:
+            paths.setdefault(int(inode), path)
+
+    order: List[str] = []
+    seen = set()
+    for match in TRACE_EVENT.finditer(trace):
+        if match.group(1) != device:
+            continue
+        inode = int(match.group(2), 16)
+        if inode not in seen and inode in paths:
+            seen.add(inode)
+            order.append(paths[inode])
+    return device, order
+
+
+def write_sort_file(order: List[str], output: Path, prefix: str = "") -> int:
+    """Write a mksquashfs sort file, first read file with the highest priority"""
+    lines = []
+    for index, path in enumerate(order[:MAX_SORT_ENTRIES]):
+        if any(c.isspace() for c in path):
+            # The sort file format has no quoting
+            continue
+        lines.append(f"{prefix}{path} {MAX_PRIORITY - index}")
+    output.write_text("\n".join(lines) + "\n")
+    return len(lines)
+
+
+def configure_vm(vm: QemuVM, args) -> None:
+    """Apply the media throttling shared by trace and measure runs"""
+    if args.throttle_mbps:
+        vm.cdrom_throttle["bps-read"] = int(args.throttle_mbps * 1024 * 1024)
+    if args.iops:
+        vm.cdrom_throttle["iops-read"] = args.iops
+
+
+def boot_iso(iso: Path, args, work_dir: Path, extra_append: str = "",
+             dump_file: Optional[Path] = None) -> QemuVM:
+    """Boot an ISO's default entry on the serial console"""
+    vm = QemuVM(iso, memory=args.memory, smp=args.smp, accel=args.accel)
+    configure_vm(vm, args)
+    vm.use_boot_entry(work_dir, extra_append)
+    if dump_file:
+        vm.extra_args += ["-chardev", f"file,id=dump,path={dump_file}",
+                          "-device", "isa-serial,chardev=dump"]
+    vm.log_file = work_dir / "console.log"
+    vm.start()
+    return vm
+
+
+def trace(args) -> bool:
+    """Trace one boot and write the sort file"""
+    iso = Path(args.iso).resolve()
+    with tempfile.TemporaryDirectory(prefix="boot-trace-") as tmp:
+        work_dir = Path(tmp)
+        dump_file = work_dir / "dump.txt"
+        print_colored(f"Booting {iso.name} with page cache tracing...", Colors.YELLOW)
+        vm = boot_iso(iso, args, work_dir, TRACE_ARGS, dump_file)
+        try:
+            if not vm.wait_for(args.milestone, args.timeout):
+                print_colored(f"Milestone /{args.milestone}/ not reached in {args.timeout}s",
+                              Colors.RED)
+                return False
+            boot_seconds = vm.elapsed()
+            print_colored(f"Milestone reached after {boot_seconds:.1f}s", Colors.GREEN)
+
+            if not vm.login(args.user, args.password):
+                print_colored(f"Cannot log in as {args.user}", Colors.RED)
+                return False
+            sudo = "" if args.user == "root" else "sudo "
+            status = vm.run(sudo + get_dump_command(args.rootfs_mount), timeout=args.timeout)
+            if status != 0:
+                print_colored(f"Collecting the trace failed (status {status})", Colors.RED)
+                return False
+        finally:
+            vm.stop()
+
+        device, order = parse_dump(dump_file.read_text(errors="replace"))
+
+    output = Path(args.output)
+    count = write_sort_file(order, output, args.prefix)
+    print_colored(f"{count} files read from squashfs device {device} before the milestone",
+                  Colors.GREEN)
+    print_colored(f"Sort file written to {output}", Colors.GREEN)
+    if args.json:
+        Path(args.json).write_text(json.dumps({
+            "iso": str(iso), "boot_seconds": round(boot_seconds, 3),
+            "files": count, "device": device,
+        }, indent=2))
+    return True
+
+
+def measure(args) -> bool:
+    """Compare time to the milestone between ISOs"""
+    results = {}
+    for iso_name in args.isos:
+        iso = Path(iso_name).resolve()
+        times = []
+        for run in range(1, args.runs + 1):
+            with tempfile.TemporaryDirectory(prefix="boot-measure-") as tmp:
+                vm = boot_iso(iso, args, Path(tmp))
+                try:
+                    reached = vm.wait_for(args.milestone, args.timeout)
+                    seconds = vm.elapsed()
+                finally:
+                    vm.stop()
+            if not reached:
+                print_colored(f"{iso.name} run {run}: milestone not reached", Colors.RED)
+                return False
+            print_colored(f"{iso.name} run {run}: {seconds:.1f}s", Colors.YELLOW)
+            times.append(seconds)
+        results[iso.name] = statistics.median(times)
+
+    print_colored("\n=== Time to milestone (median) ===", Colors.BLUE)
+    baseline = next(iter(results.values()))
+    for name, seconds in results.items():
+        print(f"{name:<40} {seconds:>8.1f}s {baseline / seconds:>6.2f}x")
+    return True
+
+
+def main():
+    """Main function"""
+    parser = argparse.ArgumentParser(description="Record the boot read order of a live ISO")
+    parser.add_argument("--memory", default="2G", help="Guest memory (default: 2G)")
+    parser.add_argument("--smp", type=int, default=2, help="Guest CPUs (default: 2)")
+    parser.add_argument("--accel", default="auto", choices=["auto", "kvm", "tcg"],
+                        help="QEMU accelerator (default: kvm if available)")
+    parser.add_argument("--milestone", default=r"login:|HardClone",
+                        help="Console regex marking the end of boot (default: login:|HardClone)")
+    parser.add_argument("--timeout", type=float, default=900,
+                        help="Seconds to wait for the milestone (default: 900)")
+    parser.add_argument("--throttle-mbps", type=float, default=0,
+                        help="Limit ISO reads to this many MB/s, e.g. 20 for a USB 2.0 stick")
+    parser.add_argument("--iops", type=int, default=0,
+                        help="Limit ISO read requests per second to emulate seek cost")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    trace_parser = subparsers.add_parser("trace", help="Trace one boot and write a sort file")
+    trace_parser.add_argument("iso")
+    trace_parser.add_argument("-o", "--output", default="boot-order.sort",
+                              help="Sort file to write (default: boot-order.sort)")
+    trace_parser.add_argument("--user", default="user",
+                              help="Console login (default: user, Clonezilla live)")
+    trace_parser.add_argument("--password", default="live", help="Console password (default: live)")
+    trace_parser.add_argument("--rootfs-mount",
+                              help="Squashfs mount point in the guest (default: autodetect)")
+    trace_parser.add_argument("--prefix", default="",
+                              help="Prepend to every path, if mksquashfs needs it")
+    trace_parser.add_argument("--json", metavar="FILE", help="Also write a JSON summary")
+
+    measure_parser = subparsers.add_parser("measure", help="Compare boot time of ISOs")
+    measure_parser.add_argument("isos", nargs="+", help="ISOs, the first is the baseline")
+    measure_parser.add_argument("--runs", type=int, default=3,
+                                help="Boots per ISO, the median is reported (default: 3)")
+
+    args = parser.parse_args()
+    success = trace(args) if args.command == "trace" else measure(args)
+    sys.exit(0 if success else 1)
+
+
+if __name__ == "__main__":
+    main()
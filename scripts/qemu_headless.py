@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+"""
+qemu_headless.py - Run a live ISO in QEMU without a display, driven over the serial console
+"""
+
+import os
+import re
+import socket
+import subprocess
+import shutil
+import threading
+import time
+from pathlib import Path
+import logging
+from typing import List, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Bootloader configs searched for the default boot entry, in order
+BOOT_CONFIGS = [
+    "boot/grub/grub.cfg",
+    "isolinux/isolinux.cfg",
+    "syslinux/isolinux.cfg",
+    "syslinux/syslinux.cfg",
+    "boot/syslinux/archiso_sys-linux.cfg",
+]
+
+
+# OVMF builds as packaged by Debian/Ubuntu, Fedora and Arch: (code, vars template)
+OVMF_FIRMWARE = [
+    ("/usr/share/OVMF/OVMF_CODE_4M.fd", "/usr/share/OVMF/OVMF_VARS_4M.fd"),
+    ("/usr/share/OVMF/OVMF_CODE.fd", "/usr/share/OVMF/OVMF_VARS.fd"),
+    ("/usr/share/edk2/ovmf/OVMF_CODE.fd", "/usr/share/edk2/ovmf/OVMF_VARS.fd"),
+    ("/usr/share/edk2/x64/OVMF_CODE.4m.fd", "/usr/share/edk2/x64/OVMF_VARS.4m.fd"),
+    ("/usr/share/edk2-ovmf/x64/OVMF_CODE.fd", "/usr/share/edk2-ovmf/x64/OVMF_VARS.fd"),
+]
+
+# Console text kept for wait_for(); older output is dropped (the log file has it all)
+OUTPUT_LIMIT = 1024 * 1024
+LINES_LIMIT = 100000
+
+# Characters typed through the monitor's sendkey that are not plain keys (US layout)
+SENDKEY_NAMES = {
+    " ": "spc", "-": "minus", "_": "shift-minus", "=": "equal", "+": "shift-equal",
+    ",": "comma", ".": "dot", "/": "slash", ":": "shift-semicolon", ";": "semicolon",
+    "'": "apostrophe", '"': "shift-apostrophe", "\n": "ret", "\r": "ret", "\t": "tab",
+    "<": "shift-comma", ">": "shift-dot", "?": "shift-slash",
+    "[": "bracket_left", "]": "bracket_right", "{": "shift-bracket_left", "}": "shift-bracket_right",
+    "\\": "backslash", "|": "shift-backslash", "`": "grave_accent", "~": "shift-grave_accent",
+    "!": "shift-1", "@": "shift-2", "#": "shift-3", "$": "shift-4", "%": "shift-5",
+    "^": "shift-6", "&": "shift-7", "*": "shift-8", "(": "shift-9", ")": "shift-0",
+}
+
+
+def find_ovmf() -> Optional[Tuple[Path, Path]]:
+    """UEFI firmware code and variable store template, if installed"""
+    for code, variables in OVMF_FIRMWARE:
+        if Path(code).exists() and Path(variables).exists():
+            return Path(code), Path(variables)
+    return None
+
+
+def detect_accel() -> str:
+    """KVM when the host allows it, TCG otherwise"""
+    return "kvm" if os.access("/dev/kvm", os.R_OK | os.W_OK) else "tcg"
+
+
+def extract_from_iso(iso: Path, iso_path: str, dest: Path) -> bool:
+    """Extract one file from an ISO image without mounting it"""
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    result = subprocess.run(["xorriso", "-osirrox", "on", "-indev", str(iso),
+                             "-extract", f"/{iso_path.lstrip('/')}", str(dest)],
+                            capture_output=True)
+    return result.returncode == 0 and dest.exists()
+
+
+def parse_boot_config(text: str) -> Optional[Tuple[str, str, str]]:
+    """First (kernel, initrd, cmdline) entry of a GRUB or syslinux config"""
+    kernel = initrd = None
+    append = ""
+    for line in text.splitlines():
+        line = line.strip()
+        # GRUB: linux /path args... / initrd /path [/path...]
+        match = re.match(r"linux(?:efi)?\s+(\S+)\s*(.*)", line)
+        if match and kernel is None:
+            kernel, append = match.group(1), match.group(2)
+            continue
+        match = re.match(r"(?i)initrd(?:efi)?\s+(.+)", line)
+        if match and kernel and initrd is None:
+            # Microcode images come first, the real initramfs last
+            initrd = match.group(1).replace(",", " ").split()[-1]
+            continue
+        # syslinux: KERNEL/LINUX, APPEND, INITRD (or initrd= inside APPEND)
+        match = re.match(r"(?i)(?:kernel|linux)\s+(\S+)", line)
+        if match and kernel is None:
+            kernel = match.group(1)
+            continue
+        match = re.match(r"(?i)append\s+(.*)", line)
+        if match and kernel and not append:
+            append = match.group(1)
+            continue
+        if kernel and (append or initrd) and re.match(r"(?i)label\s", line):
+            break
+
+    if not kernel:
+        return None
+    args = []
+    for arg in append.split():
+        if arg.startswith("initrd="):
+            initrd = initrd or arg[len("initrd="):].split(",")[-1]
+        elif "$" not in arg:
+            # GRUB variables only make sense inside GRUB
+            args.append(arg)
+    if not initrd:
+        return None
+    return kernel, initrd, " ".join(args)
+
+
+def read_boot_entries(iso: Path, dest_dir: Path):
+    """Yield (config, (kernel, initrd, cmdline)) for each bootloader config on the ISO"""
+    for config in BOOT_CONFIGS:
+        config_file = dest_dir / "config" / config
+        if not extract_from_iso(iso, config, config_file):
+            continue
+        entry = parse_boot_config(config_file.read_text(errors="replace"))
+        if entry is not None:
+            yield config, entry
+
+
+def find_boot_entry(iso: Path, dest_dir: Path) -> Tuple[Path, Path, str]:
+    """Extract the default kernel and initramfs of an ISO for direct kernel boot"""
+    for config, (kernel_path, initrd_path, append) in read_boot_entries(iso, dest_dir):
+        kernel = dest_dir / "vmlinuz"
+        initrd = dest_dir / "initrd.img"
+        if extract_from_iso(iso, kernel_path, kernel) and extract_from_iso(iso, initrd_path, initrd):
+            logger.info(f"Boot entry from {config}: {kernel_path} {initrd_path}")
+            return kernel, initrd, append
+    raise RuntimeError(f"No usable boot entry found in {iso}")
+
+
+class QemuVM:
+    """A headless VM whose serial console can be waited on and typed into"""
+
+    def __init__(self, iso: Optional[Path] = None, memory: str = "2G", smp: int = 2,
+                 accel: str = "auto"):
+        self.iso = iso
+        self.memory = memory
+        self.smp = smp
+        self.accel = detect_accel() if accel == "auto" else accel
+        self.kernel: Optional[Path] = None   # Direct kernel boot instead of the bootloader
+        self.initrd: Optional[Path] = None
+        self.append = ""
+        self.cdrom_throttle: Dict[str, int] = {}  # QEMU throttling.* options of the ISO drive
+        self.extra_args: List[str] = []
+        self.log_file: Optional[Path] = None
+        self.firmware_log = False  # SeaBIOS debug output (port 0x402) in firmware_output and lines
+        self.uefi: Optional[Tuple[Path, Path]] = None  # OVMF code and this VM's own vars copy
+        self.disks: List[Path] = []  # qcow2 images attached as virtio disks, vda onwards
+        self.monitor_socket: Optional[Path] = None  # HMP monitor, needed for send_keys()
+        self.process: Optional[subprocess.Popen] = None
+        self.started = 0.0
+        self.output = ""
+        self.firmware_output = ""
+        self.lines: List[Tuple[float, str]] = []  # Console and firmware lines, seconds since start
+        self.cursor = 0
+        self.firmware_cursor = 0
+        self._firmware_pipe: Optional[Tuple[int, int]] = None
+        self._log = None
+        self._lock = threading.Lock()
+        self._readers: List[threading.Thread] = []
+
+    def get_command(self) -> List[str]:
+        """Build the qemu-system-x86_64 command line"""
+        cmd = [
+            "qemu-system-x86_64",
+            "-machine", f"accel={self.accel}",
+            "-cpu", "host" if self.accel == "kvm" else "max",
+            "-m", self.memory,
+            "-smp", str(self.smp),
+            "-display", "none",
+            "-monitor", f"unix:{self.monitor_socket},server=on,wait=off" if self.monitor_socket else "none",
+            "-chardev", "stdio,id=console,signal=off",
+            "-serial", "chardev:console",
+        ]
+        if self.firmware_log:
+            # Its own chardev: sharing the console's (mux=on) would move the
+            # mux focus to debugcon and send() would no longer reach ttyS0.
+            # The path is the write end of the pipe start() passes to QEMU.
+            cmd += ["-chardev", f"file,id=firmware,path=/dev/fd/{self._firmware_pipe[1]}",
+                    "-device", "isa-debugcon,iobase=0x402,chardev=firmware"]
+        if self.uefi:
+            code, variables = self.uefi
+            cmd += ["-drive", f"if=pflash,format=raw,readonly=on,file={code}",
+                    "-drive", f"if=pflash,format=raw,file={variables}"]
+        for disk in self.disks:
+            cmd += ["-drive", f"file={disk},if=virtio,format=qcow2"]
+        if self.iso:
+            drive = f"file={self.iso},media=cdrom,if=ide,readonly=on,format=raw"
+            drive += "".join(f",throttling.{key}={value}" for key, value in self.cdrom_throttle.items())
+            cmd += ["-drive", drive, "-boot", "d"]
+        if self.kernel:
+            cmd += ["-kernel", str(self.kernel), "-initrd", str(self.initrd),
+                    "-append", self.append]
+        return cmd + self.extra_args
+
+    def use_boot_entry(self, work_dir: Path, extra_append: str = "") -> None:
+        """Boot the ISO's default entry directly, with the kernel console on ttyS0"""
+        self.kernel, self.initrd, append = find_boot_entry(self.iso, work_dir)
+        self.append = " ".join(filter(None, [append, extra_append,
+                                             "console=tty0 console=ttyS0,115200"]))
+
+    def start(self) -> None:
+        """Start the VM and begin collecting console output"""
+        if not shutil.which("qemu-system-x86_64"):
+            raise RuntimeError("qemu-system-x86_64 is not installed")
+        if self.firmware_log:
+            self._firmware_pipe = os.pipe()
+        cmd = self.get_command()
+        logger.debug(f"Running: {' '.join(cmd)}")
+        self._log = open(self.log_file, "w") if self.log_file else None
+        self.started = time.monotonic()
+        try:
+            self.process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                            stderr=subprocess.STDOUT,
+                                            pass_fds=self._firmware_pipe[1:] if self._firmware_pipe else ())
+        finally:
+            if self._firmware_pipe:
+                os.close(self._firmware_pipe[1])
+        streams = [(self.process.stdout.fileno(), False)]
+        if self._firmware_pipe:
+            streams.append((self._firmware_pipe[0], True))
+        for fd, firmware in streams:
+            reader = threading.Thread(target=self._read_console, args=(fd, firmware), daemon=True)
+            reader.start()
+            self._readers.append(reader)
+
+    def _read_console(self, fd: int, firmware: bool = False) -> None:
+        partial = ""
+        while True:
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                break
+            text = chunk.decode(errors="replace").replace("\r", "")
+            with self._lock:
+                now = time.monotonic() - self.started
+                if self._log:
+                    self._log.write(text)
+                    self._log.flush()
+                if firmware:
+                    self.firmware_output += text
+                else:
+                    self.output += text
+                partial += text
+                *complete, partial = partial.split("\n")
+                if complete and self.lines and self.lines[-1][0] > now:
+                    # Lines of the other stream timestamped after reading this chunk
+                    self.lines += [(now, line) for line in complete]
+                    self.lines.sort(key=lambda entry: entry[0])
+                else:
+                    self.lines += [(now, line) for line in complete]
+                self._trim_output()
+
+    def _trim_output(self) -> None:
+        """Drop the oldest console output once it exceeds the limits (lock held)"""
+        if len(self.output) > 2 * OUTPUT_LIMIT:
+            dropped = len(self.output) - OUTPUT_LIMIT
+            self.output = self.output[dropped:]
+            self.cursor = max(0, self.cursor - dropped)
+        if len(self.firmware_output) > 2 * OUTPUT_LIMIT:
+            dropped = len(self.firmware_output) - OUTPUT_LIMIT
+            self.firmware_output = self.firmware_output[dropped:]
+            self.firmware_cursor = max(0, self.firmware_cursor - dropped)
+        if len(self.lines) > 2 * LINES_LIMIT:
+            del self.lines[:-LINES_LIMIT]
+
+    def elapsed(self) -> float:
+        """Seconds since the VM was started"""
+        return time.monotonic() - self.started
+
+    def wait_for(self, pattern: str, timeout: float, firmware: bool = False) -> Optional[re.Match]:
+        """Wait until pattern appears in console (or firmware) output after the cursor"""
+        regex = re.compile(pattern)
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._lock:
+                if firmware:
+                    match = regex.search(self.firmware_output, self.firmware_cursor)
+                    if match:
+                        self.firmware_cursor = match.end()
+                else:
+                    match = regex.search(self.output, self.cursor)
+                    if match:
+                        self.cursor = match.end()
+            if match:
+                return match
+            if self.process.poll() is not None:
+                return None
+            time.sleep(0.05)
+        return None
+
+    def send(self, text: str) -> None:
+        """Type text on the serial console"""
+        self.process.stdin.write(text.encode())
+        self.process.stdin.flush()
+
+    def send_keys(self, text: str, delay: float = 0.05) -> None:
+        """Type text on the emulated keyboard (reaches bootloaders that ignore serial)"""
+        keys = []
+        for char in text:
+            if char in SENDKEY_NAMES:
+                keys.append(SENDKEY_NAMES[char])
+            elif char.isascii() and char.isalnum():
+                keys.append(f"shift-{char.lower()}" if char.isupper() else char)
+            else:
+                # Checked before typing anything, a half-typed line is worse
+                raise ValueError(f"No sendkey mapping for {char!r}")
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as monitor:
+            monitor.connect(str(self.monitor_socket))
+            for key in keys:
+                monitor.sendall(f"sendkey {key}\n".encode())
+                time.sleep(delay)
+
+    def login(self, user: str, password: str = "", timeout: float = 60) -> bool:
+        """Log in on a getty prompt and wait for a shell"""
+        with self._lock:
+            at_prompt = re.search(r"login: ?$", self.output)
+        if not at_prompt:
+            # An empty line makes getty print its prompt again
+            self.send("\r")
+            if not self.wait_for(r"(?m)login: ?$", timeout):
+                return False
+        self.send(user + "\r")
+        if password and self.wait_for(r"[Pp]assword: ?", 15):
+            self.send(password + "\r")
+        return self.wait_for(r"(?m)[$#] ?$", timeout) is not None
+
+    def run(self, command: str, timeout: float = 600) -> Optional[int]:
+        """Run a shell command on the console, return its exit status"""
+        # The split marker keeps the echoed command line from matching
+        self.send(f"{command}; echo __DON\"\"E_$?__\r")
+        match = self.wait_for(r"__DONE_(\d+)__", timeout)
+        return int(match.group(1)) if match else None
+
+    def stop(self) -> None:
+        """Power the VM off"""
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        for reader in self._readers:
+            reader.join(timeout=5)
+        self._readers = []
+        if self._firmware_pipe:
+            os.close(self._firmware_pipe[0])
+            self._firmware_pipe = None
+        if self._log:
+            self._log.close()
+            self._log = None
+
+    def __enter__(self) -> "QemuVM":
+        self.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+smoke_matrix.py - Boot every ISO in BIOS and UEFI mode in parallel and run an imaging round-trip
+
+Each job boots one ISO through its own bootloader (SeaBIOS + isolinux, or
+OVMF + GRUB), gets the kernel console onto serial by editing the boot
+entry with monitor keystrokes, logs in and images a target disk to a
+scratch disk, wipes it and restores it. Target disks are qcow2 overlays on
+one shared, read-only backing image, so no job copies the disk and the
+host can check the restore with qemu-img compare against the backing file.
+
+    smoke_matrix.py hardclone-live.iso other-live.iso@root:toor --jobs 4
+"""
+
+import os
+import sys
+import shutil
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+import json
+import logging
+from typing import List, Dict, Optional, Tuple
+import argparse
+
+from qemu_headless import QemuVM, find_ovmf, read_boot_entries
+
+# Setup logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+class Colors:
+    RED = '\033[0;31m'
+    GREEN = '\033[0;32m'
+    YELLOW = '\033[1;33m'
+    BLUE = '\033[0;34m'
+    NC = '\033[0m'  # No Color
+
+MODES = ["bios", "uefi"]
+SERIAL_CONSOLE = "console=tty0 console=ttyS0,115200"
+
+# Firmware lines printed right before the bootloader takes over
+BOOTLOADER_HANDOFF = {
+    "bios": r"Booting from DVD/CD",
+    "uefi": r"BdsDxe: (loading|starting) Boot",
+}
+
+# Image the target disk (vda) into a file on the scratch disk (vdb), wipe
+# the start of the target, restore it and compare checksums
+ROUNDTRIP_COMMAND = (
+    "set -e; T=/dev/vda; S=/dev/vdb; A=$(sha256sum $T | cut -c1-64); "
+    "mkfs.ext4 -q -F $S; mkdir -p /mnt/smoke; mount $S /mnt/smoke; "
+    "dd if=$T bs=1M status=none | gzip -1 > /mnt/smoke/target.img.gz; "
+    "dd if=/dev/zero of=$T bs=1M count=64 status=none; "
+    "gzip -dc /mnt/smoke/target.img.gz | dd of=$T bs=1M status=none; sync; "
+    "umount /mnt/smoke; B=$(sha256sum $T | cut -c1-64); echo \"roundtrip $A $B\"; [ \"$A\" = \"$B\" ]"
+)
+
+
+def print_colored(message: str, color: str = Colors.NC) -> None:
+    """Print colored message"""
+    print(f"{color}{message}{Colors.NC}", flush=True)
+
+
+def parse_iso_spec(spec: str, user: str, password: str) -> Tuple[Path, str, str]:
+    """ISO[@user:password] -> (iso, user, password)"""
+    path, _, login = spec.partition("@")
+    if login:
+        user, _, password = login.partition(":")
+    return Path(path).resolve(), user, password
+
+
+class SmokeMatrix:
+    def __init__(self, out_dir: Path, jobs: int, disk_size: str = "256M"):
+        self.out_dir = out_dir
+        self.jobs = jobs
+        self.disk_size = disk_size
+        self.base_disk = out_dir / "target-base.qcow2"
+        self.memory = "2G"
+        self.smp = 2
+        self.accel = "auto"
+        self.timeout = 900.0
+        self.bootloader_delay = 4.0  # Seconds for the bootloader menu to come up
+        self.roundtrip_command = ROUNDTRIP_COMMAND
+        self.ovmf = find_ovmf()
+
+    def create_base_disk(self) -> None:
+        """Shared backing disk with recognisable data at known offsets"""
+        self.base_disk.unlink(missing_ok=True)
+        subprocess.run(["qemu-img", "create", "-q", "-f", "qcow2", str(self.base_disk),
+                        self.disk_size], check=True)
+        subprocess.run(["qemu-io", "-f", "qcow2",
+                        "-c", "write -q -P 0x5a 0 32M",
+                        "-c", "write -q -P 0xc3 96M 16M",
+                        str(self.base_disk)], check=True)
+        # Overlays must never write through to the backing file
+        self.base_disk.chmod(0o444)
+
+    def create_overlay(self, path: Path, backing: Optional[Path] = None) -> Path:
+        """Copy-on-write overlay of the base disk, or an empty scratch disk"""
+        cmd = ["qemu-img", "create", "-q", "-f", "qcow2"]
+        if backing:
+            cmd += ["-b", str(backing), "-F", "qcow2", str(path)]
+        else:
+            cmd += [str(path), self.disk_size]
+        subprocess.run(cmd, check=True)
+        return path
+
+    def type_boot_entry(self, vm: QemuVM, mode: str, entry: Optional[Tuple[str, str, str]]) -> None:
+        """Make the bootloader start the kernel with its console on serial"""
+        if mode == "bios":
+            # isolinux: Tab opens the default entry's command line for editing
+            vm.send_keys("\t")
+            time.sleep(0.5)
+            vm.send_keys(f" {SERIAL_CONSOLE}\n")
+        else:
+            # GRUB: type the entry on its command line
+            kernel, initrd, append = entry
+            vm.send_keys("c")
+            time.sleep(0.5)
+            vm.send_keys(f"linux {kernel} {append} {SERIAL_CONSOLE}\n")
+            vm.send_keys(f"initrd {initrd}\n")
+            vm.send_keys("boot\n")
+
+    def run_job(self, name: str, iso: Path, mode: str, user: str, password: str) -> Dict:
+        """Boot one ISO in one firmware mode and run the round-trip"""
+        job_dir = self.out_dir / name
+        shutil.rmtree(job_dir, ignore_errors=True)
+        job_dir.mkdir(parents=True)
+        result = {"name": name, "iso": iso.name, "mode": mode, "status": "fail", "stage": "setup"}
+        started = time.monotonic()
+
+        vm = QemuVM(iso, memory=self.memory, smp=self.smp, accel=self.accel)
+        vm.log_file = job_dir / "console.log"
+        vm.monitor_socket = Path(tempfile.mkdtemp(prefix="smoke-")) / "monitor.sock"
+        vm.disks = [self.create_overlay(job_dir / "target.qcow2", self.base_disk),
+                    self.create_overlay(job_dir / "scratch.qcow2")]
+        if mode == "uefi":
+            code, vars_template = self.ovmf
+            shutil.copy(vars_template, job_dir / "OVMF_VARS.fd")
+            vm.uefi = (code, job_dir / "OVMF_VARS.fd")
+        else:
+            vm.firmware_log = True
+
+        try:
+            entry = None
+            if mode == "uefi":
+                # The GRUB entry, with the paths as they are on the ISO
+                entry = next((entry for config, entry in read_boot_entries(iso, job_dir / "boot")
+                              if config.startswith("boot/grub")), None)
+                if entry is None:
+                    result["error"] = "no GRUB boot entry on the ISO"
+                    return result
+
+            vm.start()
+            result["stage"] = "firmware"
+            if not vm.wait_for(BOOTLOADER_HANDOFF[mode], 120, firmware=vm.firmware_log):
+                # Not every firmware build says so on serial, carry on regardless
+                logger.debug(f"{name}: no firmware hand-off message")
+            time.sleep(self.bootloader_delay)
+            self.type_boot_entry(vm, mode, entry)
+
+            result["stage"] = "boot"
+            if not vm.wait_for(r"(?m)login: ?$", self.timeout):
+                return result
+            result["boot_seconds"] = round(vm.elapsed(), 1)
+
+            result["stage"] = "login"
+            if not vm.login(user, password):
+                return result
+
+            result["stage"] = "roundtrip"
+            sudo = "" if user == "root" else "sudo "
+            command = self.roundtrip_command.replace("'", "'\\''")
+            if vm.run(f"{sudo}sh -c '{command}'", timeout=self.timeout) != 0:
+                return result
+        except Exception as e:
+            result["error"] = str(e)
+            return result
+        finally:
+            vm.stop()
+            shutil.rmtree(vm.monitor_socket.parent, ignore_errors=True)
+            result["seconds"] = round(time.monotonic() - started, 1)
+
+        # The restored overlay must read exactly like the backing disk
+        result["stage"] = "compare"
+        compare = subprocess.run(["qemu-img", "compare", "-q", str(self.base_disk),
+                                  str(job_dir / "target.qcow2")])
+        if compare.returncode == 0:
+            result["status"] = "pass"
+            result["stage"] = "done"
+        return result
+
+    def run(self, isos: List[Tuple[Path, str, str]], modes: List[str]) -> List[Dict]:
+        """Run all jobs on a worker pool"""
+        if "uefi" in modes and not self.ovmf:
+            print_colored("OVMF not found, skipping UEFI jobs (install ovmf / edk2-ovmf)",
+                          Colors.YELLOW)
+            modes = [mode for mode in modes if mode != "uefi"]
+
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        self.create_base_disk()
+        jobs = []
+        for index, (iso, user, password) in enumerate(isos):
+            # ISOs from different directories may share a file name
+            stem = iso.stem if [i[0].stem for i in isos].count(iso.stem) == 1 else f"{iso.stem}-{index}"
+            jobs += [(f"{stem}-{mode}", iso, mode, user, password) for mode in modes]
+        print_colored(f"Running {len(jobs)} jobs, {self.jobs} at a time", Colors.GREEN)
+
+        results = []
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            futures = {pool.submit(self.run_job, *job): job for job in jobs}
+            for future in as_completed(futures):
+                result = future.result()
+                color = Colors.GREEN if result["status"] == "pass" else Colors.RED
+                print_colored(f"{result['name']}: {result['status']} "
+                              f"({result['stage']}, {result.get('seconds', 0)}s)", color)
+                results.append(result)
+        return sorted(results, key=lambda r: r["name"])
+
+
+def default_jobs(smp: int, memory_gb: float) -> int:
+    """Parallel VMs the host has cores and memory for"""
+    cores = max(1, (os.cpu_count() or 1) // smp)
+    memory = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / (1024 ** 3)
+    return max(1, min(cores, int(memory // (memory_gb + 0.5))))
+
+
+def main():
+    """Main function"""
+    parser = argparse.ArgumentParser(description="Parallel BIOS/UEFI boot and imaging smoke test")
+    parser.add_argument("isos", nargs="+", metavar="ISO[@USER:PASSWORD]",
+                        help="ISOs to test, with their console login if not the default")
+    parser.add_argument("--modes", default="bios,uefi", help="Firmware modes (default: bios,uefi)")
+    parser.add_argument("--jobs", type=int, default=0,
+                        help="Parallel VMs (default: host cores / --smp, bounded by memory)")
+    parser.add_argument("--user", default="user", help="Default console login (default: user)")
+    parser.add_argument("--password", default="live", help="Default console password (default: live)")
+    parser.add_argument("--memory", type=float, default=2, help="Guest memory in GB (default: 2)")
+    parser.add_argument("--smp", type=int, default=2, help="Guest CPUs (default: 2)")
+    parser.add_argument("--accel", default="auto", choices=["auto", "kvm", "tcg"],
+                        help="QEMU accelerator (default: kvm if available)")
+    parser.add_argument("--timeout", type=float, default=900,
+                        help="Seconds allowed for boot and for the round-trip (default: 900)")
+    parser.add_argument("--disk-size", default="256M", help="Target disk size (default: 256M)")
+    parser.add_argument("--out-dir", default="smoke-results",
+                        help="Console logs, disks and results.json (default: smoke-results)")
+
+    args = parser.parse_args()
+
+    matrix = SmokeMatrix(Path(args.out_dir).resolve(),
+                         args.jobs or default_jobs(args.smp, args.memory), args.disk_size)
+    matrix.memory = f"{args.memory:g}G"
+    matrix.smp = args.smp
+    matrix.accel = args.accel
+    matrix.timeout = args.timeout
+
+    isos = [parse_iso_spec(spec, args.user, args.password) for spec in args.isos]
+    started = datetime.now()
+    results = matrix.run(isos, [mode for mode in args.modes.split(",") if mode in MODES])
+
+    report = {"started": started.isoformat(timespec="seconds"), "results": results}
+    (matrix.out_dir / "results.json").write_text(json.dumps(report, indent=2))
+
+    print_colored("\n=== Smoke matrix ===", Colors.BLUE)
+    print(f"{'Job':<40} {'Mode':<5} {'Result':<7} {'Boot (s)':>9} {'Total (s)':>10}")
+    for r in results:
+        print(f"{r['name']:<40} {r['mode']:<5} {r['status']:<7} {r.get('boot_seconds', '-'):>9} "
+              f"{r.get('seconds', '-'):>10}")
+    failed = [r for r in results if r["status"] != "pass"]
+    print_colored(f"{len(results) - len(failed)}/{len(results)} passed, logs in {matrix.out_dir}",
+                  Colors.GREEN if not failed else Colors.RED)
+    sys.exit(0 if results and not failed else 1)
+
+
+if __name__ == "__main__":
+    main()